@@ -0,0 +1,643 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Executor, Future
+import numpy as np
+from spherov2.types import Color
+from Sphero_Metrics import LatencyHistogram
+from Sphero_StateMachine import SpheroStateMachine, STATES
+
+
+class _Periodic:
+    """call_every handle on an asyncio loop, re-armed from its deadline"""
+
+    def __init__(self, events, interval, event, data):
+        self.events = events
+        self.interval = interval
+        self.event = event
+        self.data = data
+        self.deadline = events.loop.time() + interval
+        self.handle = events.loop.call_at(self.deadline, self._fire)
+
+    def _fire(self):
+        now = self.events.loop.time()
+        self.events._timer_fired(self.deadline, now, self.event, self.data)
+        self.deadline += self.interval
+        if self.deadline <= now:
+            self.deadline = now + self.interval
+        self.handle = self.events.loop.call_at(self.deadline, self._fire)
+
+    def cancel(self):
+        self.handle.cancel()
+
+
+class AsyncEventLoop:
+    """EventLoop's interface (post / call_later / call_every / run) on asyncio
+
+    post() is safe from any thread; timers must be set from the loop thread
+    (state handlers and event handlers run there).
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.queue = None
+        self.is_running = True
+        self._thread_id = None
+
+        self.started = time.monotonic()
+        self.wakeups = 0
+        self.dispatched = 0
+        self.timers_fired = 0
+        self.reaction = LatencyHistogram()
+        self.timer_lateness = LatencyHistogram()
+
+    def bind(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self._thread_id = threading.get_ident()
+
+    def post(self, event, data=None):
+        item = (event, data, time.monotonic())
+        if self.loop is None:
+            return
+        if threading.get_ident() == self._thread_id:
+            self.queue.put_nowait(item)
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        except RuntimeError:
+            # loop already closed (shutdown)
+            pass
+
+    def call_later(self, delay, event, data=None):
+        deadline = self.loop.time() + delay
+        return self.loop.call_at(deadline, lambda: self._timer_fired(deadline, self.loop.time(), event, data))
+
+    def call_every(self, interval, event, data=None):
+        return _Periodic(self, interval, event, data)
+
+    def _timer_fired(self, deadline, now, event, data):
+        self.timer_lateness.observe(max(0.0, now - deadline))
+        self.timers_fired += 1
+        self.queue.put_nowait((event, data, time.monotonic()))
+
+    async def run(self, handler):
+        while self.is_running:
+            event, data, posted = await self.queue.get()
+            self.wakeups += 1
+            if event is None:
+                continue
+            self.reaction.observe(time.monotonic() - posted)
+            self.dispatched += 1
+            handler(event, data)
+
+    def stop(self):
+        self.is_running = False
+        # wake run() so it sees the flag
+        self.post(None)
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return {
+            'wakeups': self.wakeups,
+            'wakeups_per_second': self.wakeups / elapsed,
+            'dispatched': self.dispatched,
+            'timers_fired': self.timers_fired,
+            'reaction': self.reaction.summary(),
+            'timer_lateness': self.timer_lateness.summary()
+        }
+
+
+class _WorkerTimer:
+    """BLEWorker.every handle, re-armed from its deadline"""
+
+    def __init__(self, worker, interval, func):
+        self.worker = worker
+        self.interval = interval
+        self.func = func
+        self.cancelled = False
+        self.deadline = time.monotonic() + interval
+        self.future = worker.submit_at(self.deadline, self._fire)
+
+    def _fire(self):
+        if self.cancelled:
+            return
+        try:
+            self.func()
+        except Exception as e:
+            print(f"BLE timer error: {e}")
+        now = time.monotonic()
+        self.deadline += self.interval
+        if self.deadline <= now:
+            self.deadline = now + self.interval
+        if not self.cancelled:
+            try:
+                self.future = self.worker.submit_at(self.deadline, self._fire)
+            except RuntimeError:
+                # worker shut down
+                pass
+
+    def cancel(self):
+        self.cancelled = True
+        self.future.cancel()
+
+
+class BLEWorker(Executor):
+    """The one thread that talks to the robot, in submission order
+
+    An Executor, so coroutines await api calls through run_in_executor().
+    Jobs can also be queued for a time.monotonic() deadline (LED fade steps,
+    spin steps, IMU ticks); the worker runs those on time by itself without
+    waking the event loop.
+    """
+
+    def __init__(self, name="ble"):
+        self._cond = threading.Condition()
+        # (deadline, seq, future, func, args, kwargs)
+        self._jobs = []
+        self._seq = itertools.count()
+        self._shutdown = False
+
+        self.wakeups = 0
+        self.jobs_run = 0
+        self.lateness = LatencyHistogram()
+
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        return self.submit_at(None, fn, *args, **kwargs)
+
+    def submit_at(self, deadline, fn, *args, **kwargs):
+        """run fn at deadline (time.monotonic(); None: now), returns a Future"""
+        future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("BLE worker is shut down")
+            entry = (time.monotonic() if deadline is None else deadline, next(self._seq),
+                     future, fn, args, kwargs)
+            heapq.heappush(self._jobs, entry)
+            # only a new earliest job changes how long the worker sleeps
+            if self._jobs[0] is entry:
+                self._cond.notify()
+        return future
+
+    def every(self, interval, fn):
+        """fn() every interval on the worker; returns a handle with cancel()"""
+        return _WorkerTimer(self, interval, fn)
+
+    def _next_due(self):
+        """lock held: wait for the first job, then pop every job that is due"""
+        while True:
+            while self._jobs and self._jobs[0][2].cancelled():
+                heapq.heappop(self._jobs)
+            if not self._jobs:
+                if self._shutdown:
+                    return None
+                self._cond.wait()
+                continue
+            delay = self._jobs[0][0] - time.monotonic()
+            if delay > 0:
+                self._cond.wait(delay)
+                continue
+            now = time.monotonic()
+            due = []
+            while self._jobs and self._jobs[0][0] <= now:
+                due.append(heapq.heappop(self._jobs))
+            return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                due = self._next_due()
+            if due is None:
+                return
+            self.wakeups += 1
+            for deadline, _, future, fn, args, kwargs in due:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.lateness.observe(max(0.0, time.monotonic() - deadline))
+                self.jobs_run += 1
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._cond:
+            self._shutdown = True
+            if cancel_futures:
+                for job in self._jobs:
+                    job[2].cancel()
+            self._cond.notify()
+        if wait and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def stats(self):
+        return {
+            'wakeups': self.wakeups,
+            'jobs': self.jobs_run,
+            'lateness': self.lateness.summary()
+        }
+
+
+class AsyncSpheroStateMachine(SpheroStateMachine):
+    """Same table and events, run as coroutines on one asyncio loop
+
+    Behaviours and timeouts are tasks/timers on the loop. Every api call -
+    behaviours, collision reactions, IMU samples, the shake poll and
+    cleanup - runs on one BLEWorker thread, which also keeps commands to
+    the robot in order. LED fades and spins are queued a cycle at a time
+    with their deadlines, so the loop wakes per cycle, not per step; IMU
+    sampling and checkpoints need no threads of their own.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.events = AsyncEventLoop()
+        self.ble = BLEWorker()
+        self.loop = None
+        self.checkpoint_interval = 10.0
+
+        self._task = None
+        self._stopping = None
+        self._imu_timer = None
+        self._checkpoint_timer = None
+        self._checkpointed = None
+
+        for state in STATES:
+            self.engine.on_enter(state, self._enter)
+            self.engine.on_exit(state, self._exit)
+
+    # robot I/O -------------------------------------------------------
+    async def call(self, name, *args):
+        """api.<name>(*args) on the BLE thread"""
+        return await self.loop.run_in_executor(self.ble, lambda: getattr(self.api, name)(*args))
+
+    async def blocking(self, func, *args):
+        return await self.loop.run_in_executor(self.ble, lambda: func(*args))
+
+    def send(self, func, *args):
+        """queue func(*args) on the BLE thread without waiting (order is kept)"""
+        self.ble.submit(func, *args).add_done_callback(self._report)
+
+    @staticmethod
+    def _report(future):
+        if not future.cancelled() and future.exception():
+            print(f"BLE error: {future.exception()}")
+
+    async def run_queued(self, futures):
+        """wait for jobs queued on the BLE thread; cancelled with them"""
+        try:
+            await asyncio.wrap_future(futures[-1])
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _set_leds(self, color):
+        # front + back in one trip to the BLE thread
+        self.api.set_front_led(color)
+        self.api.set_back_led(color)
+
+    def _led_step(self, color, deadline, step):
+        # BLE fell behind: skip the level rather than burst
+        if time.monotonic() - deadline < step:
+            self._set_leds(color)
+
+    def _start_move(self, heading, speed):
+        self.last_speed = speed
+        self.api.set_heading(heading)
+        self.api.set_speed(speed)
+
+    def _stop_move(self):
+        self.last_speed = 0
+        self.api.set_speed(0)
+
+    # state behaviour -------------------------------------------------
+    def _enter(self, state):
+        if not self.api:
+            return
+        if state == "PATROL":
+            self.collision_count = 0
+            self._last_patrol = None
+        self._task = self.loop.create_task(self._run_state(state, self._stopping))
+
+    def _exit(self, state):
+        task, self._task = self._task, None
+        if task:
+            task.cancel()
+        self._stopping = self.loop.create_task(self._halt(task, state))
+        if state == "PATROL":
+            self.end_patrol_episode()
+
+    async def _halt(self, task, state):
+        # bounded wait for the cancelled behaviour, then stop the robot
+        if task:
+            await asyncio.wait({task}, timeout=self.behaviour.stop_timeout)
+        if self.api and state in ("PATROL", "ANGRY"):
+            await self.blocking(self._stop_move)
+
+    async def _run_state(self, state, previous):
+        if previous:
+            await previous
+        try:
+            if state == "PATROL":
+                await self.blocking(self.patterns.show_expression, self.api, "wave")
+                await self._patrol()
+            elif state == "SLEEP":
+                await self.blocking(self.patterns.show_expression, self.api, "sleep")
+                await self._breathing((255, 255, 255), 1.0)
+            elif state == "ANGRY":
+                await self.blocking(self.patterns.show_expression, self.api, "angry")
+                await self._angry()
+            elif state == "INTERACT":
+                self.send(self.api.set_speed, 0)
+                await self.blocking(self.patterns.show_expression, self.api, "ishmael")
+            elif state == "SATISFIED":
+                self.send(self.api.set_speed, 0)
+                await self.blocking(self.patterns.show_expression, self.api, "satisfied")
+                await self._breathing((220, 80, 0), 0.8)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Behaviour error ({state}): {e}")
+
+    async def _patrol(self):
+        while self.is_running and not self.should_stop:
+            heading, speed = self.choose_patrol_action()
+            self.send(self._start_move, heading, speed)
+            await asyncio.sleep(2.0)
+            self.send(self._stop_move)
+            await asyncio.sleep(2.5)
+
+    async def _angry(self, steps=20):
+        while self.is_running and not self.should_stop:
+            start = await self.call("get_heading") or 0
+            # the whole spin queued with its deadlines, one loop wakeup
+            now = time.monotonic()
+            await self.run_queued([
+                self.ble.submit_at(now + 2 * step / steps, self.api.set_heading,
+                                   int(start + 360 * step / steps) % 360)
+                for step in range(1, steps + 1)
+            ])
+            await asyncio.sleep(0.5)
+
+    async def _breathing(self, color, duration):
+        levels = list(range(0, 255, 10)) + list(range(255, 0, -10))
+        step = duration / 50
+        deadline = time.monotonic()
+        while True:
+            # one fade cycle queued with its deadlines, one loop wakeup
+            queued = []
+            for brightness in levels:
+                led_color = Color(
+                    int(color[0] * brightness / 255),
+                    int(color[1] * brightness / 255),
+                    int(color[2] * brightness / 255)
+                )
+                deadline += step
+                queued.append(self.ble.submit_at(deadline, self._led_step, led_color, deadline, step))
+            await self.run_queued(queued)
+            deadline = max(deadline, time.monotonic())
+
+    # sensors ---------------------------------------------------------
+    def start_imu(self):
+        """no sampler thread: ticks run on the BLE worker while a state reads channels"""
+        self.imu.started = time.monotonic()
+
+    def _arm_state_timers(self, state):
+        super()._arm_state_timers(state)
+        if not self.imu:
+            return
+        if self.imu.active and self._imu_timer is None:
+            self._imu_timer = self.ble.every(1.0 / self.imu.rate_hz, self.imu.sample_once)
+        elif not self.imu.active and self._imu_timer:
+            self._imu_timer.cancel()
+            self._imu_timer = None
+
+    def start_sensor_poll(self):
+        """shake check on the BLE worker: the loop only hears about a shake"""
+        return self.ble.every(self.sensor_interval, self._poll_shake)
+
+    def _poll_shake(self):
+        if self.detect_shake():
+            self.events.post("shake")
+
+    def _on_firmware_collision(self, collision_data):
+        # spherov2's thread: stamp the arrival, react on the loop
+        self.events.post("firmware_collision", (time.time(), collision_data))
+
+    def _collision_stop(self):
+        self.send(super()._collision_stop)
+
+    # learned state ---------------------------------------------------
+    def start_checkpoints(self):
+        """no checkpoint thread: a loop timer, armed in serve()"""
+
+    def end_patrol_episode(self):
+        super().end_patrol_episode()
+        self.events.post("checkpoint")
+
+    def _checkpoint(self):
+        """snapshot where the table is updated, write on the BLE thread"""
+        q_table, counters, history = self.learned_snapshot()
+        if not self.store or counters == self._checkpointed:
+            return
+        self._checkpointed = dict(counters)
+        self.send(self.store.checkpoint, np.array(q_table), counters, history)
+
+    # events ----------------------------------------------------------
+    def handle_event(self, event, data=None):
+        if event == "firmware_collision":
+            arrived, collision_data = data
+            if self.soft_collision:
+                self.soft_collision.firmware_event(arrived)
+            self.on_collision_detected(collision_data)
+        elif event == "collision_flash_done":
+            self.send(self.api.set_main_led, Color(255, 255, 255))
+        elif event == "checkpoint":
+            self._checkpoint()
+        else:
+            super().handle_event(event, data)
+
+    def stop(self):
+        self.should_stop = True
+        self.is_running = False
+        self.events.stop()
+
+    def serve(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.events.bind(self.loop)
+        if self.store:
+            self._checkpoint_timer = self.events.call_every(self.checkpoint_interval, "checkpoint")
+        self.start_state_behavior()
+        self._arm_state_timers(self.current_state)
+        try:
+            await self.events.run(self.handle_event)
+        finally:
+            if self._checkpoint_timer:
+                self._checkpoint_timer.cancel()
+            if self._task:
+                self._task.cancel()
+                await asyncio.wait({self._task}, timeout=self.behaviour.stop_timeout)
+            if self.current_state == "PATROL":
+                # no loop left for the checkpoint event: cleanup writes it
+                SpheroStateMachine.end_patrol_episode(self)
+
+    def stop_current_state_behavior(self):
+        """cleanup runs after the loop: the behaviour task is gone already"""
+        if self.api:
+            self.api.set_speed(0)
+
+    def cleanup(self):
+        """cleanup on the BLE thread after its timers, last checkpoint first"""
+        if self.cleaned_up:
+            return
+        for timer in (self._imu_timer, self._sensor_timer):
+            if timer:
+                timer.cancel()
+        self._imu_timer = self._sensor_timer = None
+        if self.store:
+            q_table, counters, history = self.learned_snapshot()
+            self.ble.submit(self.store.checkpoint, np.array(q_table), counters, history)
+        self.ble.submit(super().cleanup).result()
+        self.ble.shutdown(cancel_futures=True)
+
+
+def benchmark(machine_cls, script, command_latency=0.005):
+    """Run a scripted session on the simulator, returns threads/switches/jitter"""
+    import os
+    import resource
+    import tempfile
+
+    class SimApi:
+        """a robot on one BLE link: every call is a round trip, one at a time"""
+
+        def __init__(self):
+            self.link = threading.Lock()
+            self.commands = 0
+            self.led_times = []
+
+        def _command(self, value=None):
+            with self.link:
+                self.commands += 1
+                time.sleep(command_latency)
+            return value
+
+        def __getattr__(self, name):
+            return lambda *args, **kwargs: self._command()
+
+        def get_heading(self):
+            return self._command(0)
+
+        def get_orientation(self):
+            return self._command({'pitch': 0.0, 'roll': 0.0, 'yaw': 0.0})
+
+        def get_acceleration(self):
+            return self._command({'x': 0.0, 'y': 0.0, 'z': 1.0})
+
+        def get_gyroscope(self):
+            return self._command({'x': 0.0, 'y': 0.0, 'z': 0.0})
+
+        def get_velocity(self):
+            return self._command({'x': 0.0, 'y': 0.0})
+
+        def set_front_led(self, color):
+            # breathing steps while asleep (nominal 20 ms)
+            if machine.current_state == "SLEEP":
+                self.led_times.append(time.perf_counter())
+            self._command()
+
+    class SilentVoice:
+        def register_phrase(self, *args): pass
+        def start_listening(self, callback=None): pass
+        def stop_listening(self): pass
+
+    machine = machine_cls()
+    machine.api = SimApi()
+    machine.voice = SilentVoice()
+    machine.patterns.show_expression = lambda api, name: api._command()
+    # what connect() starts besides the link: IMU sampling and checkpoints
+    machine.attach_imu()
+    machine.store_path = os.path.join(tempfile.mkdtemp(), "learned_state.bin")
+    machine.load_learned()
+
+    peak_threads = threading.active_count()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    switches = usage.ru_nvcsw + usage.ru_nivcsw
+
+    server = threading.Thread(target=machine.serve)
+    server.start()
+    time.sleep(0.2)
+    for delay, event in script:
+        end = time.perf_counter() + delay
+        while time.perf_counter() < end:
+            peak_threads = max(peak_threads, threading.active_count())
+            time.sleep(0.05)
+        machine.events.post(event)
+    machine.stop()
+    server.join(timeout=5)
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    switches = usage.ru_nvcsw + usage.ru_nivcsw - switches
+    commands = machine.api.commands
+    # the last state's behaviour, sampler and checkpoints must not run into the next measurement
+    machine.cleanup()
+    os.remove(machine.store_path)
+
+    led_times = machine.api.led_times
+    intervals = [b - a for a, b in zip(led_times, led_times[1:]) if b - a < 0.1]
+    mean = sum(intervals) / len(intervals) if intervals else 0.0
+    jitter = (sum((i - mean) ** 2 for i in intervals) / len(intervals)) ** 0.5 if intervals else 0.0
+    # against the fade's own schedule (1 s / 50 steps): a slow, steady step is off too
+    error = (sum((i - 0.02) ** 2 for i in intervals) / len(intervals)) ** 0.5 if intervals else 0.0
+    return {
+        'peak_threads': peak_threads,
+        'context_switches': switches,
+        'commands': commands,
+        'led_interval_ms': mean * 1000,
+        'led_jitter_ms': jitter * 1000,
+        'led_error_ms': error * 1000,
+        'reaction': machine.events.stats()['reaction']
+    }
+
+
+def main():
+    state_machine = AsyncSpheroStateMachine()
+
+    if state_machine.connect():
+        try:
+            state_machine.run()
+        except Exception as e:
+            print(f"Run error: {e}")
+        finally:
+            state_machine.cleanup()
+    else:
+        print("Connect failed")
+
+
+# Threads vs asyncio on the simulator: python3 Sphero_Async.py --bench
+if __name__ == "__main__":
+    import sys
+
+    if "--bench" not in sys.argv:
+        main()
+        sys.exit(0)
+
+    # sleep (breathing) -> patrol -> interact -> satisfied (breathing) -> angry -> sleep
+    script = [(2.0, "voice_patrol"), (2.0, "key_s"), (0.5, "voice_satisfied"),
+              (2.0, "your_fault"), (1.5, "voice_sleep"), (2.0, "key_s")]
+    for cls in (SpheroStateMachine, AsyncSpheroStateMachine):
+        report = benchmark(cls, script)
+        print(f"{cls.__name__:24s} threads={report['peak_threads']:2d} "
+              f"ctx switches={report['context_switches']:6d} commands={report['commands']:5d} "
+              f"led step={report['led_interval_ms']:.1f}ms (20ms nominal) jitter={report['led_jitter_ms']:.2f}ms "
+              f"error={report['led_error_ms']:.2f}ms "
+              f"reaction={report['reaction']['mean_ms']:.2f}ms")
@@ -0,0 +1,419 @@
+import bisect
+import threading
+import time
+import numpy as np
+from collections import deque
+import speech_recognition as sr
+from Sphero_Keyword import SAMPLE_RATE, load_wav
+
+
+class _BufferStream:
+    """stream.read() over int16 samples, optionally paced in real time"""
+
+    def __init__(self, pcm, rate, realtime):
+        self.pcm = pcm
+        self.rate = rate
+        self.realtime = realtime
+        self.position = 0
+        self.started = None
+        self.lock = threading.Lock()
+
+    def read(self, frames, exception_on_overflow=False):
+        with self.lock:
+            if self.started is None:
+                self.started = time.perf_counter()
+            start = self.position
+            end = min(start + frames, len(self.pcm))
+            self.position = end
+
+        if self.realtime and end > start:
+            # wait until these samples would have been captured
+            due = self.started + end / self.rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        return self.pcm[start:end].tobytes()
+
+    @property
+    def finished(self):
+        return self.position >= len(self.pcm)
+
+    def close(self):
+        pass
+
+
+class SampleClock:
+    """Wall time at which sample indices arrived, from one (end index, time) record per chunk
+
+    Live input arrives in real time; files and arrays read as fast as
+    possible do not, so times are looked up instead of derived from the
+    sample offset to the newest sample.
+    """
+
+    def __init__(self, rate, history=4096):
+        self.rate = rate
+        self.history = history
+        self._ends = []
+        self._times = []
+        self._lock = threading.Lock()
+
+    def record(self, end, t=None):
+        with self._lock:
+            self._ends.append(end)
+            self._times.append(time.time() if t is None else t)
+            if len(self._ends) > 2 * self.history:
+                del self._ends[:self.history]
+                del self._times[:self.history]
+
+    def time_of(self, index):
+        """time sample `index` arrived; within a chunk, backed off by its offset (not before the previous chunk)"""
+        with self._lock:
+            if not self._ends:
+                return time.time()
+            i = bisect.bisect_right(self._ends, index)
+            if i >= len(self._ends):
+                return self._times[-1]
+            t = self._times[i] - (self._ends[i] - index) / self.rate
+            return max(t, self._times[i - 1]) if i > 0 else t
+
+
+class MeteredStream:
+    """Wraps a source stream: counts and timestamps the samples read and
+    reports each chunk's RMS (0..1) to on_chunk (optional)"""
+
+    def __init__(self, stream, on_chunk, rate, history=512):
+        self.stream = stream
+        self.on_chunk = on_chunk
+        self.rate = rate
+        self.position = 0
+        self.clock = SampleClock(rate)
+        # (end index, rms) of recent chunks
+        self.energies = deque(maxlen=history)
+
+    def read(self, frames, *args, **kwargs):
+        data = self.stream.read(frames, *args, **kwargs)
+        pcm = np.frombuffer(data, dtype=np.int16)
+        if len(pcm):
+            self.position += len(pcm)
+            self.clock.record(self.position)
+            energy = float(np.sqrt(np.dot(pcm, pcm.astype(np.float32)) / len(pcm))) / 32768.0
+            self.energies.append((self.position, energy))
+            if self.on_chunk:
+                self.on_chunk(energy, len(pcm) / self.rate)
+        return data
+
+    def last_above(self, threshold, since=0):
+        """end index of the newest chunk with rms above threshold, None if none after since"""
+        for end, energy in reversed(self.energies):
+            if end <= since:
+                break
+            if energy > threshold:
+                return end
+        return None
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class ArraySource(sr.AudioSource):
+    """NumPy buffer as a speech_recognition audio source"""
+
+    live = False
+
+    def __init__(self, samples, rate=SAMPLE_RATE, realtime=False, chunk=1024):
+        samples = np.asarray(samples)
+        if samples.dtype != np.int16:
+            samples = np.clip(samples * 32768.0, -32768, 32767).astype(np.int16)
+        self.samples = samples
+        self.SAMPLE_RATE = rate
+        self.SAMPLE_WIDTH = 2
+        self.CHUNK = chunk
+        self.realtime = realtime
+        self.stream = None
+
+    def __enter__(self):
+        self.stream = _BufferStream(self.samples, self.SAMPLE_RATE, self.realtime)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stream = None
+
+    @property
+    def finished(self):
+        return self.stream is not None and self.stream.finished
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.SAMPLE_RATE
+
+
+class WavFileSource(ArraySource):
+    """WAV file (resampled to 16 kHz mono) as an audio source"""
+
+    def __init__(self, path, realtime=False, chunk=1024):
+        super().__init__(load_wav(path, SAMPLE_RATE), SAMPLE_RATE, realtime, chunk)
+        self.path = path
+
+
+class AudioRingBuffer:
+    """Preallocated float32 ring; any recent span is a contiguous view"""
+
+    def __init__(self, capacity_seconds=30.0, rate=SAMPLE_RATE):
+        self.rate = rate
+        self.capacity = int(capacity_seconds * rate)
+        # every sample is written twice so views never wrap
+        self._buffer = np.zeros(2 * self.capacity, dtype=np.float32)
+        self._scale = np.float32(1.0 / 32768.0)
+        self.total = 0
+        # reader position and start -> count of segments handed on as views,
+        # only used for backpressure by non-live producers
+        self.consumed = 0
+        self._holds = {}
+        self.last_write = None
+        self.clock = SampleClock(rate)
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def write(self, pcm):
+        """Append int16 samples (scaled in place, no intermediate arrays)"""
+        count = len(pcm)
+        if count > self.capacity:
+            pcm = pcm[-self.capacity:]
+        n = len(pcm)
+        pos = (self.total + count - n) % self.capacity
+        first = min(n, self.capacity - pos)
+        buffer = self._buffer
+        # convert once, the mirror half is a plain float32 copy
+        np.multiply(pcm[:first], self._scale, out=buffer[pos:pos + first])
+        buffer[pos + self.capacity:pos + self.capacity + first] = buffer[pos:pos + first]
+        if first < n:
+            np.multiply(pcm[first:], self._scale, out=buffer[:n - first])
+            buffer[self.capacity:self.capacity + n - first] = buffer[:n - first]
+        with self._cond:
+            self.total += count
+            self.last_write = time.time()
+            self.clock.record(self.total, self.last_write)
+            self._cond.notify_all()
+
+    @property
+    def oldest(self):
+        """first absolute sample index still held"""
+        return max(0, self.total - self.capacity)
+
+    def view(self, start, end):
+        """Samples [start, end) by absolute index, None once overwritten"""
+        if start < self.oldest or end > self.total or end - start > self.capacity:
+            return None
+        pos = start % self.capacity
+        return self._buffer[pos:pos + end - start]
+
+    def latest(self, n):
+        n = min(n, self.total, self.capacity)
+        return self.view(self.total - n, self.total)
+
+    def hold(self, start):
+        """a consumer keeps a view from `start` on until release()"""
+        with self._cond:
+            self._holds[start] = self._holds.get(start, 0) + 1
+
+    def release(self, start):
+        """drop a hold; False if the held samples were overwritten meanwhile"""
+        with self._cond:
+            count = self._holds.get(start, 0) - 1
+            if count > 0:
+                self._holds[start] = count
+            else:
+                self._holds.pop(start, None)
+        return start >= self.oldest
+
+    @property
+    def low_water(self):
+        """oldest index still needed: the reader position or the oldest held view"""
+        with self._cond:
+            return min(self.consumed, min(self._holds)) if self._holds else self.consumed
+
+    def time_of(self, index):
+        """wall clock time a sample index was written (within a chunk for live input)"""
+        return self.clock.time_of(index)
+
+    def wait(self, total, timeout=None):
+        """block until `total` samples have been written (False on timeout / close)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.total >= total or self.closed, timeout)
+            return self.total >= total
+
+    def close(self):
+        """no more writes; wakes waiting readers"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class RingCapture:
+    """Audio pushed into an AudioRingBuffer from a capture thread"""
+
+    live = True
+
+    def __init__(self, rate=SAMPLE_RATE, chunk=320, capacity_seconds=30.0):
+        self.rate = rate
+        self.chunk = chunk
+        self.ring = AudioRingBuffer(capacity_seconds, rate)
+        self.is_running = False
+        self.finished = False
+
+        self.callbacks = 0
+        self.callback_time = 0.0
+        self.overflows = 0
+
+    def _on_audio(self, data):
+        # frombuffer is a view of the driver's bytes, the ring write is the only copy
+        start = time.perf_counter()
+        self.ring.write(np.frombuffer(data, dtype=np.int16))
+        self.callbacks += 1
+        self.callback_time += time.perf_counter() - start
+
+    def media_time(self, index=None):
+        return (self.ring.total if index is None else index) / self.rate
+
+    def stats(self):
+        return {
+            'callbacks': self.callbacks,
+            'callback_us': 1e6 * self.callback_time / self.callbacks if self.callbacks else 0.0,
+            'overflows': self.overflows,
+            'samples': self.ring.total
+        }
+
+
+class CallbackCapture(RingCapture):
+    """PyAudio callback mode straight into the ring"""
+
+    def __init__(self, rate=SAMPLE_RATE, chunk=320, capacity_seconds=30.0, device_index=None):
+        super().__init__(rate, chunk, capacity_seconds)
+        self.device_index = device_index
+        self._audio = None
+        self._stream = None
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        import pyaudio
+        if status & pyaudio.paInputOverflow:
+            self.overflows += 1
+        self._on_audio(in_data)
+        return (None, pyaudio.paContinue)
+
+    def start(self):
+        import pyaudio
+        self._audio = pyaudio.PyAudio()
+        self._stream = self._audio.open(
+            format=pyaudio.paInt16, channels=1, rate=self.rate, input=True,
+            frames_per_buffer=self.chunk, input_device_index=self.device_index,
+            stream_callback=self._callback)
+        self.is_running = True
+        self._stream.start_stream()
+
+    def stop(self):
+        self.is_running = False
+        if self._stream:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+        if self._audio:
+            self._audio.terminate()
+            self._audio = None
+        self.finished = True
+        self.ring.close()
+
+
+class ArrayCapture(RingCapture):
+    """NumPy buffer / WAV pushed into the ring in chunks, like the callback"""
+
+    live = False
+
+    def __init__(self, samples, rate=SAMPLE_RATE, chunk=320, capacity_seconds=30.0, realtime=False):
+        super().__init__(rate, chunk, capacity_seconds)
+        self.samples = ArraySource(samples, rate).samples
+        self.realtime = realtime
+        self.thread = None
+
+    def _run(self):
+        started = time.perf_counter()
+        for start in range(0, len(self.samples), self.chunk):
+            if not self.is_running:
+                break
+            end = min(start + self.chunk, len(self.samples))
+            if self.realtime:
+                delay = started + end / self.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                # as fast as the reader keeps up, without overrunning the
+                # reader or any view it has handed on
+                while self.is_running and end - self.ring.low_water > self.ring.capacity:
+                    time.sleep(0.001)
+            self._on_audio(self.samples[start:end].tobytes())
+        self.finished = True
+        self.ring.close()
+
+    def start(self):
+        self.is_running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.is_running = False
+        if self.thread:
+            self.thread.join(timeout=2)
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.rate
+
+
+def open_capture(source=None, realtime=False, chunk=320, capacity_seconds=30.0):
+    """Microphone (None / "mic"), WAV path or NumPy array -> ring capture"""
+    if source is None or (isinstance(source, str) and source == "mic"):
+        return CallbackCapture(SAMPLE_RATE, chunk, capacity_seconds)
+    if isinstance(source, str):
+        source = load_wav(source, SAMPLE_RATE)
+    if isinstance(source, np.ndarray):
+        return ArrayCapture(source, SAMPLE_RATE, chunk, capacity_seconds, realtime)
+    return source
+
+
+def open_source(source=None, sample_rate=None, realtime=False):
+    """Microphone (None / "mic"), WAV path or NumPy array -> audio source"""
+    if source is None or (isinstance(source, str) and source == "mic"):
+        # live microphone only needs PyAudio when actually used
+        return sr.Microphone(sample_rate=sample_rate)
+    if isinstance(source, str):
+        return WavFileSource(source, realtime=realtime)
+    if isinstance(source, np.ndarray):
+        return ArraySource(source, realtime=realtime)
+    return source
+
+
+# Per-chunk cost: ring write vs byte-string accumulation (listen path)
+if __name__ == "__main__":
+    chunk = 320
+    pcm = (np.random.default_rng(0).standard_normal(chunk) * 3000).astype(np.int16).tobytes()
+    runs = 20000
+
+    ring = AudioRingBuffer(30.0)
+    start = time.perf_counter()
+    for _ in range(runs):
+        ring.write(np.frombuffer(pcm, dtype=np.int16))
+        ring.latest(chunk)
+    ring_us = (time.perf_counter() - start) / runs * 1e6
+
+    frames = []
+    start = time.perf_counter()
+    for i in range(runs):
+        frames.append(bytes(pcm))
+        if i % 250 == 249:
+            # a 5 s phrase: join, AudioData raw copy, back to float
+            raw = b"".join(frames)
+            np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768.0
+            frames = []
+    bytes_us = (time.perf_counter() - start) / runs * 1e6
+
+    print(f"ring buffer: {ring_us:.2f}us per {chunk}-sample chunk")
+    print(f"byte chunks: {bytes_us:.2f}us per {chunk}-sample chunk")
@@ -0,0 +1,167 @@
+import argparse
+import glob
+import json
+import os
+import cv2
+import numpy as np
+from Sphero_Vision import HSV_CONFIG_PATH
+
+
+# where SpheroVision looks for it, whatever the working directory
+DEFAULT_CONFIG = HSV_CONFIG_PATH
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+def load_frames(source, step=1, limit=None):
+    """Frames from an image directory or a video file"""
+    frames = []
+    if os.path.isdir(source):
+        paths = sorted(p for p in glob.glob(os.path.join(source, "*"))
+                       if p.lower().endswith(IMAGE_EXTENSIONS))
+        for path in paths[::step]:
+            frame = cv2.imread(path)
+            if frame is not None:
+                frames.append(frame)
+            if limit and len(frames) >= limit:
+                break
+    else:
+        capture = cv2.VideoCapture(source)
+        index = 0
+        while True:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            if index % step == 0:
+                frames.append(frame)
+                if limit and len(frames) >= limit:
+                    break
+            index += 1
+        capture.release()
+    return frames
+
+
+def select_regions(frame, names=("red", "green")):
+    """Click one box per colour on the first frame"""
+    regions = {}
+    for name in names:
+        print(f"Drag a box around the {name} object, ENTER to confirm, c to skip")
+        x, y, w, h = cv2.selectROI(f"Select {name}", frame, showCrosshair=True)
+        cv2.destroyWindow(f"Select {name}")
+        if w > 0 and h > 0:
+            regions[name] = [[int(x), int(y), int(w), int(h)]]
+    return regions
+
+
+def hsv_pixels(frames, rects):
+    """All HSV pixels inside rects, over every frame, in one conversion"""
+    stack = np.stack(frames)
+    n, height, width, _ = stack.shape
+
+    # one big image -> a single cvtColor call
+    hsv = cv2.cvtColor(stack.reshape(n * height, width, 3), cv2.COLOR_BGR2HSV)
+    hsv = hsv.reshape(n, height, width, 3)
+
+    mask = np.zeros((height, width), dtype=bool)
+    for x, y, w, h in rects:
+        mask[y:y + h, x:x + w] = True
+
+    # same rects on every frame -> broadcast over n
+    return hsv[:, mask].reshape(-1, 3)
+
+
+def percentile_from_hist(hist, low, high):
+    """Bin range holding [low, high] of the mass"""
+    cdf = np.cumsum(hist) / max(hist.sum(), 1)
+    lo = int(np.searchsorted(cdf, low))
+    hi = int(np.searchsorted(cdf, high))
+    return lo, min(hi, len(hist) - 1)
+
+
+def compute_thresholds(pixels, coverage=0.98, margin=(4, 15, 15)):
+    """Tight HSV ranges (list of [lower, upper]) from pixel samples"""
+    tail = (1.0 - coverage) / 2.0
+    hue = pixels[:, 0].astype(np.int64)
+
+    # red straddles 0/180: shift by 90 so the cluster is contiguous
+    hue_hist = np.bincount(hue, minlength=180)[:180]
+    shifted_hist = np.bincount((hue + 90) % 180, minlength=180)[:180]
+    h_lo, h_hi = percentile_from_hist(hue_hist, tail, 1.0 - tail)
+    s_lo, s_hi = percentile_from_hist(shifted_hist, tail, 1.0 - tail)
+    wraps = (s_hi - s_lo) < (h_hi - h_lo)
+
+    sat_hist = np.bincount(pixels[:, 1], minlength=256)
+    val_hist = np.bincount(pixels[:, 2], minlength=256)
+    sat_lo, sat_hi = percentile_from_hist(sat_hist, tail, 1.0 - tail)
+    val_lo, val_hi = percentile_from_hist(val_hist, tail, 1.0 - tail)
+
+    dh, ds, dv = margin
+    sat_lo, sat_hi = max(0, sat_lo - ds), min(255, sat_hi + ds)
+    val_lo, val_hi = max(0, val_lo - dv), min(255, val_hi + dv)
+
+    if not wraps:
+        lo, hi = max(0, h_lo - dh), min(179, h_hi + dh)
+        return [[[lo, sat_lo, val_lo], [hi, sat_hi, val_hi]]]
+
+    # back to real hue (shift is its own inverse mod 180), split at 0
+    lo, hi = max(0, s_lo - dh), min(179, s_hi + dh)
+    if lo < 90 <= hi:
+        return [[[0, sat_lo, val_lo], [hi - 90, sat_hi, val_hi]],
+                [[lo + 90, sat_lo, val_lo], [179, sat_hi, val_hi]]]
+    return [[[(lo + 90) % 180, sat_lo, val_lo], [(hi + 90) % 180, sat_hi, val_hi]]]
+
+
+def calibrate(frames, regions, coverage=0.98):
+    """Thresholds for every named region"""
+    config = {}
+    for name, rects in regions.items():
+        pixels = hsv_pixels(frames, rects)
+        if len(pixels) == 0:
+            continue
+        config[name] = compute_thresholds(pixels, coverage=coverage)
+        print(f"{name}: {len(pixels)} px -> {config[name]}")
+    return config
+
+
+def save_config(config, path=DEFAULT_CONFIG):
+    with open(path, "w") as f:
+        json.dump(config, f, indent=2)
+    print(f"Saved {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HSV calibration from recorded frames")
+    parser.add_argument("source", help="image directory or video file")
+    parser.add_argument("--regions", help="json {name: [[x, y, w, h], ...]}")
+    parser.add_argument("--red", nargs=4, type=int, metavar=("X", "Y", "W", "H"))
+    parser.add_argument("--green", nargs=4, type=int, metavar=("X", "Y", "W", "H"))
+    parser.add_argument("--step", type=int, default=1, help="use every Nth frame")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--coverage", type=float, default=0.98)
+    parser.add_argument("--output", default=DEFAULT_CONFIG)
+    args = parser.parse_args()
+
+    frames = load_frames(args.source, step=args.step, limit=args.limit)
+    if not frames:
+        print("No frames loaded")
+        return
+    print(f"Loaded {len(frames)} frames")
+
+    # known regions first, click otherwise
+    regions = {}
+    if args.regions:
+        with open(args.regions) as f:
+            regions = json.load(f)
+    if args.red:
+        regions["red"] = [args.red]
+    if args.green:
+        regions["green"] = [args.green]
+    if not regions:
+        regions = select_regions(frames[0])
+
+    config = calibrate(frames, regions, coverage=args.coverage)
+    if config:
+        save_config(config, args.output)
+
+
+if __name__ == "__main__":
+    main()
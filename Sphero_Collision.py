@@ -0,0 +1,238 @@
+import math
+import threading
+import time
+import numpy as np
+from Sphero_Gesture import RollingStats
+
+
+# IMU channels the detector reads
+COLLISION_CHANNELS = ('accelerometer', 'velocity')
+
+
+class CollisionDetector:
+    """Collisions from accelerometer jerk and a drop in measured speed
+
+    Per sample: horizontal jerk against its rolling baseline, and streamed
+    velocity against its rolling mean while the robot is commanded to
+    move. Both within confirm_seconds of each other is a collision; a very
+    large jerk alone is one too. Constant work per sample.
+    """
+
+    def __init__(self, rate_hz=20, window_seconds=0.5, jerk_threshold=6.0, jerk_sigma=4.0,
+                 hard_jerk=20.0, velocity_drop=0.5, min_command=10, min_velocity=10.0,
+                 confirm_seconds=0.15, settle_seconds=0.3, refractory=1.0):
+        self.rate_hz = rate_hz
+        self.window = max(2, int(round(window_seconds * rate_hz)))
+        self.confirm = max(1, int(round(confirm_seconds * rate_hz)))
+
+        # jerk in g/s, velocity in cm/s (spherov2 units)
+        self.jerk_threshold = jerk_threshold
+        self.jerk_sigma = jerk_sigma
+        self.hard_jerk = hard_jerk
+        self.velocity_drop = velocity_drop
+        self.min_command = min_command
+        self.min_velocity = min_velocity
+        self.settle_seconds = settle_seconds
+        self.refractory = refractory
+
+        self.callbacks = []
+        self._lock = threading.Lock()
+
+        # arrival times of detections and of firmware collisions to compare against
+        self.detections = []
+        self.firmware = []
+        self.updates = 0
+        self.update_time = 0.0
+        self.reset()
+
+    def reset(self):
+        """forget the baselines (after a gap in the samples)"""
+        self.jerk = RollingStats(self.window)
+        self.speed = RollingStats(self.window)
+        self.last_accel = None
+        self.last_time = None
+        self.last_command = 0
+        self.command_changed = -math.inf
+        self.last_collision = -math.inf
+        self.since_jerk = None
+        self.since_drop = None
+
+    def on_collision(self, callback):
+        """callback(data) with the same role as the firmware's on_collision"""
+        self.callbacks.append(callback)
+
+    def update(self, t, accel, velocity=None, commanded=0):
+        """one sample: accel (x, y, z) g, velocity (x, y) cm/s or None -> collision dict or None"""
+        start = time.perf_counter()
+        if commanded != self.last_command:
+            self.last_command = commanded
+            self.command_changed = t
+
+        jerk = 0.0
+        if self.last_accel is not None and t > self.last_time:
+            # horizontal only: bumps on the floor are mostly vertical
+            dx = accel[0] - self.last_accel[0]
+            dy = accel[1] - self.last_accel[1]
+            jerk = math.sqrt(dx * dx + dy * dy) / (t - self.last_time)
+        self.last_accel = accel
+        self.last_time = t
+
+        # test against the baseline before this sample joins it
+        limit = max(self.jerk_threshold, self.jerk.mean + self.jerk_sigma * self.jerk.std)
+        spike = self.jerk.full and jerk > limit
+        self.jerk.push(jerk)
+
+        drop = 0.0
+        if velocity is not None:
+            speed = math.hypot(velocity[0], velocity[1])
+            cruise = self.speed.mean
+            if self.speed.full and cruise > self.min_velocity:
+                drop = 1.0 - speed / cruise
+            self.speed.push(speed)
+
+        self.since_jerk = 0 if spike else (None if self.since_jerk is None or self.since_jerk >= self.confirm
+                                           else self.since_jerk + 1)
+        dropped = drop > self.velocity_drop
+        self.since_drop = 0 if dropped else (None if self.since_drop is None or self.since_drop >= self.confirm
+                                             else self.since_drop + 1)
+
+        result = None
+        moving = commanded >= self.min_command and t - self.command_changed >= self.settle_seconds
+        if moving and t - self.last_collision >= self.refractory:
+            if (self.since_jerk is not None and self.since_drop is not None) or jerk > self.hard_jerk:
+                result = {'source': 'accelerometer', 'time': t, 'detected_at': time.time(),
+                          'jerk': jerk, 'velocity_drop': drop}
+                self._fire(result)
+
+        self.updates += 1
+        self.update_time += time.perf_counter() - start
+        return result
+
+    def _fire(self, result):
+        self.last_collision = result['time']
+        self.since_jerk = None
+        self.since_drop = None
+        with self._lock:
+            # 'time' is when the sample was read; the firmware event is stamped on arrival, so is this
+            self.detections.append(result['detected_at'])
+        for callback in list(self.callbacks):
+            try:
+                callback(result)
+            except Exception as e:
+                print(f"Collision callback error: {e}")
+
+    def attach(self, imu, commanded):
+        """run on every IMU sample; commanded() returns the speed last sent"""
+        seen = [None]
+
+        def on_sample(service, t):
+            if 'accelerometer' not in service.active:
+                return
+            # after a pause or a change of channels the baselines are stale
+            if seen[0] is None or seen[0][0] != service.active or t - seen[0][1] > 0.5:
+                self.reset()
+            seen[0] = (service.active, t)
+            accel = service.latest('accelerometer')
+            if accel is None:
+                return
+            velocity = service.latest('velocity') if 'velocity' in service.active else None
+            self.update(t, (accel['x'], accel['y'], accel['z']),
+                        (velocity['x'], velocity['y']) if velocity else None, commanded())
+        imu.subscribe(on_sample)
+
+    def firmware_event(self, t=None):
+        """a firmware collision as it arrives, for the latency comparison"""
+        with self._lock:
+            self.firmware.append(time.time() if t is None else t)
+
+    def compare(self, window=1.0):
+        """software vs firmware by arrival time: matched pairs, signed latency (software - firmware), misses, extras"""
+        with self._lock:
+            firmware = list(self.firmware)
+            software = list(self.detections)
+        latencies = []
+        used = set()
+        for ft in firmware:
+            best = None
+            for i, st in enumerate(software):
+                if i not in used and abs(st - ft) <= window and (best is None or abs(st - ft) < abs(software[best] - ft)):
+                    best = i
+            if best is not None:
+                used.add(best)
+                latencies.append(software[best] - ft)
+        result = {
+            'firmware': len(firmware),
+            'software': len(software),
+            'matched': len(latencies),
+            'missed': len(firmware) - len(latencies),
+            'extra': len(software) - len(latencies)
+        }
+        if latencies:
+            result['latency_mean_ms'] = 1000 * float(np.mean(latencies))
+            result['latency_max_ms'] = 1000 * float(np.max(latencies))
+        return result
+
+    def stats(self):
+        return {
+            'updates': self.updates,
+            'update_us': 1e6 * self.update_time / self.updates if self.updates else 0.0,
+            'detections': len(self.detections)
+        }
+
+
+def synthesize_drive(seed=0, rate_hz=20, impact=True, seconds=4.0):
+    """straight move at speed 40 with an optional wall hit at 2.5 s -> (t, accel, velocity, commanded, impact time)"""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * rate_hz)
+    t = np.arange(n) / rate_hz
+    commanded = np.where((t >= 0.5) & (t < 3.5), 40, 0)
+    cruise = 32.0  # cm/s
+    velocity = cruise * np.clip((t - 0.5) / 0.4, 0, 1) * (t < 3.5)
+    velocity = velocity + np.clip((3.7 - t) / 0.2, 0, 1) * (t >= 3.5) * cruise
+    hit = rng.uniform(2.2, 2.8) if impact else None
+    if hit is not None:
+        after = t >= hit
+        velocity = np.where(after, rng.uniform(0, 4), velocity)
+    heading = rng.uniform(0, 2 * np.pi)
+    vx, vy = velocity * np.sin(heading), velocity * np.cos(heading)
+    # acceleration from the velocity profile (cm/s^2 -> g), plus noise and floor bumps
+    ax = np.gradient(vx, t) / 981.0 + rng.normal(0, 0.03, n)
+    ay = np.gradient(vy, t) / 981.0 + rng.normal(0, 0.03, n)
+    az = 1.0 + rng.normal(0, 0.05, n)
+    if hit is not None:
+        k = int(np.searchsorted(t, hit))
+        # the impact itself: a short horizontal spike
+        ax[k] += -np.sin(heading) * rng.uniform(0.8, 1.5)
+        ay[k] += -np.cos(heading) * rng.uniform(0.8, 1.5)
+    velocity_xy = np.stack([vx, vy], axis=1) + rng.normal(0, 1.0, (n, 2))
+    return t, np.stack([ax, ay, az], axis=1), velocity_xy, commanded, hit
+
+
+# Detection delay and false alarms on synthetic drives: python3 Sphero_Collision.py
+if __name__ == "__main__":
+    runs = 200
+    delays = []
+    missed = 0
+    false_alarms = 0
+    detector = None
+    for seed in range(runs):
+        for impact in (True, False):
+            detector = CollisionDetector()
+            t, accel, velocity, commanded, hit = synthesize_drive(seed, impact=impact)
+            found = None
+            for i in range(len(t)):
+                result = detector.update(t[i], tuple(accel[i]), tuple(velocity[i]), int(commanded[i]))
+                if result and found is None:
+                    found = result['time']
+            if impact:
+                if found is None or found < hit:
+                    missed += found is None
+                    false_alarms += found is not None
+                else:
+                    delays.append(found - hit)
+            elif found is not None:
+                false_alarms += 1
+    print(f"impacts: {len(delays)}/{runs} detected, mean delay {1000 * np.mean(delays):.0f}ms "
+          f"(max {1000 * np.max(delays):.0f}ms at 20 Hz), {missed} missed")
+    print(f"false alarms: {false_alarms} in {2 * runs} drives (start / stop included)")
+    print(f"{detector.stats()['update_us']:.1f}us per sample")
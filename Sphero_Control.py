@@ -0,0 +1,382 @@
+import math
+import threading
+import time
+
+
+def wrap_angle(angle):
+    """Wrap degrees to [-180, 180)"""
+    return (angle + 180.0) % 360.0 - 180.0
+
+
+def image_to_heading(dx, dy):
+    """Image vector (y down) to Sphero heading (0 = up, clockwise)"""
+    return (90.0 - math.degrees(math.atan2(-dy, dx))) % 360.0
+
+
+class PID:
+    """Plain PID with output clamp and anti-windup"""
+
+    def __init__(self, kp, ki=0.0, kd=0.0, output_limits=(None, None), integral_limit=None):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.output_limits = output_limits
+        self.integral_limit = integral_limit
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self.last_error = None
+
+    def update(self, error, dt):
+        if dt <= 0:
+            dt = 1e-3
+
+        self.integral += error * dt
+        if self.integral_limit is not None:
+            self.integral = max(-self.integral_limit, min(self.integral_limit, self.integral))
+
+        derivative = 0.0
+        if self.last_error is not None:
+            derivative = (error - self.last_error) / dt
+        self.last_error = error
+
+        output = self.kp * error + self.ki * self.integral + self.kd * derivative
+
+        low, high = self.output_limits
+        if low is not None:
+            output = max(low, output)
+        if high is not None:
+            output = min(high, output)
+        return output
+
+
+class SpheroVisualServo:
+    """Fixed-rate visual servo: steers the Sphero to the red target"""
+
+    def __init__(self, api, rate_hz=20, max_speed=60, clock=time.time):
+        self.api = api
+        self.clock = clock
+
+        # loop
+        self.rate_hz = rate_hz
+        self.is_running = False
+        self.control_thread = None
+
+        # controllers
+        # no derivative term: the travel direction is already a noisy derivative
+        self.heading_pid = PID(0.5, 0.2, 0.0, output_limits=(-45, 45), integral_limit=60)
+        self.distance_pid = PID(0.35, 0.0, 0.0, output_limits=(0, max_speed))
+        self.max_speed = max_speed
+        self.min_speed = 12
+        self.arrive_radius = 40
+
+        # estimate filter
+        self.filter_alpha = 0.5
+        self.velocity_alpha = 0.3
+        self.min_motion = 15.0
+        self.stale_timeout = 0.5
+
+        # bearing / heading error low-pass (seconds) and hysteresis band (degrees)
+        self.smoothing_time_constant = 0.3
+        self.error_engage = 8.0
+        self.error_release = 3.0
+        self._error = None
+        self._bearing = None
+        self._correcting = False
+
+        # command dedupe
+        self.heading_deadband = 6
+        self.speed_deadband = 4
+        # at most one heading change per interval, whatever the loop rate
+        self.heading_interval = 0.1
+        self._heading_sent_at = None
+        self.last_heading = None
+        self.last_speed = None
+        self.command_count = 0
+
+        # shared estimate
+        self._lock = threading.Lock()
+        self._sphero = None
+        self._target = None
+        self._velocity = (0.0, 0.0)
+        self._stamp = None
+        self._last_step = None
+        self.pipeline_latency = 0.0
+        self.latency_alpha = 0.1
+
+    def update_estimate(self, result, received_at=None):
+        """Feed a detect_sphero_and_target() result (any thread)"""
+        now = received_at if received_at is not None else self.clock()
+
+        with self._lock:
+            if 'timestamp' in result:
+                # latency ema
+                stamp = result['timestamp']
+                self.pipeline_latency += (now - stamp - self.pipeline_latency) * self.latency_alpha
+            else:
+                # unstamped frames are back-dated by the measured pipeline latency
+                stamp = now - self.pipeline_latency
+
+            if not (result.get('sphero_found') and result.get('target_found')):
+                self._sphero = None
+                self._target = None
+                self._stamp = stamp
+                return
+
+            sx, sy = result['sphero_pos']
+            tx, ty = result['target_pos']
+
+            if self._sphero is None or self._stamp is None:
+                self._sphero = (float(sx), float(sy))
+                self._velocity = (0.0, 0.0)
+            else:
+                # alpha-beta on sphero position
+                dt = max(stamp - self._stamp, 1e-3)
+                px = self._sphero[0] + self._velocity[0] * dt
+                py = self._sphero[1] + self._velocity[1] * dt
+                rx = sx - px
+                ry = sy - py
+                a = self.filter_alpha
+                b = self.velocity_alpha
+                self._sphero = (px + a * rx, py + a * ry)
+                self._velocity = (self._velocity[0] + b * rx / dt,
+                                  self._velocity[1] + b * ry / dt)
+
+            if self._target is None:
+                self._target = (float(tx), float(ty))
+            else:
+                a = self.filter_alpha
+                self._target = (self._target[0] + a * (tx - self._target[0]),
+                                self._target[1] + a * (ty - self._target[1]))
+            self._stamp = stamp
+
+    def _predict(self, now):
+        """Latency compensated estimate at time now"""
+        with self._lock:
+            if self._sphero is None or self._stamp is None:
+                return None
+            age = now - self._stamp
+            if age > self.stale_timeout:
+                return None
+            vx, vy = self._velocity
+            sphero = (self._sphero[0] + vx * age, self._sphero[1] + vy * age)
+            return sphero, self._target, (vx, vy)
+
+    def step(self, now=None):
+        """One control tick, returns (heading, speed)"""
+        if now is None:
+            now = self.clock()
+        dt = 1.0 / self.rate_hz if self._last_step is None else now - self._last_step
+        self._last_step = now
+
+        estimate = self._predict(now)
+        if estimate is None:
+            self._reset_controllers()
+            self._send(self.last_heading or 0, 0)
+            return self.last_heading, 0
+
+        (sx, sy), (tx, ty), (vx, vy) = estimate
+        dx = tx - sx
+        dy = ty - sy
+        distance = math.hypot(dx, dy)
+        bearing = self._smooth_bearing(image_to_heading(dx, dy), dt)
+
+        if distance <= self.arrive_radius:
+            self._reset_controllers()
+            self._send(self.last_heading or int(bearing), 0)
+            return self.last_heading, 0
+
+        # heading loop on the low-passed error between bearing and travel direction
+        correction = 0.0
+        if math.hypot(vx, vy) > self.min_motion:
+            error = wrap_angle(bearing - image_to_heading(vx, vy))
+            if self._error is None:
+                self._error = error
+            else:
+                self._error = wrap_angle(self._error + wrap_angle(error - self._error) * self._alpha(dt))
+
+            # hysteresis: engage on a real drift, hold until it is corrected
+            if abs(self._error) >= self.error_engage:
+                self._correcting = True
+            elif abs(self._error) <= self.error_release:
+                self._correcting = False
+            if self._correcting:
+                correction = self.heading_pid.update(self._error, dt)
+            else:
+                # keep the learned offset (integral), without accumulating noise
+                correction = self.heading_pid.ki * self.heading_pid.integral
+        heading = int(round(bearing + correction)) % 360
+
+        # distance loop
+        speed = self.distance_pid.update(distance - self.arrive_radius, dt)
+        speed = int(max(self.min_speed, min(self.max_speed, speed)))
+
+        self._send(heading, speed, now)
+        return heading, speed
+
+    def _alpha(self, dt):
+        """low-pass gain for a tick of dt; a time constant keeps it rate independent"""
+        return 1.0 - math.exp(-dt / self.smoothing_time_constant)
+
+    def _smooth_bearing(self, bearing, dt):
+        if self._bearing is None:
+            self._bearing = bearing
+        else:
+            self._bearing = (self._bearing + wrap_angle(bearing - self._bearing) * self._alpha(dt)) % 360.0
+        return self._bearing
+
+    def _reset_controllers(self):
+        self.heading_pid.reset()
+        self.distance_pid.reset()
+        self._error = None
+        self._bearing = None
+        self._correcting = False
+
+    def _send(self, heading, speed, now=None):
+        """Only talk to the robot when the command really changes"""
+        heading = int(heading) % 360
+        speed = int(speed)
+
+        if self.last_heading is None or abs(wrap_angle(heading - self.last_heading)) >= self.heading_deadband:
+            recent = (now is not None and self._heading_sent_at is not None
+                      and now - self._heading_sent_at < self.heading_interval)
+            if speed > 0 and not recent:
+                self.api.set_heading(heading)
+                self.last_heading = heading
+                self._heading_sent_at = now
+                self.command_count += 1
+
+        if self.last_speed is None or abs(speed - self.last_speed) >= self.speed_deadband \
+                or (speed == 0 and self.last_speed != 0):
+            self.api.set_speed(speed)
+            self.last_speed = speed
+            self.command_count += 1
+
+    def _control_loop(self):
+        period = 1.0 / self.rate_hz
+        next_tick = time.perf_counter()
+        while self.is_running:
+            try:
+                self.step()
+            except Exception as e:
+                print(f"Servo error: {e}")
+
+            # absolute deadlines, no drift
+            next_tick += period
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.perf_counter()
+
+    def start(self):
+        if self.is_running:
+            return
+        self._reset_controllers()
+        self.last_heading = None
+        self.last_speed = None
+        self._heading_sent_at = None
+        self._last_step = None
+        self.is_running = True
+        self.control_thread = threading.Thread(target=self._control_loop, daemon=True)
+        self.control_thread.start()
+        print(f"Servo started ({self.rate_hz} Hz)")
+
+    def stop(self):
+        if not self.is_running:
+            return
+        self.is_running = False
+        if self.control_thread:
+            self.control_thread.join(timeout=1)
+        try:
+            self.api.set_speed(0)
+        except Exception:
+            pass
+        self.last_speed = 0
+        print(f"Servo stopped ({self.command_count} commands, "
+              f"pipeline latency {self.pipeline_latency * 1000:.0f}ms)")
+
+
+def benchmark_servo(runs=20, rate_hz=20, camera_fps=30, latency=0.08, timeout=15.0, seed=0):
+    """Time-to-target, overshoot past the stop line and command count against Sphero_Sim"""
+    import random
+    from Sphero_Sim import SimulatedSphero, SimulatedCamera
+
+    rng = random.Random(seed)
+    physics_dt = 0.005
+    results = []
+
+    for run in range(runs):
+        start = (rng.uniform(20, 300), rng.uniform(20, 220))
+        target = (rng.uniform(20, 300), rng.uniform(20, 220))
+        while math.hypot(target[0] - start[0], target[1] - start[1]) < 120:
+            target = (rng.uniform(20, 300), rng.uniform(20, 220))
+
+        sim = SimulatedSphero(start[0], start[1], target=target,
+                              heading_offset=rng.uniform(-20, 20))
+        camera = SimulatedCamera(sim, latency=latency, seed=seed + run)
+
+        t = 0.0
+        servo = SpheroVisualServo(sim, rate_hz=rate_hz, clock=lambda: t)
+        approach = ((target[0] - start[0]), (target[1] - start[1]))
+        norm = math.hypot(*approach)
+        approach = (approach[0] / norm, approach[1] / norm)
+
+        next_frame = 0.0
+        next_control = 0.0
+        reached_at = None
+        overshoot = 0.0
+        while t < timeout:
+            camera.record(t)
+            if t >= next_frame:
+                servo.update_estimate(camera.observe(t), received_at=t)
+                next_frame += 1.0 / camera_fps
+            if t >= next_control:
+                servo.step(now=t)
+                next_control += 1.0 / rate_hz
+
+            sim.advance(physics_dt)
+            t += physics_dt
+
+            if reached_at is None and sim.distance_to_target() <= servo.arrive_radius:
+                reached_at = t
+            # the servo stops arrive_radius short of the target: overshoot is
+            # how far the robot coasts past that stop line, along the approach
+            past = (sim.x - target[0]) * approach[0] + (sim.y - target[1]) * approach[1]
+            overshoot = max(overshoot, past + servo.arrive_radius)
+
+            if reached_at is not None and t - reached_at > 2.0:
+                break
+
+        results.append({
+            'time_to_target': reached_at,
+            'overshoot': overshoot,
+            'commands': servo.command_count
+        })
+
+    reached = [r['time_to_target'] for r in results if r['time_to_target'] is not None]
+    summary = {
+        'runs': runs,
+        'reached': len(reached),
+        'mean_time_to_target': sum(reached) / len(reached) if reached else None,
+        'max_overshoot': max(r['overshoot'] for r in results),
+        'mean_commands': sum(r['commands'] for r in results) / runs
+    }
+    return summary, results
+
+
+# Benchmark
+if __name__ == "__main__":
+    print("="*60)
+    print(" "*18 + "Servo Benchmark")
+    print("="*60)
+
+    for rate in (10, 20, 50):
+        summary, _ = benchmark_servo(rate_hz=rate)
+        mean_time = summary['mean_time_to_target']
+        mean_time = f"{mean_time:.2f}s" if mean_time is not None else "n/a"
+        print(f"{rate:3d} Hz: reached {summary['reached']}/{summary['runs']}, "
+              f"time={mean_time}, "
+              f"overshoot={summary['max_overshoot']:.1f}px, "
+              f"commands={summary['mean_commands']:.0f}")
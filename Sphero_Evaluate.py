@@ -0,0 +1,199 @@
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import cv2
+
+from Sphero_Vision import SpheroVision, HSV_CONFIG_PATH
+
+
+LABELS_FILE = "labels.json"
+
+# Per worker process
+_vision = None
+
+
+def _init_worker(hsv_config):
+    global _vision
+    # One process per core, no nested OpenCV threads
+    cv2.setNumThreads(1)
+    _vision = SpheroVision(hsv_config=hsv_config)
+
+
+def _evaluate_frame(task):
+    """Run both detectors on one labelled frame"""
+    path, label = task
+    frame = cv2.imread(path)
+    if frame is None:
+        return None
+
+    t0 = time.perf_counter()
+    red = _vision.process_red_object(frame)
+    t1 = time.perf_counter()
+    pair = _vision.process_sphero_and_target(frame)
+    t2 = time.perf_counter()
+
+    return {
+        'frame': os.path.basename(path),
+        'label': label,
+        'red': red.get('position') if red['found'] else None,
+        'sphero': pair.get('sphero_pos'),
+        'target': pair.get('target_pos'),
+        'red_time': t1 - t0,
+        'pair_time': t2 - t1
+    }
+
+
+def load_labels(directory):
+    """labels.json: {frame: {"target": [x, y] | null, "sphero": [x, y] | null}}"""
+    with open(os.path.join(directory, LABELS_FILE)) as f:
+        labels = json.load(f)
+    return [(os.path.join(directory, name), label) for name, label in sorted(labels.items())]
+
+
+class DetectionScore:
+    """Precision / recall / centroid error for one object"""
+
+    def __init__(self, match_radius):
+        self.match_radius = match_radius
+        self.tp = 0
+        self.fp = 0
+        self.fn = 0
+        self.errors = []
+
+    def add(self, predicted, truth):
+        if predicted is None:
+            if truth is not None:
+                self.fn += 1
+            return
+        if truth is None:
+            self.fp += 1
+            return
+
+        error = math.hypot(predicted[0] - truth[0], predicted[1] - truth[1])
+        if error <= self.match_radius:
+            self.tp += 1
+            self.errors.append(error)
+        else:
+            # wrong blob: a false alarm and a miss
+            self.fp += 1
+            self.fn += 1
+
+    def summary(self):
+        errors = sorted(self.errors)
+        return {
+            'precision': self.tp / (self.tp + self.fp) if self.tp + self.fp else 1.0,
+            'recall': self.tp / (self.tp + self.fn) if self.tp + self.fn else 1.0,
+            'mean_error': sum(errors) / len(errors) if errors else None,
+            'median_error': errors[len(errors) // 2] if errors else None,
+            'tp': self.tp,
+            'fp': self.fp,
+            'fn': self.fn
+        }
+
+
+def evaluate(directory, workers=None, match_radius=20.0, hsv_config=HSV_CONFIG_PATH):
+    """Batch evaluation over a labelled frame directory"""
+    tasks = load_labels(directory)
+    workers = workers or os.cpu_count() or 1
+
+    scores = {
+        'red_object': DetectionScore(match_radius),
+        'target': DetectionScore(match_radius),
+        'sphero': DetectionScore(match_radius)
+    }
+    red_time = 0.0
+    pair_time = 0.0
+    frames = 0
+
+    start = time.perf_counter()
+    with Pool(workers, initializer=_init_worker, initargs=(hsv_config,)) as pool:
+        chunksize = max(1, len(tasks) // (workers * 4))
+        for result in pool.imap_unordered(_evaluate_frame, tasks, chunksize=chunksize):
+            if result is None:
+                continue
+            frames += 1
+            label = result['label']
+            scores['red_object'].add(result['red'], label.get('target'))
+            scores['target'].add(result['target'], label.get('target'))
+            scores['sphero'].add(result['sphero'], label.get('sphero'))
+            red_time += result['red_time']
+            pair_time += result['pair_time']
+    wall = time.perf_counter() - start
+
+    return {
+        'frames': frames,
+        'workers': workers,
+        'wall_time': wall,
+        'throughput_fps': frames / wall if wall > 0 else 0.0,
+        'red_object_fps': frames / red_time if red_time > 0 else 0.0,
+        'sphero_and_target_fps': frames / pair_time if pair_time > 0 else 0.0,
+        'scores': {name: score.summary() for name, score in scores.items()}
+    }
+
+
+def compare_to_baseline(report, baseline, max_drop=0.02, max_error_growth=2.0):
+    """List of accuracy regressions against a saved report"""
+    regressions = []
+    for name, score in report['scores'].items():
+        base = baseline['scores'].get(name)
+        if not base:
+            continue
+        for metric in ('precision', 'recall'):
+            if score[metric] < base[metric] - max_drop:
+                regressions.append(f"{name} {metric} {base[metric]:.3f} -> {score[metric]:.3f}")
+        if score['mean_error'] is not None and base['mean_error'] is not None:
+            if score['mean_error'] > base['mean_error'] + max_error_growth:
+                regressions.append(f"{name} error {base['mean_error']:.1f}px -> "
+                                   f"{score['mean_error']:.1f}px")
+    return regressions
+
+
+def print_report(report):
+    print(f"{report['frames']} frames, {report['workers']} workers, "
+          f"{report['wall_time']:.2f}s")
+    print(f"Throughput: {report['throughput_fps']:.1f} fps (pool), "
+          f"red {report['red_object_fps']:.1f} fps/core, "
+          f"pair {report['sphero_and_target_fps']:.1f} fps/core")
+    for name, score in report['scores'].items():
+        error = f"{score['mean_error']:.1f}px" if score['mean_error'] is not None else "n/a"
+        print(f"  {name:12s} P={score['precision']:.3f} R={score['recall']:.3f} "
+              f"err={error} (tp={score['tp']} fp={score['fp']} fn={score['fn']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate detectors on labelled frames")
+    parser.add_argument("directory", help=f"frames plus {LABELS_FILE}")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--radius", type=float, default=20.0, help="match radius in px")
+    parser.add_argument("--hsv-config", default=HSV_CONFIG_PATH)
+    parser.add_argument("--output", help="save report json")
+    parser.add_argument("--baseline", help="fail on accuracy loss against this report")
+    parser.add_argument("--max-drop", type=float, default=0.02)
+    args = parser.parse_args()
+
+    report = evaluate(args.directory, workers=args.workers,
+                      match_radius=args.radius, hsv_config=args.hsv_config)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, max_drop=args.max_drop)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No accuracy loss")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,463 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque, namedtuple
+from Sphero_Metrics import LatencyHistogram
+
+
+# one row of the table; guard(data) -> bool, action(source, target, data)
+Transition = namedtuple("Transition", "source event target guard action")
+
+ANY = "*"
+
+
+class StateMachineEngine:
+    """Declarative (state, event, guard, action) table, compiled to dict lookups
+
+    fire() is serialized by one lock: a transition (exit, action, enter) runs
+    to completion before the next event is looked at. Events fired from inside
+    a handler on the same thread are queued and run right after.
+    """
+
+    def __init__(self, states, initial, clock=time.time, verbose=True):
+        self.states = list(states)
+        self.verbose = verbose
+        if initial not in self.states:
+            raise ValueError(f"Unknown initial state {initial}")
+        self.clock = clock
+        self.state = initial
+        self.entered_at = clock()
+
+        self.rows = []
+        self.enter_handlers = {}
+        self.exit_handlers = {}
+        self._table = None
+
+        self._lock = threading.RLock()
+        self._dispatching = False
+        self._pending = deque()
+
+        self.history = deque(maxlen=100)
+        self.transitions = 0
+        self.ignored = 0
+        # called as listener(source, event, target) after every transition
+        self.listeners = []
+
+    def add(self, source, event, target, guard=None, action=None):
+        """source: a state, a list of states or ANY (every state but target)"""
+        if target not in self.states:
+            raise ValueError(f"Unknown target state {target}")
+        if source == ANY:
+            sources = [state for state in self.states if state != target]
+        elif isinstance(source, str):
+            sources = [source]
+        else:
+            sources = list(source)
+        for state in sources:
+            if state not in self.states:
+                raise ValueError(f"Unknown source state {state}")
+            self.rows.append(Transition(state, event, target, guard, action))
+        self._table = None
+
+    def on_enter(self, state, handler):
+        self.enter_handlers[state] = handler
+
+    def on_exit(self, state, handler):
+        self.exit_handlers[state] = handler
+
+    def _compile(self):
+        """(state, event) -> rows in the order they were added"""
+        table = {}
+        for row in self.rows:
+            table.setdefault((row.source, row.event), []).append(row)
+        self._table = table
+        return table
+
+    def fire(self, event, data=None):
+        """Run the first matching row; True if the state changed.
+
+        None when called from inside a handler: the event is queued and
+        handled once the current transition has finished.
+        """
+        return self._serialized(self._dispatch, event, data)
+
+    def _serialized(self, step, *args):
+        with self._lock:
+            if self._dispatching:
+                self._pending.append((step, args))
+                return None
+            self._dispatching = True
+            try:
+                result = step(*args)
+                while self._pending:
+                    queued, queued_args = self._pending.popleft()
+                    queued(*queued_args)
+            finally:
+                self._dispatching = False
+            return result
+
+    def _dispatch(self, event, data):
+        table = self._table if self._table is not None else self._compile()
+        for row in table.get((self.state, event), ()):
+            if row.guard is None or row.guard(data):
+                self._change(row.target, event, row.action, data)
+                return True
+        self.ignored += 1
+        return False
+
+    def force(self, target, event="force"):
+        """Unconditional transition (also re-enters the current state)"""
+        if target not in self.states:
+            raise ValueError(f"Unknown state {target}")
+        return self._serialized(self._force, target, event)
+
+    def _force(self, target, event):
+        self._change(target, event, None, None)
+        return True
+
+    def _change(self, target, event, action, data):
+        source = self.state
+        if self.verbose:
+            print(f"State: {source} -> {target} ({event})")
+
+        exit_handler = self.exit_handlers.get(source)
+        if exit_handler:
+            self._run_handler(exit_handler, source)
+        if action:
+            self._run_handler(action, source, target, data)
+
+        self.state = target
+        self.entered_at = self.clock()
+        self.transitions += 1
+        self.history.append((self.entered_at, source, event, target))
+
+        enter_handler = self.enter_handlers.get(target)
+        if enter_handler:
+            self._run_handler(enter_handler, target)
+        for listener in self.listeners:
+            self._run_handler(listener, source, event, target)
+
+    def _run_handler(self, handler, *args):
+        # a failing handler must not leave the engine half-way
+        try:
+            handler(*args)
+        except Exception as e:
+            print(f"State handler error ({handler.__name__}): {e}")
+
+    def elapsed(self):
+        return self.clock() - self.entered_at
+
+    def events(self, state=None):
+        """Events that can change `state` (default: current)"""
+        state = state or self.state
+        table = self._table if self._table is not None else self._compile()
+        return sorted({event for (source, event) in table if source == state})
+
+    def dump(self):
+        """Transition table as aligned text"""
+        lines = []
+        width = max((len(row.source) for row in self.rows), default=5)
+        event_width = max((len(row.event) for row in self.rows), default=5)
+        for row in self.rows:
+            guard = f" [{row.guard.__name__}]" if row.guard else ""
+            action = f" / {row.action.__name__}" if row.action else ""
+            lines.append(f"{row.source:<{width}}  --{row.event:<{event_width}} -->  {row.target}{guard}{action}")
+        for state in self.states:
+            handlers = []
+            if state in self.enter_handlers:
+                handlers.append(f"enter={self.enter_handlers[state].__name__}")
+            if state in self.exit_handlers:
+                handlers.append(f"exit={self.exit_handlers[state].__name__}")
+            if handlers:
+                lines.append(f"{state:<{width}}  {' '.join(handlers)}")
+        return "\n".join(lines)
+
+
+class Timer:
+    """Handle returned by EventLoop.call_later / call_every"""
+
+    def __init__(self, deadline, event, data, interval):
+        self.deadline = deadline
+        self.event = event
+        self.data = data
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop:
+    """Thread-safe event queue plus deadline timers; sleeps until one is due
+
+    Any thread may post(); the loop thread wakes at once. Timers are kept in
+    a heap, so the loop never wakes up just to look at the clock.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._events = deque()
+        self._timers = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.is_running = True
+
+        self.started = clock()
+        self.wakeups = 0
+        self.dispatched = 0
+        self.timers_fired = 0
+        # post -> dispatch delay of posted events, timer lateness of timers
+        self.reaction = LatencyHistogram()
+        self.timer_lateness = LatencyHistogram()
+
+    def post(self, event, data=None):
+        with self._cond:
+            self._events.append((event, data, self.clock()))
+            self._cond.notify()
+
+    def call_later(self, delay, event, data=None):
+        return self._schedule(Timer(self.clock() + delay, event, data, None))
+
+    def call_every(self, interval, event, data=None):
+        """Periodic timer, re-armed from its deadline (no drift)"""
+        return self._schedule(Timer(self.clock() + interval, event, data, interval))
+
+    def _schedule(self, timer):
+        with self._cond:
+            heapq.heappush(self._timers, (timer.deadline, next(self._seq), timer))
+            self._cond.notify()
+        return timer
+
+    def poll(self, timeout=None):
+        """Wait for posted events / due timers, returns [(event, data)]
+
+        timeout=None waits for the next event or timer, however long.
+        """
+        with self._cond:
+            self.wakeups += 1
+            if not self._events and self.is_running:
+                wait = self._next_deadline_in()
+                if timeout is not None:
+                    wait = timeout if wait is None else min(wait, timeout)
+                if wait is None or wait > 0:
+                    self._cond.wait(wait)
+
+            now = self.clock()
+            ready = []
+            while self._events:
+                event, data, posted = self._events.popleft()
+                self.reaction.observe(now - posted)
+                ready.append((event, data))
+            while self._timers and self._timers[0][0] <= now:
+                deadline, _, timer = heapq.heappop(self._timers)
+                if timer.cancelled:
+                    continue
+                self.timer_lateness.observe(now - deadline)
+                self.timers_fired += 1
+                ready.append((timer.event, timer.data))
+                if timer.interval:
+                    timer.deadline = deadline + timer.interval
+                    if timer.deadline <= now:
+                        # fell behind: skip missed ticks instead of bursting
+                        timer.deadline = now + timer.interval
+                    heapq.heappush(self._timers, (timer.deadline, next(self._seq), timer))
+            self.dispatched += len(ready)
+            return ready
+
+    def _next_deadline_in(self):
+        while self._timers and self._timers[0][2].cancelled:
+            heapq.heappop(self._timers)
+        if not self._timers:
+            return None
+        return max(0.0, self._timers[0][0] - self.clock())
+
+    def run(self, handler, timeout=None):
+        """Dispatch to handler(event, data) until stop()"""
+        while self.is_running:
+            for event, data in self.poll(timeout):
+                handler(event, data)
+
+    def stop(self):
+        with self._cond:
+            self.is_running = False
+            self._cond.notify_all()
+
+    def stats(self):
+        elapsed = max(self.clock() - self.started, 1e-6)
+        return {
+            'wakeups': self.wakeups,
+            'wakeups_per_second': self.wakeups / elapsed,
+            'dispatched': self.dispatched,
+            'timers_fired': self.timers_fired,
+            'reaction': self.reaction.summary(),
+            'timer_lateness': self.timer_lateness.summary()
+        }
+
+
+class CancelToken:
+    """Cancellation flag with an interruptible sleep"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def wait(self, seconds):
+        """Sleep up to `seconds`; True (early) when cancelled"""
+        return self._event.wait(seconds)
+
+
+class BehaviourTask:
+    """Runs one state behaviour at a time as a cancellable thread
+
+    start() stops the previous behaviour first, so two loops can never
+    drive the robot at once. Behaviours take a CancelToken and must only
+    block in token.wait() or in single short robot commands.
+    """
+
+    def __init__(self, stop_timeout=0.5):
+        self.stop_timeout = stop_timeout
+        self.name = None
+        self.thread = None
+        self.token = None
+        self._lock = threading.Lock()
+
+        self.stop_times = LatencyHistogram()
+        self.overruns = 0
+
+    def start(self, name, target, *args):
+        with self._lock:
+            self._stop_locked(self.stop_timeout)
+            self.name = name
+            self.token = CancelToken()
+            self.thread = threading.Thread(target=self._run, args=(name, target, self.token) + args, daemon=True)
+            self.thread.start()
+
+    def _run(self, name, target, token, *args):
+        try:
+            target(token, *args)
+        except Exception as e:
+            print(f"Behaviour error ({name}): {e}")
+
+    def stop(self, timeout=None):
+        """Cancel and wait; False if it did not finish within timeout"""
+        with self._lock:
+            return self._stop_locked(self.stop_timeout if timeout is None else timeout)
+
+    def _stop_locked(self, timeout):
+        thread, token = self.thread, self.token
+        self.thread = None
+        self.token = None
+        if thread is None:
+            return True
+        token.cancel()
+        if thread is threading.current_thread():
+            # a behaviour stopping itself just returns afterwards
+            return True
+
+        start = time.perf_counter()
+        thread.join(timeout)
+        self.stop_times.observe(time.perf_counter() - start)
+        if thread.is_alive():
+            self.overruns += 1
+            print(f"Behaviour {self.name} still running {timeout:.2f}s after cancel")
+            return False
+        return True
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+
+# Dispatch cost vs table size, and concurrent firing
+if __name__ == "__main__":
+    for size in (5, 50, 500):
+        states = [f"S{i}" for i in range(size)]
+        engine = StateMachineEngine(states, "S0", verbose=False)
+        for i, state in enumerate(states):
+            engine.add(state, "next", states[(i + 1) % size])
+            engine.add(state, "noop", state)
+        runs = 20000
+        start = time.perf_counter()
+        for _ in range(runs):
+            engine.fire("next")
+        per_event = (time.perf_counter() - start) / runs
+        print(f"{size:4d} states: {per_event*1e6:.2f}us per transition")
+
+    # eight threads race the same event: exactly one may win each round
+    engine = StateMachineEngine(["A", "B"], "A", verbose=False)
+    engine.add("A", "go", "B")
+    engine.add("B", "back", "A")
+    rounds = 200
+    for _ in range(rounds):
+        barrier = threading.Barrier(8)
+
+        def racer():
+            barrier.wait()
+            engine.fire("go")
+
+        threads = [threading.Thread(target=racer) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        engine.fire("back")
+    print(f"Race: {engine.transitions} transitions for {rounds} rounds (expected {2 * rounds})")
+
+    # reaction latency and idle wakeups: 100 ms polling tick vs event loop
+    import random
+
+    def producer(post, count=15, spread=3.0):
+        rng = random.Random(1)
+        for _ in range(count):
+            time.sleep(rng.uniform(0.0, 2 * spread / count))
+            post()
+
+    # polling: events land in a flag list, the tick looks every 100 ms
+    inbox = deque()
+    latencies = LatencyHistogram()
+    wakeups = 0
+    done = threading.Event()
+    thread = threading.Thread(target=lambda: (producer(lambda: inbox.append(time.monotonic())), done.set()))
+    started = time.monotonic()
+    thread.start()
+    while not done.is_set() or inbox:
+        wakeups += 1
+        while inbox:
+            latencies.observe(time.monotonic() - inbox.popleft())
+        time.sleep(0.1)
+    elapsed = time.monotonic() - started
+    polled = latencies.summary()
+    print(f"Polling 100ms: reaction mean {polled['mean_ms']:.1f}ms max {polled['max_ms']:.1f}ms, "
+          f"{wakeups / elapsed:.1f} wakeups/s")
+
+    loop = EventLoop()
+    thread = threading.Thread(target=lambda: (producer(lambda: loop.post("event")), loop.stop()))
+    thread.start()
+    loop.run(lambda event, data: None)
+    stats = loop.stats()
+    print(f"Event loop:    reaction mean {stats['reaction']['mean_ms']:.2f}ms max {stats['reaction']['max_ms']:.2f}ms, "
+          f"{stats['wakeups_per_second']:.1f} wakeups/s")
+
+    # behaviour stop time: loops of short commands and long waits
+    def patrol_like(token):
+        while not token.cancelled:
+            time.sleep(0.02)        # one robot command
+            if token.wait(2.5):
+                break
+
+    task = BehaviourTask(stop_timeout=0.5)
+    rng = random.Random(2)
+    for _ in range(50):
+        task.start("patrol", patrol_like)
+        time.sleep(rng.uniform(0.0, 0.1))
+        task.stop()
+    stops = task.stop_times.summary()
+    print(f"Behaviour stop: mean {stops['mean_ms']:.1f}ms, max {stops['max_ms']:.1f}ms, "
+          f"{task.overruns} over {task.stop_timeout}s")
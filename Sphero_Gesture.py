@@ -0,0 +1,526 @@
+import argparse
+import glob
+import math
+import os
+import threading
+import time
+import numpy as np
+
+
+GESTURES = ("shake", "tap", "roll", "pickup")
+
+# someone has the robot in hand: wakes it up / satisfies it
+HANDLED_GESTURES = ("shake", "pickup")
+
+# IMU channels each gesture is classified from
+GESTURE_CHANNELS = {
+    'shake': ('accelerometer',),
+    'tap': ('accelerometer',),
+    # rolling is told apart by its rotation rate
+    'roll': ('accelerometer', 'gyroscope'),
+    'pickup': ('orientation', 'gyroscope'),
+}
+
+
+def channels_for(*gestures):
+    """IMU channels needed to detect these gestures (all of them by default)"""
+    needed = set()
+    for gesture in gestures or GESTURES:
+        needed.update(GESTURE_CHANNELS[gesture])
+    return tuple(sorted(needed))
+
+
+class RollingStats:
+    """Mean / variance over the last `size` values, O(1) per push"""
+
+    def __init__(self, size):
+        self.size = size
+        self.values = [0.0] * size
+        self.count = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self._pos = 0
+        self._pushes = 0
+
+    def push(self, x):
+        old = self.values[self._pos]
+        self.values[self._pos] = x
+        self._pos = (self._pos + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+            self.sum += x
+            self.sumsq += x * x
+        else:
+            self.sum += x - old
+            self.sumsq += x * x - old * old
+        self._pushes += 1
+        if self._pushes % (64 * self.size) == 0:
+            # running sums drift, resync now and then
+            self.sum = math.fsum(self.values[:self.count] if self.count < self.size else self.values)
+            self.sumsq = math.fsum(v * v for v in self.values)
+
+    @property
+    def full(self):
+        return self.count == self.size
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        mean = self.sum / self.count
+        return max(0.0, self.sumsq / self.count - mean * mean)
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def oldest(self):
+        """value about to leave the window"""
+        return self.values[self._pos] if self.full else self.values[0]
+
+    def clear(self):
+        self.values = [0.0] * self.size
+        self.count = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self._pos = 0
+
+
+class GestureDetector:
+    """Shake / tap / roll / pickup from rolling IMU window statistics
+
+    Units follow spherov2: orientation in degrees, accelerometer in g,
+    gyroscope in degrees per second. Every update is constant work, so the
+    detector can run on each sample the IMU service produces.
+    """
+
+    def __init__(self, rate_hz=20, window_seconds=1.0, smooth_seconds=0.2,
+                 shake_std=0.35, shake_spikes=3, spike_g=0.5,
+                 tap_g=0.8, tap_quiet_seconds=0.3,
+                 roll_rate=120.0, pickup_angle=20.0, pickup_seconds=1.5, refractory=1.0):
+        self.rate_hz = rate_hz
+        self.window = max(2, int(round(window_seconds * rate_hz)))
+        self.smooth = max(1, int(round(smooth_seconds * rate_hz)))
+        self.pickup_window = max(2, int(round(pickup_seconds * rate_hz)))
+
+        self.shake_std = shake_std
+        self.shake_spikes = shake_spikes
+        self.spike_g = spike_g
+        self.tap_g = tap_g
+        self.tap_quiet = max(1, int(round(tap_quiet_seconds * rate_hz)))
+        self.roll_rate = roll_rate
+        self.pickup_angle = pickup_angle
+        self.refractory = refractory
+
+        self.callbacks = []
+        self.last_fired = {}
+        self.pending = set()
+        self._lock = threading.Lock()
+
+        self.updates = 0
+        self.update_time = 0.0
+        # channels and time of the last IMU sample, to notice a gap or a new selection
+        self._seen = None
+        self.reset()
+
+    def reset(self):
+        # per-axis acceleration and |gyro| over the window
+        self.accel_x = RollingStats(self.window)
+        self.accel_y = RollingStats(self.window)
+        self.accel_z = RollingStats(self.window)
+        self.last_accel = None
+        self.gyro = RollingStats(self.window)
+        # spike indicator: rolling sum is the spike count in the window
+        self.spikes = RollingStats(self.window)
+        # pitch / roll smoothed over a few samples, pickup_seconds of history
+        self.pitch = RollingStats(self.smooth)
+        self.roll = RollingStats(self.smooth)
+        self.tilt_history = RollingStats(self.pickup_window)
+        self.roll_history = RollingStats(self.pickup_window)
+        self.since_spike = None
+
+    def clear(self):
+        """drop latched gestures (stale on state changes)"""
+        with self._lock:
+            self.pending.clear()
+
+    def on_gesture(self, callback):
+        """callback(name, time) when a gesture is recognised"""
+        self.callbacks.append(callback)
+
+    def update(self, t, orientation=None, accel=None, gyro=None):
+        """one IMU sample: (pitch, roll, ...), (x, y, z) g, (x, y, z) deg/s -> gesture or None"""
+        start = time.perf_counter()
+
+        jerk = 0.0
+        if accel is not None:
+            x, y, z = accel[0], accel[1], accel[2]
+            if self.last_accel is not None:
+                # change since the previous sample, in g
+                jerk = math.sqrt((x - self.last_accel[0]) ** 2 + (y - self.last_accel[1]) ** 2
+                                 + (z - self.last_accel[2]) ** 2)
+            self.last_accel = (x, y, z)
+            self.accel_x.push(x)
+            self.accel_y.push(y)
+            self.accel_z.push(z)
+            self.spikes.push(1.0 if jerk > self.spike_g else 0.0)
+        rate = 0.0
+        if gyro is not None:
+            rate = math.sqrt(gyro[0] * gyro[0] + gyro[1] * gyro[1] + gyro[2] * gyro[2])
+            self.gyro.push(rate)
+        tilt_change = 0.0
+        if rate > self.roll_rate:
+            # tilt while spinning fast is rolling, not a pickup
+            self.tilt_history.clear()
+            self.roll_history.clear()
+        if orientation is not None:
+            self.pitch.push(orientation[0])
+            self.roll.push(orientation[1])
+            if self.pitch.full:
+                # smoothed angle now vs pickup_seconds ago: one noisy reading
+                # moves it by 1/smooth, a slow pickup still adds up
+                if self.tilt_history.full:
+                    tilt_change = math.hypot(_angle_diff(self.pitch.mean, self.tilt_history.oldest),
+                                             _angle_diff(self.roll.mean, self.roll_history.oldest))
+                self.tilt_history.push(self.pitch.mean)
+                self.roll_history.push(self.roll.mean)
+
+        gesture = self._classify(jerk, tilt_change)
+        if gesture and t - self.last_fired.get(gesture, -math.inf) < self.refractory:
+            gesture = None
+        if gesture:
+            self._fire(gesture, t)
+
+        self.updates += 1
+        self.update_time += time.perf_counter() - start
+        return gesture
+
+    @property
+    def accel_std(self):
+        """spread of the acceleration vector over the window, g"""
+        return math.sqrt(self.accel_x.variance + self.accel_y.variance + self.accel_z.variance)
+
+    def _classify(self, jerk, tilt_change):
+        spikes = round(self.spikes.sum)
+        accel_std = self.accel_std
+        if self.accel_x.full and accel_std > self.shake_std and spikes >= self.shake_spikes:
+            self.since_spike = None
+            return "shake"
+
+        # tap: one knock (a jump and its return), then quiet for a moment,
+        # so the first swing of a shake is not a tap
+        if jerk > self.tap_g and spikes <= 2:
+            if self.since_spike is None:
+                self.since_spike = 0
+        elif self.since_spike is not None:
+            self.since_spike += 1
+            if spikes > 2:
+                self.since_spike = None
+            elif self.since_spike >= self.tap_quiet:
+                self.since_spike = None
+                return "tap"
+
+        if self.gyro.full and self.gyro.mean > self.roll_rate and accel_std < self.shake_std:
+            return "roll"
+        if tilt_change > self.pickup_angle and self.gyro.mean <= self.roll_rate and spikes < self.shake_spikes:
+            return "pickup"
+        return None
+
+    def _fire(self, gesture, t):
+        self.last_fired[gesture] = t
+        # the tilt that went with this gesture must not read as a pickup later
+        self.tilt_history.clear()
+        self.roll_history.clear()
+        with self._lock:
+            self.pending.add(gesture)
+        for callback in list(self.callbacks):
+            try:
+                callback(gesture, t)
+            except Exception as e:
+                print(f"Gesture callback error: {e}")
+
+    def take(self, *gestures):
+        """True (and unlatch) if any of these fired since the last take"""
+        with self._lock:
+            hit = self.pending.intersection(gestures)
+            self.pending.difference_update(hit)
+            return bool(hit)
+
+    def attach(self, imu):
+        """run on every sample of an IMUService"""
+        imu.subscribe(self._on_imu)
+
+    def _on_imu(self, imu, t):
+        # after a pause or a change of channels the windows hold stale samples
+        if self._seen is None or self._seen[0] != imu.active or t - self._seen[1] > 0.5:
+            self.reset()
+        self._seen = (imu.active, t)
+        # channels the service is not reading right now would only repeat a stale sample
+        orientation = imu.latest('orientation') if 'orientation' in imu.active else None
+        accel = imu.latest('accelerometer') if 'accelerometer' in imu.active else None
+        gyro = imu.latest('gyroscope') if 'gyroscope' in imu.active else None
+        self.update(
+            t,
+            (orientation['pitch'], orientation['roll']) if orientation else None,
+            (accel['x'], accel['y'], accel['z']) if accel else None,
+            (gyro['x'], gyro['y'], gyro['z']) if gyro else None
+        )
+
+    def stats(self):
+        return {
+            'updates': self.updates,
+            'update_us': 1e6 * self.update_time / self.updates if self.updates else 0.0,
+            'last_fired': dict(self.last_fired)
+        }
+
+
+def _angle_diff(a, b):
+    return (a - b + 180.0) % 360.0 - 180.0
+
+
+# Corpus --------------------------------------------------------------
+# A recording is an .npz with t (n,), orientation (n, 2), accel (n, 3),
+# gyro (n, 3) and label ("none" or a gesture).
+
+def save_recording(path, t, orientation, accel, gyro, label):
+    np.savez_compressed(path, t=np.asarray(t), orientation=np.asarray(orientation),
+                        accel=np.asarray(accel), gyro=np.asarray(gyro), label=np.array(label))
+
+
+def load_recording(path):
+    data = np.load(path)
+    return {
+        't': data['t'], 'orientation': data['orientation'], 'accel': data['accel'],
+        'gyro': data['gyro'], 'label': str(data['label']), 'name': os.path.basename(path)
+    }
+
+
+def synthesize(label, rate_hz=20, seed=0):
+    """3 s clip: rest, the gesture, rest, with sensor noise"""
+    rng = np.random.default_rng(seed)
+    name = f"synthetic-{label}-{seed}"
+    n = 3 * rate_hz
+    t = np.arange(n) / rate_hz
+    orientation = rng.normal(0.0, 1.5, (n, 2))
+    accel = np.tile([0.0, 0.0, 1.0], (n, 1)) + rng.normal(0.0, 0.03, (n, 3))
+    gyro = rng.normal(0.0, 5.0, (n, 3))
+    active = slice(rate_hz, 2 * rate_hz)
+    phase = t[active] - 1.0
+
+    if label == "shake":
+        # ~5 Hz back and forth, sampled at 20 Hz
+        accel[active, 0] += 1.5 * np.sin(2 * np.pi * 5 * phase + rng.uniform(0, np.pi))
+        gyro[active, 2] += 200 * np.cos(2 * np.pi * 5 * phase)
+    elif label == "tap":
+        accel[rate_hz + rate_hz // 2, 2] += rng.uniform(1.2, 2.0)
+    elif label == "roll":
+        gyro[active, 1] += rng.uniform(200, 400)
+        orientation[active, 0] += np.cumsum(np.full(rate_hz, 15.0))
+        orientation[2 * rate_hz:, 0] += 15.0 * rate_hz
+    elif label == "pickup":
+        # slow lift and tilt over a second or more
+        angle = rng.uniform(25, 45)
+        ramp = np.clip((t - 0.8) / 1.5, 0, 1)
+        orientation[:, 0] += angle * ramp
+        accel[:, 2] += 0.1 * np.exp(-((t - 1.2) / 0.2) ** 2)
+        gyro[:, 0] += angle / 1.5 * ((t > 0.8) & (t < 2.3))
+    elif label == "glitch":
+        # a single bad orientation reading, the old two-sample check fires on it
+        orientation[rate_hz + rate_hz // 2] += rng.uniform(8, 15, 2)
+        label = "none"
+    return {'t': t, 'orientation': orientation, 'accel': accel, 'gyro': gyro,
+            'label': label, 'name': name}
+
+
+def synthesize_held_out(label, rate_hz=20, seed=0):
+    """4 s clip with every parameter drawn from wide ranges of plausible handling,
+    not from the ones the thresholds were tuned on: onset, length, axis, strength, noise"""
+    rng = np.random.default_rng(10_000 + seed)
+    name = f"held-out-{label}-{seed}"
+    n = 4 * rate_hz
+    t = np.arange(n) / rate_hz
+    noise = rng.uniform(1.0, 2.0)
+    orientation = rng.uniform(-10, 10, 2) + rng.normal(0.0, 1.5 * noise, (n, 2))
+    accel = np.tile([0.0, 0.0, 1.0], (n, 1)) + rng.normal(0.0, 0.03 * noise, (n, 3))
+    gyro = rng.normal(0.0, 5.0 * noise, (n, 3))
+    onset = rng.uniform(0.8, 1.5)
+    length = rng.uniform(0.5, 1.5)
+    during = (t >= onset) & (t < onset + length)
+    phase = t - onset
+    axis = rng.normal(size=2)
+    axis /= np.linalg.norm(axis)
+
+    if label == "shake":
+        freq = rng.uniform(3.0, 7.0)
+        swing = rng.uniform(0.8, 2.5) * np.sin(2 * np.pi * freq * phase + rng.uniform(0, 2 * np.pi)) * during
+        accel[:, 0] += axis[0] * swing
+        accel[:, 1] += axis[1] * swing
+        gyro[:, 2] += rng.uniform(100, 300) * np.cos(2 * np.pi * freq * phase) * during
+    elif label == "tap":
+        k = int(onset * rate_hz)
+        direction = rng.integers(3)
+        accel[k, direction] += rng.choice([-1, 1]) * rng.uniform(0.8, 2.5)
+    elif label == "roll":
+        rate = rng.uniform(90, 360)
+        gyro[during, 1] += rate
+        orientation[:, 0] += np.cumsum(during) * rate / rate_hz
+    elif label == "pickup":
+        angle = rng.uniform(15, 60) * rng.choice([-1, 1])
+        lift = rng.uniform(0.5, 2.5)
+        ramp = np.clip(phase / lift, 0, 1)
+        tilt = rng.uniform(0, 2 * np.pi)
+        orientation[:, 0] += angle * np.cos(tilt) * ramp
+        orientation[:, 1] += angle * np.sin(tilt) * ramp
+        accel[:, 2] += rng.uniform(0.05, 0.3) * np.exp(-((phase - lift / 3) / 0.2) ** 2)
+        gyro[:, 0] += angle / lift * ((phase > 0) & (phase < lift))
+    elif label == "glitch":
+        orientation[int(onset * rate_hz)] += rng.uniform(5, 20, 2) * rng.choice([-1, 1], 2)
+        label = "none"
+    return {'t': t, 'orientation': orientation, 'accel': accel, 'gyro': gyro,
+            'label': label, 'name': name}
+
+
+def synthetic_corpus(per_label=20, rate_hz=20, held_out=False):
+    """the clips the thresholds were tuned on, or held-out ones drawn independently"""
+    labels = GESTURES + ("none", "glitch")
+    make = synthesize_held_out if held_out else synthesize
+    return [make(label, rate_hz, seed) for label in labels for seed in range(per_label)]
+
+
+def replay(recording, detector):
+    """feed one recording through a fresh detector state, return gestures seen"""
+    detector.reset()
+    detector.last_fired = {}
+    seen = []
+    for i in range(len(recording['t'])):
+        gesture = detector.update(float(recording['t'][i]), recording['orientation'][i],
+                                  recording['accel'][i], recording['gyro'][i])
+        if gesture:
+            seen.append(gesture)
+    return seen
+
+
+def _two_sample_change(recording):
+    """largest pitch/roll change between consecutive samples, degrees"""
+    delta = np.diff(recording['orientation'][:, :2], axis=0)
+    return float(np.max(np.hypot(delta[:, 0], delta[:, 1])))
+
+
+def calibrate_two_sample(corpus, margin=1.2):
+    """the old check's threshold set just above the noise of the resting clips
+
+    The robot used 0.3 on degrees, under the sensor noise, so it fired on
+    everything; a calibrated threshold is the fair comparison.
+    """
+    rest = [_two_sample_change(recording) for recording in corpus
+            if recording['label'] == "none" and "glitch" not in recording['name']]
+    return margin * max(rest)
+
+
+def two_sample_baseline(recording, threshold):
+    """the old detect_shake / detect_wakeup: consecutive pitch/roll difference over a threshold"""
+    return _two_sample_change(recording) > threshold
+
+
+def evaluate(corpus, detector, threshold):
+    """per label: exact gesture right, wake decision right (windowed), wake decision right (two-sample)
+
+    A clip's gesture is right when exactly its gesture (or nothing) fires;
+    its wake decision is right when a handled gesture fires exactly for
+    shake and pickup clips.
+    """
+    results = {}
+    for recording in corpus:
+        seen = set(replay(recording, detector))
+        label = recording['label']
+        expected = set() if label == "none" else {label}
+        should_wake = label in HANDLED_GESTURES
+        woke = bool(seen.intersection(HANDLED_GESTURES))
+        row = results.setdefault(label, [0, 0, 0, 0])
+        row[0] += seen == expected
+        row[1] += woke == should_wake
+        row[2] += two_sample_baseline(recording, threshold) == should_wake
+        row[3] += 1
+    return results
+
+
+def record(path, label, seconds, rate_hz=20):
+    """record one labelled clip from the robot"""
+    from spherov2 import scanner
+    from spherov2.sphero_edu import SpheroEduAPI
+    from Sphero_IMU import IMUService
+
+    toy = scanner.find_toy(toy_name="SB-D96A")
+    if not toy:
+        print("Device not found")
+        return False
+    with SpheroEduAPI(toy) as api:
+        imu = IMUService(api, rate_hz=rate_hz, history_seconds=seconds + 1)
+        imu.start()
+        print(f"Recording '{label}' for {seconds}s...")
+        time.sleep(seconds)
+        imu.stop()
+    # align the three channels on the orientation timestamps
+    t, orientation = imu.window('orientation')
+    _, accel = imu.window('accelerometer', count=len(t))
+    _, gyro = imu.window('gyroscope', count=len(t))
+    n = min(len(t), len(accel), len(gyro))
+    save_recording(path, t[-n:] - t[-n], orientation[-n:, :2], accel[-n:], gyro[-n:], label)
+    print(f"Saved {n} samples to {path}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an IMU gesture corpus")
+    parser.add_argument("corpus", nargs="?", help="directory of .npz recordings (default: synthetic)")
+    parser.add_argument("--rate", type=int, default=20, help="sample rate in Hz")
+    parser.add_argument("--save", help="write the synthetic corpus to this directory")
+    parser.add_argument("--record", help="record one clip from the robot to this .npz")
+    parser.add_argument("--label", default="none", choices=GESTURES + ("none",))
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record, args.label, args.seconds, args.rate)
+        return
+
+    tuning = synthetic_corpus(rate_hz=args.rate)
+    if args.corpus:
+        corpus = [load_recording(path) for path in sorted(glob.glob(os.path.join(args.corpus, "*.npz")))]
+        corpora = {args.corpus: corpus}
+        # the two-sample threshold comes from the resting clips' noise, the recorded ones if any
+        resting = any(recording['label'] == "none" for recording in corpus)
+        threshold = calibrate_two_sample(corpus if resting else tuning)
+    else:
+        threshold = calibrate_two_sample(tuning)
+        # the tuning clips only show the thresholds fit what they were chosen on
+        corpora = {"synthetic (tuning)": tuning,
+                   "synthetic (held-out)": synthetic_corpus(rate_hz=args.rate, held_out=True)}
+    if args.save:
+        os.makedirs(args.save, exist_ok=True)
+        for corpus in corpora.values():
+            for recording in corpus:
+                save_recording(os.path.join(args.save, recording['name'] + ".npz"), recording['t'],
+                               recording['orientation'], recording['accel'], recording['gyro'],
+                               recording['label'])
+        print(f"Saved {sum(len(corpus) for corpus in corpora.values())} recordings to {args.save}")
+
+    detector = GestureDetector(rate_hz=args.rate)
+    print(f"two-sample threshold {threshold:.1f} deg (calibrated on resting clips)")
+    for name, corpus in corpora.items():
+        results = evaluate(corpus, detector, threshold)
+        print(f"\n{name}: {len(corpus)} clips")
+        print(f"{'label':8s} {'gesture':>9s} {'wake':>9s} {'two-sample wake':>16s}")
+        for label, (exact, wake, base, total) in sorted(results.items()):
+            print(f"{label:8s} {exact:4d}/{total:<4d} {wake:4d}/{total:<4d} {base:9d}/{total:<4d}")
+    stats = detector.stats()
+    print(f"\n{stats['updates']} samples, {stats['update_us']:.1f}us per update")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+import threading
+import time
+import numpy as np
+from Sphero_Metrics import LatencyHistogram
+
+
+# channel -> (api getter, fields)
+IMU_CHANNELS = {
+    'orientation': ('get_orientation', ('pitch', 'roll', 'yaw')),
+    'quaternion': ('get_quaternion', ('w', 'x', 'y', 'z')),
+    'accelerometer': ('get_acceleration', ('x', 'y', 'z')),
+    'gyroscope': ('get_gyroscope', ('x', 'y', 'z')),
+    'velocity': ('get_velocity', ('x', 'y')),
+}
+
+
+def read_fields(value, fields):
+    """dict or attribute object (quaternion) -> tuple of floats, None if incomplete"""
+    if value is None:
+        return None
+    try:
+        if isinstance(value, dict):
+            return tuple(float(value[name]) for name in fields)
+        return tuple(float(getattr(value, name)) for name in fields)
+    except (KeyError, AttributeError, TypeError, ValueError):
+        return None
+
+
+class SensorRing:
+    """Preallocated timestamped ring of fixed-width samples"""
+
+    def __init__(self, capacity, width):
+        self.capacity = int(capacity)
+        self.width = width
+        # every sample is written twice so windows never wrap
+        self._times = np.zeros(2 * self.capacity)
+        self._values = np.zeros((2 * self.capacity, width))
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def append(self, t, values):
+        with self._lock:
+            pos = self.total % self.capacity
+            self._times[pos] = self._times[pos + self.capacity] = t
+            self._values[pos] = self._values[pos + self.capacity] = values
+            self.total += 1
+
+    def latest(self):
+        """(time, values) of the newest sample, None while empty"""
+        with self._lock:
+            if not self.total:
+                return None
+            pos = (self.total - 1) % self.capacity
+            return float(self._times[pos]), tuple(self._values[pos].tolist())
+
+    def window(self, count=None, since=None):
+        """(times, values) copies, oldest first: last `count` samples and/or those after `since`"""
+        with self._lock:
+            n = min(self.total, self.capacity)
+            if count is not None:
+                n = min(n, count)
+            start = (self.total - n) % self.capacity
+            times = self._times[start:start + n]
+            values = self._values[start:start + n]
+            if since is not None:
+                first = int(np.searchsorted(times, since, side='right'))
+                times, values = times[first:], values[first:]
+            return times.copy(), values.copy()
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+
+class IMUService:
+    """One sampler for every IMU consumer
+
+    A single thread reads the selected channels at a fixed rate into
+    SensorRings; consumers take the latest sample or a window from memory
+    instead of asking the robot themselves. select() narrows the reads to
+    the channels the current consumers use; with none selected the thread
+    sleeps.
+    """
+
+    def __init__(self, api, rate_hz=20, channels=('orientation', 'accelerometer', 'gyroscope'),
+                 history_seconds=10.0):
+        self.api = api
+        self.rate_hz = rate_hz
+        self.channels = {name: IMU_CHANNELS[name] for name in channels}
+        self.rings = {name: SensorRing(max(1, int(history_seconds * rate_hz)), len(fields))
+                      for name, (_, fields) in self.channels.items()}
+        self.subscribers = []
+        # channels read each tick, all of them until select()
+        self.active = tuple(self.channels)
+        self._resume = threading.Event()
+        self._resume.set()
+
+        self.is_running = False
+        self.sample_thread = None
+
+        self.ticks = 0
+        self.reads = 0
+        self.started = None
+        self.errors = {name: 0 for name in self.channels}
+        self.lateness = LatencyHistogram()
+        self.read_time = LatencyHistogram()
+
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        self.started = time.monotonic()
+        self.sample_thread = threading.Thread(target=self._sample_loop, daemon=True)
+        self.sample_thread.start()
+        print(f"IMU sampling {', '.join(self.active) or 'nothing'} at {self.rate_hz} Hz")
+
+    def stop(self):
+        self.is_running = False
+        self._resume.set()
+        if self.sample_thread:
+            self.sample_thread.join(timeout=1)
+            self.sample_thread = None
+
+    def _sample_loop(self):
+        period = 1.0 / self.rate_hz
+        next_tick = time.perf_counter()
+        while self.is_running:
+            if not self._resume.is_set():
+                # nothing selected: no reads until select() or stop()
+                self._resume.wait()
+                next_tick = time.perf_counter()
+                continue
+            self.lateness.observe(max(0.0, time.perf_counter() - next_tick))
+            self.sample_once()
+
+            # absolute deadlines, no drift
+            next_tick += period
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.perf_counter()
+
+    def select(self, channels):
+        """read only these channels from now on; none pauses the sampler"""
+        unknown = set(channels) - set(self.channels)
+        if unknown:
+            raise ValueError(f"IMU channels not configured: {', '.join(sorted(unknown))}")
+        # keep the configured order
+        self.active = tuple(name for name in self.channels if name in channels)
+        if self.active:
+            self._resume.set()
+        else:
+            self._resume.clear()
+
+    def sample_once(self):
+        """read every selected channel once, then notify subscribers"""
+        start = time.perf_counter()
+        now = time.time()
+        for name in self.active:
+            getter, fields = self.channels[name]
+            self.reads += 1
+            try:
+                values = read_fields(getattr(self.api, getter)(), fields)
+            except Exception as e:
+                if not self.errors[name]:
+                    print(f"IMU {name} read failed: {e}")
+                values = None
+            if values is None:
+                self.errors[name] += 1
+                continue
+            self.rings[name].append(now, values)
+        self.read_time.observe(time.perf_counter() - start)
+        self.ticks += 1
+        self._notify(now)
+
+    def feed(self, channel, values, t=None, notify=True):
+        """push a sample from elsewhere (replay, simulator); notify=False until the last channel"""
+        t = time.time() if t is None else t
+        self.rings[channel].append(t, values)
+        if notify:
+            self._notify(t)
+
+    def _notify(self, t):
+        for callback in list(self.subscribers):
+            try:
+                callback(self, t)
+            except Exception as e:
+                print(f"IMU subscriber error: {e}")
+
+    def subscribe(self, callback):
+        """callback(service, time) after every sample"""
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def latest(self, channel):
+        """newest sample as a dict (fields + 'time'), None before the first one"""
+        sample = self.rings[channel].latest()
+        if sample is None:
+            return None
+        t, values = sample
+        reading = dict(zip(self.channels[channel][1], values))
+        reading['time'] = t
+        return reading
+
+    def snapshot(self):
+        return {name: self.latest(name) for name in self.channels}
+
+    def window(self, channel, seconds=None, count=None):
+        """(times, values) of the last `seconds` and/or `count` samples"""
+        since = None if seconds is None else time.time() - seconds
+        return self.rings[channel].window(count, since)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        return {
+            'ticks': self.ticks,
+            'active': self.active,
+            'reads': self.reads,
+            'reads_per_second': self.reads / elapsed if elapsed else 0.0,
+            'errors': dict(self.errors),
+            'samples': {name: ring.total for name, ring in self.rings.items()},
+            'lateness': self.lateness.summary(),
+            'read_time': self.read_time.summary()
+        }
+
+
+# Shared sampler vs one poll per consumer, simulated 5 ms BLE reads
+if __name__ == "__main__":
+    class SlowApi:
+        """every getter costs a round trip"""
+
+        def __init__(self, latency=0.005):
+            self.latency = latency
+            self.calls = 0
+
+        def _read(self, **values):
+            self.calls += 1
+            time.sleep(self.latency)
+            return values
+
+        def get_orientation(self):
+            return self._read(pitch=0.0, roll=0.0, yaw=0.0)
+
+        def get_acceleration(self):
+            return self._read(x=0.0, y=0.0, z=1.0)
+
+        def get_gyroscope(self):
+            return self._read(x=0.0, y=0.0, z=0.0)
+
+        def get_velocity(self):
+            return self._read(x=0.0, y=0.0)
+
+    def polled(consumers, duration):
+        """every consumer asks the robot itself"""
+        api = SlowApi()
+        is_running = [True]
+
+        def poll():
+            while is_running[0]:
+                api.get_orientation()
+                time.sleep(0.05)
+
+        threads = [threading.Thread(target=poll, daemon=True) for _ in range(consumers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        is_running[0] = False
+        for thread in threads:
+            thread.join()
+        return api.calls / duration
+
+    def shared(consumers, duration):
+        """one sampler, consumers read memory"""
+        api = SlowApi()
+        imu = IMUService(api, rate_hz=20, channels=('orientation',))
+
+        def consume():
+            while imu.is_running:
+                imu.latest('orientation')
+                time.sleep(0.05)
+
+        imu.start()
+        threads = [threading.Thread(target=consume, daemon=True) for _ in range(consumers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        imu.stop()
+        for thread in threads:
+            thread.join()
+        return api.calls / duration, imu.stats()
+
+    # consumers each wanting orientation at 20 Hz
+    for consumers in (1, 2, 4):
+        before = polled(consumers, 1.0)
+        after, stats = shared(consumers, 1.0)
+        print(f"{consumers} consumers: polling {before:4.0f} reads/s, shared {after:4.0f} reads/s "
+              f"(tick lateness p95<={stats['lateness']['p95_ms']:.0f}ms)")
+
+    # the state machine's sampler: every channel in every state vs what each
+    # state reads (as in SpheroStateMachine.imu_channels)
+    from Sphero_Gesture import HANDLED_GESTURES, channels_for
+    from Sphero_Collision import COLLISION_CHANNELS
+
+    everything = ('orientation', 'accelerometer', 'gyroscope', 'velocity')
+    per_state = {
+        'SLEEP': channels_for(*HANDLED_GESTURES),
+        'PATROL': COLLISION_CHANNELS,
+        'ANGRY': channels_for(*HANDLED_GESTURES),
+        'INTERACT': (),
+        'SATISFIED': ()
+    }
+    for state, channels in per_state.items():
+        api = SlowApi()
+        imu = IMUService(api, channels=everything)
+        imu.select(channels)
+        imu.start()
+        time.sleep(1.0)
+        imu.stop()
+        print(f"{state:9s}: all channels {len(everything) * imu.rate_hz:3d} reads/s, "
+              f"selected {imu.stats()['reads_per_second']:3.0f} reads/s ({', '.join(channels) or 'paused'})")
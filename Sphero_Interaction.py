@@ -7,6 +7,10 @@ from spherov2.types import Color
 from Sphero_Pattern import SpheroPattern
 from Sphero_Voice import SpheroVoiceRecognition
 from Sphero_Vision import SpheroVision
+from Sphero_Control import SpheroVisualServo
+from Sphero_FSM import EventLoop
+from Sphero_IMU import IMUService
+from Sphero_Gesture import GestureDetector, HANDLED_GESTURES, channels_for
 
 
 class SpheroInteraction:
@@ -16,13 +20,16 @@ class SpheroInteraction:
         self.api = None
         self.patterns = SpheroPattern()
         self.voice = SpheroVoiceRecognition()
-        self.vision = SpheroVision()
+        self.vision = SpheroVision(hist_tracking=True)
+        self.servo = None
         
         # state management
         self.current_state = "sleeping"  # sleeping, awake, idle, tracking
         self.is_running = True
         
         # orientation detection parameters
+        self.imu = None
+        self.gestures = None
         self.last_orientation = None 
         self.wakeup_threshold = 0.2 
         
@@ -32,10 +39,18 @@ class SpheroInteraction:
         # angry state
         self.angry_mode = False
         self.angry_start_time = None
+        self.angry_duration = 7
+        self._angry_timer = None
+        
+        # keys, voice and timers wake the main loop, no polling tick
+        self.events = EventLoop()
+        self.wakeup_poll_interval = 0.2
+        self.blink_interval = 2.0
         
         # tracking parameters
         self.tracking_speed = 60
         self.dead_zone = 50  
+        self.control_rate = 20
 
     def connect(self):
         try:
@@ -47,6 +62,15 @@ class SpheroInteraction:
             
             self.api = SpheroEduAPI(self.toy)
             self.api.__enter__()
+            
+            # shared IMU sampler, wakeup reads it instead of the robot
+            self.imu = IMUService(self.api)
+            self.gestures = GestureDetector(rate_hz=self.imu.rate_hz)
+            self.gestures.attach(self.imu)
+            self.gestures.on_gesture(self.on_gesture)
+            # only sleep mode reads the IMU
+            self.imu.select(())
+            self.imu.start()
 
             time.sleep(1)
             
@@ -57,6 +81,19 @@ class SpheroInteraction:
             return False
 
     def disconnect(self):
+        self.events.stop()
+        stats = self.events.stats()
+        if stats['dispatched']:
+            print(f"Events: {stats['dispatched']} handled, {stats['wakeups_per_second']:.1f} wakeups/s")
+        
+        # stop servo
+        if self.servo:
+            self.servo.stop()
+        
+        # stop IMU sampler
+        if self.imu:
+            self.imu.stop()
+        
         # stop visual tracking
         if self.vision:
             self.vision.stop_tracking()
@@ -89,27 +126,60 @@ class SpheroInteraction:
         try:
             if key == keyboard.Key.esc:
                 self.is_running = False
+                self.events.post("quit")
                 return False 
             
             elif hasattr(key, 'char') and key.char == 's':
-                if self.current_state == "awake":
-                    print("Press 's' for chasing")
-                    self.current_state = "tracking"
-                    green_color = Color(0, 255, 0)
-                    self.api.set_front_led(green_color)
-                    self.api.set_back_led(green_color)
-                    print("LED set to green")
+                self.events.post("track")
         except AttributeError:
             pass
     
+    def on_gesture(self, gesture, t):
+        """IMU thread: wake gestures go to the main loop as events"""
+        if gesture in HANDLED_GESTURES:
+            self.events.post("wakeup", t)
+    
+    def start_tracking(self):
+        if self.current_state == "awake":
+            print("Press 's' for chasing")
+            self.current_state = "tracking"
+            green_color = Color(0, 255, 0)
+            self.api.set_front_led(green_color)
+            self.api.set_back_led(green_color)
+            print("LED set to green")
+            self.vision.reset_target_track()
+            if self.servo and not self.angry_mode:
+                self.servo.start()
+    
+    def end_angry(self):
+        print("😌 ")
+        self.angry_mode = False
+        self.patterns.show_expression(self.api, "ishmael")
+        if self.current_state == "tracking":
+            self.servo.start()
+    
+    def handle_event(self, event, data=None):
+        """main loop thread"""
+        if event == "track":
+            self.start_tracking()
+        elif event == "angry_over":
+            self.end_angry()
+    
     def trigger_angry(self):
         print("😠 ")
         
         self.angry_mode = True
         self.angry_start_time = time.time()
         
+        # a new trigger restarts the countdown
+        if self._angry_timer:
+            self._angry_timer.cancel()
+        self._angry_timer = self.events.call_later(self.angry_duration, "angry_over")
+        
         # Stop Chasing
         if self.current_state == "tracking":
+            if self.servo:
+                self.servo.stop()
             self.api.set_speed(0)
         
         # Angry face
@@ -119,42 +189,20 @@ class SpheroInteraction:
         self.api.spin(720, 1) 
     
     def navigate_to_target(self, result):
+        """hand the latest frame to the servo loop"""
         if self.current_state != "tracking":
             return
         
         if self.angry_mode:
             return
-    
-        if result['target_found']:
-            print("Detected red Whale, full speed ahead!")
+        
+        # steering runs at control_rate in the servo thread
+        if self.servo:
+            self.servo.update_estimate(result)
+        elif result['target_found']:
             self.api.set_speed(self.tracking_speed)
         else:
             self.api.set_speed(0)
-        
-        # if not result['sphero_found']:
-        #     print("Didn't find Sphero (green LED)")
-        #     self.api.set_speed(0)
-        #     return
-        # 
-        # if not result['target_found']:
-        #     self.api.set_speed(0)
-        #     return
-        # 
-        # angle = float(result['relative_angle'])
-        # distance = float(result['distance'])
-        # sphero_heading = int((90 - angle) % 360)
-        # 
-        # if distance > 150:
-        #     speed = self.tracking_speed
-        # elif distance > 80:
-        #     speed = 15
-        # else:
-        #     speed = 0
-        # 
-        # if speed > 0:
-        #     self.api.roll(sphero_heading, speed, 0.3)
-        # else:
-        #     self.api.set_speed(0)
 
     def play_wakeup_speech(self):
         try:
@@ -181,9 +229,9 @@ class SpheroInteraction:
 
 
     def detect_wakeup(self):
-        """orientation"""
+        """orientation, when there is no gesture detector"""
         try:
-            orient = self.api.get_orientation()
+            orient = self.imu.latest('orientation') if self.imu else self.api.get_orientation()
             if not orient:
                 return False
             
@@ -214,26 +262,41 @@ class SpheroInteraction:
         print("Shake or pick up to wake up\n")
 
         blink_state = False
-        counter = 0
-
-        while self.is_running and self.current_state == "sleeping":
-            try:
-                time.sleep(0.2)
-                counter += 1
+        asleep_since = time.time()
+        # gestures arrive as "wakeup" events; only without them is orientation polled
+        poll_timer = None
+        if not self.gestures:
+            poll_timer = self.events.call_every(self.wakeup_poll_interval, "poll_wakeup")
+        blink_timer = self.events.call_every(self.blink_interval, "blink")
+        if self.imu:
+            self.imu.select(channels_for(*HANDLED_GESTURES))
 
-                if self.detect_wakeup():
-                    self.wakeup_sequence()
-                    break
+        try:
+            while self.is_running and self.current_state == "sleeping":
+                for event, data in self.events.poll():
+                    if self.current_state != "sleeping":
+                        # woke up earlier in this batch, the rest belongs to the main loop
+                        self.handle_event(event, data)
+                        continue
+                    try:
+                        # only gestures made while asleep count
+                        if (event == "wakeup" and data >= asleep_since) or \
+                                (event == "poll_wakeup" and self.detect_wakeup()):
+                            self.wakeup_sequence()
 
-                if counter % 10 == 0:
-                    blink_state = not blink_state
-                    brightness = 20 if blink_state else 0
-                    self.api.set_front_led(Color(brightness, brightness, brightness))
+                        elif event == "blink":
+                            blink_state = not blink_state
+                            brightness = 20 if blink_state else 0
+                            self.api.set_front_led(Color(brightness, brightness, brightness))
 
-            except Exception as e:
-                print(f" {e}")
-                time.sleep(0.5)
-                continue
+                    except Exception as e:
+                        print(f" {e}")
+        finally:
+            if poll_timer:
+                poll_timer.cancel()
+            blink_timer.cancel()
+            if self.imu:
+                self.imu.select(())
 
     def start_sleeping_mode(self):
 
@@ -254,6 +317,10 @@ class SpheroInteraction:
                 # initialize camera
                 camera_ready = self.vision.initialize_camera()
                 
+                # closed loop controller
+                self.servo = SpheroVisualServo(self.api, rate_hz=self.control_rate,
+                                               max_speed=self.tracking_speed)
+                
                 # start voice listening
                 self.voice.start_listening(callback=self.trigger_angry)
                 
@@ -261,19 +328,19 @@ class SpheroInteraction:
                 
                 # main loop
                 while self.is_running:
-                    if self.angry_mode and self.angry_start_time:
-                        if time.time() - self.angry_start_time > 7:
-                            print("😌 ")
-                            self.angry_mode = False
-                            self.patterns.show_expression(self.api, "ishmael")
-                    
-                    # tracking mode
+                    # tracking mode (paced by the camera, events in between frames)
                     if self.current_state == "tracking" and camera_ready:
+                        for event, data in self.events.poll(timeout=0):
+                            self.handle_event(event, data)
+                        
                         result = self.vision.detect_sphero_and_target(show_preview=True)
 
                         self.navigate_to_target(result)
+                        continue
                     
-                    time.sleep(0.1)
+                    # otherwise sleep until a key, voice event or timer
+                    for event, data in self.events.poll():
+                        self.handle_event(event, data)
         except KeyboardInterrupt:
             print("\n\ninterrupted")
             self.is_running = False
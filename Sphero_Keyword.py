@@ -0,0 +1,429 @@
+import os
+import sys
+import time
+import wave
+import numpy as np
+
+
+SAMPLE_RATE = 16000
+KEYWORD_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "keyword_templates.npz")
+# bumped whenever MFCC output changes; older templates must be re-enrolled
+FEATURE_VERSION = 2
+
+
+def keyword_model_path(phrase, base=KEYWORD_MODEL_PATH):
+    """Templates of an extra phrase live next to the main model: keyword_templates_go_to_sleep.npz"""
+    root, ext = os.path.splitext(base)
+    return f"{root}_{'_'.join(phrase.lower().split())}{ext}"
+
+
+def load_wav(path, rate=SAMPLE_RATE):
+    """Mono float32 samples in [-1, 1] at `rate`"""
+    with wave.open(path, "rb") as f:
+        channels = f.getnchannels()
+        width = f.getsampwidth()
+        source_rate = f.getframerate()
+        raw = f.readframes(f.getnframes())
+
+    dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[width]
+    samples = np.frombuffer(raw, dtype=dtype).astype(np.float32)
+    if width == 1:
+        samples = (samples - 128.0) / 128.0
+    else:
+        samples /= float(2 ** (8 * width - 1))
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    if source_rate != rate:
+        # linear resample, enough for MFCCs
+        n = int(len(samples) * rate / source_rate)
+        samples = np.interp(np.linspace(0, len(samples) - 1, n), np.arange(len(samples)), samples)
+    return samples.astype(np.float32)
+
+
+def pcm16_to_float(raw):
+    """Bytes of 16-bit PCM to float32"""
+    return np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+class MFCC:
+    """MFCC extractor, filterbank and DCT computed once"""
+
+    def __init__(self, rate=SAMPLE_RATE, frame_ms=25, hop_ms=10, n_fft=512,
+                 n_mels=26, n_ceps=13, pre_emphasis=0.97):
+        self.rate = rate
+        self.frame_len = int(rate * frame_ms / 1000)
+        self.hop = int(rate * hop_ms / 1000)
+        self.n_fft = n_fft
+        self.n_ceps = n_ceps
+        self.pre_emphasis = pre_emphasis
+        self.window = np.hamming(self.frame_len).astype(np.float32)
+        self.filterbank = self._mel_filterbank(n_mels)
+        # c0 (log energy) left out: the input level does not change the features
+        self.dct = self._dct_matrix(n_mels, n_ceps + 1)[1:]
+
+    def _mel_filterbank(self, n_mels):
+        def hz_to_mel(hz):
+            return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+        def mel_to_hz(mel):
+            return 700.0 * (10 ** (mel / 2595.0) - 1.0)
+
+        mels = np.linspace(hz_to_mel(0), hz_to_mel(self.rate / 2), n_mels + 2)
+        bins = np.floor((self.n_fft + 1) * mel_to_hz(mels) / self.rate).astype(int)
+
+        bank = np.zeros((n_mels, self.n_fft // 2 + 1), dtype=np.float32)
+        for m in range(1, n_mels + 1):
+            left, center, right = bins[m - 1], bins[m], bins[m + 1]
+            if center > left:
+                bank[m - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+            if right > center:
+                bank[m - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+        return bank
+
+    def _dct_matrix(self, n_in, n_out):
+        n = np.arange(n_in)
+        k = np.arange(n_out)[:, None]
+        dct = np.cos(np.pi * k * (2 * n + 1) / (2 * n_in)) * np.sqrt(2.0 / n_in)
+        dct[0] /= np.sqrt(2.0)
+        return dct.astype(np.float32)
+
+    def __call__(self, samples):
+        """(frames, n_ceps) features c1..c13, no mean normalisation: a mean
+        over the whole input shifts with the speech around a phrase, which
+        breaks subsequence matching in the middle of a sentence"""
+        samples = np.asarray(samples, dtype=np.float32)
+        if len(samples) < self.frame_len:
+            samples = np.pad(samples, (0, self.frame_len - len(samples)))
+        emphasized = np.append(samples[0], samples[1:] - self.pre_emphasis * samples[:-1])
+
+        # strided frame view, no copy until the window multiply
+        n_frames = 1 + (len(emphasized) - self.frame_len) // self.hop
+        frames = np.lib.stride_tricks.sliding_window_view(emphasized, self.frame_len)[::self.hop][:n_frames]
+
+        spectrum = np.abs(np.fft.rfft(frames * self.window, n=self.n_fft)) ** 2 / self.n_fft
+        energies = np.log(spectrum @ self.filterbank.T + 1e-10)
+        return energies @ self.dct.T
+
+
+def subsequence_dtw(template, query, return_end=False):
+    """Best normalised DTW cost of template anywhere inside query"""
+    # pairwise euclidean cost (template rows x query columns)
+    diff = template[:, None, :] - query[None, :, :]
+    cost = np.sqrt(np.einsum("ijk,ijk->ij", diff, diff))
+
+    n, m = cost.shape
+    inf = np.float32(np.inf)
+    # steps (1,1), (1,2), (2,1): each row only needs the two rows above -> vectorised
+    prev2 = np.full(m, inf, dtype=np.float32)
+    prev = cost[0].astype(np.float32)
+    for i in range(1, n):
+        diag = np.concatenate(([inf], prev[:-1]))
+        skip_query = np.concatenate(([inf, inf], prev[:-2]))
+        skip_template = np.concatenate(([inf], prev2[:-1]))
+        row = cost[i] + np.minimum(np.minimum(diag, skip_query), skip_template)
+        prev2, prev = prev, row
+    if return_end:
+        # query frame where the match ends
+        end = int(prev.argmin())
+        return float(prev[end]) / n, end
+    return float(prev.min()) / n
+
+
+class KeywordSpotter:
+    """Template-matching keyword spotter for one phrase"""
+
+    def __init__(self, phrase="your fault", threshold=None, rate=SAMPLE_RATE):
+        self.phrase = phrase
+        self.rate = rate
+        self.mfcc = MFCC(rate=rate)
+        self.templates = []
+        self.threshold = threshold
+        self.default_threshold = 6.0
+        self.threshold_margin = 1.25
+
+    def enroll(self, clips):
+        """Add example recordings of the phrase (float32 arrays)"""
+        for samples in clips:
+            self.templates.append(self.mfcc(trim_silence(samples, self.rate)))
+
+        # leave-one-out distances set the acceptance threshold
+        if len(self.templates) > 1:
+            worst = 0.0
+            for i, template in enumerate(self.templates):
+                worst = max(worst, self.score_features(template, skip=i))
+            self.threshold = worst * self.threshold_margin
+        elif self.threshold is None:
+            self.threshold = self.default_threshold
+
+    def score_features(self, features, skip=None):
+        """Lowest template distance for a feature sequence"""
+        best = np.inf
+        for i, template in enumerate(self.templates):
+            if i == skip:
+                continue
+            best = min(best, subsequence_dtw(template, features))
+        return best
+
+    def score(self, samples):
+        if not self.templates:
+            return np.inf
+        # same trimming as enrollment
+        return self.score_features(self.mfcc(trim_silence(samples, self.rate)))
+    
+    def locate(self, samples):
+        """(score, end sample of the best match) in an audio window"""
+        if not self.templates:
+            return np.inf, None
+        start, stop = voiced_bounds(samples, self.rate)
+        features = self.mfcc(samples[start:stop])
+        best, best_end = np.inf, None
+        for template in self.templates:
+            score, end = subsequence_dtw(template, features, return_end=True)
+            if score < best:
+                best, best_end = score, end
+        if best_end is None:
+            return best, None
+        end_sample = start + best_end * self.mfcc.hop + self.mfcc.frame_len
+        return best, min(end_sample, stop)
+
+    def detect(self, samples):
+        """(detected, score) for an utterance"""
+        score = self.score(samples)
+        return score <= self.threshold, score
+
+    def save(self, path=KEYWORD_MODEL_PATH):
+        arrays = {f"template_{i}": t for i, t in enumerate(self.templates)}
+        np.savez(path, phrase=self.phrase, threshold=self.threshold,
+                 feature_version=FEATURE_VERSION, **arrays)
+        print(f"Saved {len(self.templates)} templates to {path}")
+
+    @classmethod
+    def load(cls, path=KEYWORD_MODEL_PATH):
+        data = np.load(path)
+        version = int(data["feature_version"]) if "feature_version" in data.files else 1
+        if version != FEATURE_VERSION:
+            raise ValueError(f"templates use feature version {version}, re-enroll for {FEATURE_VERSION}")
+        spotter = cls(phrase=str(data["phrase"]), threshold=float(data["threshold"]))
+        keys = sorted((k for k in data.files if k.startswith("template_")),
+                      key=lambda k: int(k.split("_")[1]))
+        spotter.templates = [data[k] for k in keys]
+        return spotter
+
+
+def voiced_bounds(samples, rate=SAMPLE_RATE, frame_ms=10, ratio=0.1):
+    """(start, stop) sample range above ratio * peak frame energy"""
+    frame = int(rate * frame_ms / 1000)
+    n = len(samples) // frame
+    if n == 0:
+        return 0, len(samples)
+    energy = np.square(samples[:n * frame].reshape(n, frame)).mean(axis=1)
+    voiced = np.flatnonzero(energy > energy.max() * ratio)
+    if len(voiced) == 0:
+        return 0, len(samples)
+    return voiced[0] * frame, (voiced[-1] + 1) * frame
+
+
+def trim_silence(samples, rate=SAMPLE_RATE, frame_ms=10, ratio=0.1):
+    """Cut leading/trailing frames below ratio * peak energy"""
+    start, stop = voiced_bounds(samples, rate, frame_ms, ratio)
+    return samples[start:stop]
+
+
+class StreamingPhraseDetector:
+    """Overlapping-window keyword detection over a ring buffer"""
+
+    def __init__(self, spotter, window_seconds=None, hop_seconds=0.1,
+                 min_energy=0.01, refractory_seconds=1.0, ring=None):
+        """ring: an AudioRingBuffer already holding the audio; feed() then
+        only advances the count and windows are views of that ring"""
+        self.spotter = spotter
+        self.ring = ring
+        self.rate = spotter.rate
+        if window_seconds is None:
+            # just longer than the longest template: a longer window only
+            # costs DTW work and delays the match
+            longest = max((len(t) for t in spotter.templates), default=80)
+            window_seconds = longest * spotter.mfcc.hop / self.rate + 0.25
+        self.window = int(window_seconds * self.rate)
+        self.hop = int(hop_seconds * self.rate)
+        self.min_energy = min_energy
+        self.refractory = int(refractory_seconds * self.rate)
+
+        # every sample is written twice so the window is always one contiguous view
+        self._buffer = np.zeros(0 if ring is not None else 2 * self.window, dtype=np.float32)
+        self._pos = 0
+        self.samples_seen = 0
+        self._since_eval = 0
+        self._last_trigger = -self.refractory
+
+        self.evaluations = 0
+        self.trigger_latencies = []
+
+    def window_view(self, end=None):
+        """`window` samples up to ring index `end` (default: the newest), no copy"""
+        if self.ring is not None:
+            if end is None:
+                return self.ring.latest(self.window)
+            return self.ring.view(max(0, end - self.window), end)
+        return self._buffer[self._pos:self._pos + self.window]
+
+    def _write(self, samples):
+        n = len(samples)
+        if n >= self.window:
+            samples = samples[-self.window:]
+            n = self.window
+        first = min(n, self.window - self._pos)
+        for offset in (0, self.window):
+            self._buffer[self._pos + offset:self._pos + offset + first] = samples[:first]
+            self._buffer[offset:offset + n - first] = samples[first:]
+        self._pos = (self._pos + n) % self.window
+
+    def feed(self, samples, now=None, end=None):
+        """Add audio; returns the trigger dicts for the phrase heard in it
+        (usually none or one)
+
+        A block longer than a hop is scored at every hop inside it, not
+        just at its end. With a ring, `end` is the ring index just past
+        the block (default: the ring's newest sample).
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        n = len(samples)
+        if self.ring is not None and end is None:
+            end = self.ring.total
+        hits = []
+        pos = 0
+        while pos < n:
+            take = min(n - pos, self.hop - self._since_eval)
+            if self.ring is None:
+                self._write(samples[pos:pos + take])
+            pos += take
+            self.samples_seen += take
+            self._since_eval += take
+            if self._since_eval < self.hop:
+                break
+            self._since_eval = 0
+            # samples of this block that arrived after the evaluated window
+            after = n - pos
+            hit = self._evaluate(None if end is None else end - after, after)
+            if hit:
+                hits.append((hit, after))
+        if now is None:
+            now = self.samples_seen / self.rate
+        # each hit is stamped at the end of its own window
+        for hit, after in hits:
+            hit['time'] = now - after / self.rate
+        return [hit for hit, _ in hits]
+
+    def _evaluate(self, end, after):
+        """score the window ending `after` samples before the newest one"""
+        if self.samples_seen < self.window // 2:
+            return None
+        if self.samples_seen - self._last_trigger < self.refractory:
+            return None
+
+        window = self.window_view(end)
+        # skip silent windows (and windows already overwritten) before any MFCC work
+        if window is None or np.sqrt(np.mean(window * window)) < self.min_energy * 0.5:
+            return None
+
+        self.evaluations += 1
+        start = time.perf_counter()
+        score, match_end = self.spotter.locate(window)
+        compute = time.perf_counter() - start
+        if match_end is None or score > self.spotter.threshold:
+            return None
+
+        self._last_trigger = self.samples_seen
+        # phrase ended (window - match_end) samples before the window's end,
+        # which is `after` samples before the newest sample
+        latency = (len(window) - match_end + after) / self.rate + compute
+        self.trigger_latencies.append(latency)
+        return {'phrase': self.spotter.phrase, 'score': score, 'latency': latency}
+
+    def latency_report(self):
+        if not self.trigger_latencies:
+            return None
+        latencies = sorted(self.trigger_latencies)
+        return {
+            'triggers': len(latencies),
+            'mean': float(np.mean(latencies)),
+            'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            'evaluations': self.evaluations
+        }
+
+
+def benchmark(clip_paths, spotter, use_google=False, language="en-US"):
+    """Detection latency of the local spotter vs recognize_google"""
+    local = []
+    remote = []
+    hits = {"keyword": 0, "google": 0}
+
+    for path in clip_paths:
+        samples = load_wav(path)
+
+        start = time.perf_counter()
+        detected, score = spotter.detect(samples)
+        local.append(time.perf_counter() - start)
+        hits["keyword"] += int(detected)
+
+        line = f"{os.path.basename(path)}: keyword={detected} ({score:.2f}, {local[-1]*1000:.1f}ms)"
+
+        if use_google:
+            import speech_recognition as sr
+            recognizer = sr.Recognizer()
+            with sr.AudioFile(path) as source:
+                audio = recognizer.record(source)
+            start = time.perf_counter()
+            try:
+                text = recognizer.recognize_google(audio, language=language).lower()
+            except (sr.UnknownValueError, sr.RequestError):
+                text = ""
+            remote.append(time.perf_counter() - start)
+            found = spotter.phrase in text
+            hits["google"] += int(found)
+            line += f", google={found} ({remote[-1]*1000:.0f}ms)"
+
+        print(line)
+
+    def summary(name, times):
+        if not times:
+            return
+        times = sorted(times)
+        p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+        print(f"{name:8s} mean={np.mean(times)*1000:.1f}ms p95={p95*1000:.1f}ms "
+              f"hits={hits[name]}/{len(times)}")
+
+    print("-" * 60)
+    summary("keyword", local)
+    summary("google", remote)
+
+
+# Enroll / benchmark
+if __name__ == "__main__":
+    usage = ("Usage:\n"
+             "  python3 Sphero_Keyword.py enroll [--phrase 'go to sleep'] clip1.wav clip2.wav ...\n"
+             "  python3 Sphero_Keyword.py bench [--google] clip1.wav ...")
+    if len(sys.argv) < 3:
+        print(usage)
+        sys.exit(1)
+
+    command = sys.argv[1]
+    args = sys.argv[2:]
+    phrase = None
+    if "--phrase" in args:
+        i = args.index("--phrase")
+        phrase = args[i + 1] if i + 1 < len(args) else None
+        del args[i:i + 2]
+    args = [a for a in args if not a.startswith("--")]
+
+    if command == "enroll":
+        # the target phrase keeps the main model file, others get their own
+        spotter = KeywordSpotter(phrase) if phrase else KeywordSpotter()
+        spotter.enroll(load_wav(p) for p in args)
+        print(f"Threshold: {spotter.threshold:.2f}")
+        spotter.save(keyword_model_path(phrase) if phrase else KEYWORD_MODEL_PATH)
+    elif command == "bench":
+        spotter = KeywordSpotter.load()
+        benchmark(args, spotter, use_google="--google" in sys.argv)
+    else:
+        print(usage)
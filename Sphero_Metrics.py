@@ -0,0 +1,87 @@
+import threading
+from bisect import bisect_left
+from collections import deque
+
+
+# Bucket upper bounds in milliseconds
+DEFAULT_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram, O(log buckets) per sample"""
+
+    def __init__(self, bounds_ms=DEFAULT_BOUNDS_MS):
+        self.bounds = tuple(bounds_ms)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        ms = seconds * 1000.0
+        with self._lock:
+            self.counts[bisect_left(self.bounds, ms)] += 1
+            self.count += 1
+            self.total += ms
+            self.min = ms if self.min is None else min(self.min, ms)
+            self.max = ms if self.max is None else max(self.max, ms)
+
+    def percentile(self, q):
+        """Approximate percentile (ms) from bucket bounds"""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for i, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank and count:
+                    return self.bounds[i] if i < len(self.bounds) else self.max
+            return self.max
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count,
+            'min_ms': self.min,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_ms': self.max
+        }
+
+    def buckets(self):
+        """[(upper bound ms or None, count)]"""
+        with self._lock:
+            return list(zip(list(self.bounds) + [None], self.counts))
+
+
+class StageMetrics:
+    """Per-item timestamps turned into per-stage latency histograms"""
+
+    def __init__(self, stages, keep=100):
+        # stage name -> (start mark, end mark)
+        self.stages = dict(stages)
+        self.histograms = {name: LatencyHistogram() for name in self.stages}
+        self.recent = deque(maxlen=keep)
+
+    def record(self, marks):
+        """Add one finished item (dict of mark -> time)"""
+        for name, (start, end) in self.stages.items():
+            if marks.get(start) is not None and marks.get(end) is not None:
+                self.histograms[name].observe(max(0.0, marks[end] - marks[start]))
+        self.recent.append(dict(marks))
+
+    def summary(self):
+        return {name: hist.summary() for name, hist in self.histograms.items()}
+
+    def print_summary(self, title="Latency"):
+        print(f"{title}:")
+        for name, stats in self.summary().items():
+            if not stats['count']:
+                continue
+            print(f"  {name:10s} n={stats['count']:4d} mean={stats['mean_ms']:7.1f}ms "
+                  f"p50<={stats['p50_ms']:.0f}ms p95<={stats['p95_ms']:.0f}ms max={stats['max_ms']:.1f}ms")
@@ -0,0 +1,230 @@
+import os
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+
+
+DEFAULT_PATH = "sphero_learned.bin"
+
+MAGIC = b"SPHL"
+VERSION = 1
+# magic, version, rows, cols, history length
+HEADER = struct.Struct("<4sIIII")
+HEADER_SIZE = 64
+
+COUNTERS = ("updates", "decisions", "episodes", "collisions")
+MAX_COUNTERS = 8
+
+
+def slot_dtype(rows, cols, history):
+    """one checkpoint; crc covers everything after the first 8 bytes"""
+    return np.dtype([
+        ('crc', '<u4'),
+        ('pad', '<u4'),
+        ('generation', '<u8'),
+        ('counters', '<i8', (MAX_COUNTERS,)),
+        ('history_count', '<i8'),
+        ('history', '<i4', (history,)),
+        ('q_table', '<f8', (rows, cols)),
+    ])
+
+
+class LearnedStateStore:
+    """Q-table, counters and collision history in a memory-mapped file
+
+    The file holds a versioned header and two checkpoint slots. A
+    checkpoint goes to the older slot and its CRC is written last, so a
+    crash mid-write leaves a slot that fails its check and the other one is
+    used. Opening maps the file; nothing is parsed beyond one CRC per slot.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, rows=64, cols=8, history=256):
+        self.path = path
+        self.rows = rows
+        self.cols = cols
+        self.history_len = history
+        self.dtype = slot_dtype(rows, cols, history)
+
+        self.slots = None
+        self.active = None
+        self.generation = 0
+        self._lock = threading.Lock()
+
+        self.is_running = False
+        self.checkpoint_thread = None
+        self._wake = threading.Event()
+        self.checkpoints = 0
+        self.checkpoint_time = 0.0
+
+        self._open()
+
+    # file ------------------------------------------------------------
+    def _create(self):
+        # write the empty file aside and rename it in, never a half file
+        tmp = self.path + ".tmp"
+        header = HEADER.pack(MAGIC, VERSION, self.rows, self.cols, self.history_len).ljust(HEADER_SIZE, b"\0")
+        with open(tmp, "wb") as f:
+            f.write(header)
+            f.write(np.zeros(2, dtype=self.dtype).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def _compatible(self):
+        try:
+            with open(self.path, "rb") as f:
+                header = f.read(HEADER.size)
+            magic, version, rows, cols, history = HEADER.unpack(header)
+        except (OSError, struct.error):
+            return False
+        if magic != MAGIC or version != VERSION or (rows, cols, history) != (self.rows, self.cols, self.history_len):
+            print(f"{self.path}: incompatible (version {version}, {rows}x{cols}), starting fresh")
+            return False
+        return os.path.getsize(self.path) == HEADER_SIZE + 2 * self.dtype.itemsize
+
+    def _open(self):
+        if not os.path.exists(self.path) or not self._compatible():
+            if os.path.exists(self.path):
+                os.replace(self.path, self.path + ".bak")
+            self._create()
+        self.slots = np.memmap(self.path, dtype=self.dtype, mode="r+", offset=HEADER_SIZE, shape=(2,))
+
+        # newest slot whose CRC holds
+        best = None
+        for i in range(2):
+            if self._valid(i) and (best is None or self.slots[i]['generation'] > self.slots[best]['generation']):
+                best = i
+        self.active = best
+        self.generation = int(self.slots[best]['generation']) if best is not None else 0
+
+    def _slot_bytes(self, i):
+        return self.slots[i:i + 1].view(np.uint8)[8:]
+
+    def _valid(self, i):
+        slot = self.slots[i]
+        return slot['generation'] > 0 and zlib.crc32(self._slot_bytes(i)) == slot['crc']
+
+    # data ------------------------------------------------------------
+    def load(self):
+        """last good checkpoint as {'q_table', 'counters', 'history'}, None if empty"""
+        if self.active is None:
+            return None
+        slot = self.slots[self.active]
+        return {
+            'q_table': np.array(slot['q_table']),
+            'counters': {name: int(slot['counters'][i]) for i, name in enumerate(COUNTERS)},
+            'history': slot['history'][:int(slot['history_count'])].tolist(),
+            'generation': self.generation
+        }
+
+    def checkpoint(self, q_table, counters, history):
+        """write a snapshot into the inactive slot (history: recent values, oldest first)"""
+        start = time.perf_counter()
+        with self._lock:
+            target = 0 if self.active is None else 1 - self.active
+            slot = self.slots[target:target + 1]
+            # invalidate first: a crash from here on leaves this slot bad
+            slot['crc'] = 0
+            slot['generation'] = self.generation + 1
+            slot['counters'] = [counters.get(name, 0) for name in COUNTERS] + [0] * (MAX_COUNTERS - len(COUNTERS))
+            history = list(history)[-self.history_len:]
+            slot['history_count'] = len(history)
+            slot['history'][0, :len(history)] = history
+            slot['q_table'] = q_table
+            self.slots.flush()
+            # commit point
+            slot['crc'] = zlib.crc32(self._slot_bytes(target))
+            self.slots.flush()
+            self.active = target
+            self.generation += 1
+        self.checkpoints += 1
+        self.checkpoint_time += time.perf_counter() - start
+
+    # background checkpoints -------------------------------------------
+    def start(self, snapshot, interval=10.0):
+        """checkpoint snapshot() -> (q_table, counters, history) every interval when it changed"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self.checkpoint_thread = threading.Thread(target=self._checkpoint_loop, args=(snapshot, interval),
+                                                  daemon=True)
+        self.checkpoint_thread.start()
+
+    def _checkpoint_loop(self, snapshot, interval):
+        last = None
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                q_table, counters, history = snapshot()
+                # copies: the control loop keeps updating its own table
+                q_table = np.array(q_table)
+                if counters != last:
+                    self.checkpoint(q_table, counters, history)
+                    last = dict(counters)
+            except Exception as e:
+                print(f"Checkpoint error: {e}")
+            if not self.is_running:
+                break
+
+    def request_checkpoint(self):
+        """checkpoint soon (end of an episode), without waiting for it"""
+        self._wake.set()
+
+    def stop(self):
+        """final checkpoint, then close"""
+        if self.is_running:
+            self.is_running = False
+            self._wake.set()
+            self.checkpoint_thread.join(timeout=5)
+            self.checkpoint_thread = None
+
+    def close(self):
+        self.stop()
+        if self.slots is not None:
+            self.slots.flush()
+            # unmapped once the last reference goes
+            self.slots = None
+
+    def stats(self):
+        return {
+            'generation': self.generation,
+            'checkpoints': self.checkpoints,
+            'checkpoint_ms': 1000 * self.checkpoint_time / self.checkpoints if self.checkpoints else 0.0,
+            'bytes': HEADER_SIZE + 2 * self.dtype.itemsize
+        }
+
+
+# Checkpoint cost, reopen time, and a torn write: python3 Sphero_Persist.py
+if __name__ == "__main__":
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "learned.bin")
+    store = LearnedStateStore(path)
+    rng = np.random.default_rng(0)
+    q = rng.normal(size=(64, 8))
+    for i in range(200):
+        q[i % 64] += 0.01
+        store.checkpoint(q, {'updates': i, 'episodes': i // 10, 'collisions': i}, list(range(i // 10)))
+    print(f"checkpoint: {store.stats()['checkpoint_ms']:.3f}ms, file {store.stats()['bytes']} bytes")
+    store.close()
+
+    start = time.perf_counter()
+    store = LearnedStateStore(path)
+    state = store.load()
+    print(f"reopen + load: {(time.perf_counter() - start) * 1000:.3f}ms, "
+          f"generation {state['generation']}, match={np.array_equal(state['q_table'], q)}")
+
+    # crash half way through the next checkpoint: payload written, CRC not
+    target = 1 - store.active
+    store.slots[target]['crc'] = 0
+    store.slots[target]['generation'] = store.generation + 1
+    store.slots[target]['q_table'] = np.nan
+    store.slots.flush()
+    store.close()
+    state = LearnedStateStore(path).load()
+    print(f"after torn write: generation {state['generation']}, match={np.array_equal(state['q_table'], q)}")
+
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import deque
+
+
+class PhraseMatcher:
+    """Aho-Corasick automaton: many phrases, one pass over the transcript"""
+
+    def __init__(self, whole_words=True):
+        self.whole_words = whole_words
+        self.callbacks = {}
+        self._lock = threading.Lock()
+        self._automaton = None
+
+    def add(self, phrase, callback=None):
+        """Register phrase -> callback (several callbacks per phrase allowed)"""
+        phrase = " ".join(phrase.lower().split())
+        with self._lock:
+            self.callbacks.setdefault(phrase, [])
+            if callback:
+                self.callbacks[phrase].append(callback)
+            # rebuilt on next match
+            self._automaton = None
+
+    def remove(self, phrase):
+        phrase = " ".join(phrase.lower().split())
+        with self._lock:
+            self.callbacks.pop(phrase, None)
+            self._automaton = None
+
+    def phrases(self):
+        return list(self.callbacks)
+
+    def _build(self):
+        """goto / fail / output tables as dicts and lists"""
+        goto = [{}]
+        output = [[]]
+        for phrase in self.callbacks:
+            node = 0
+            for char in phrase:
+                nxt = goto[node].get(char)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][char] = nxt
+                    goto.append({})
+                    output.append([])
+                node = nxt
+            output[node].append(phrase)
+
+        # breadth-first failure links, outputs merged along them
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(char, 0)
+                output[child] = output[child] + output[fail[child]]
+        return goto, fail, output
+
+    def match(self, text):
+        """[(phrase, start, end)] found in text, in order of their end"""
+        automaton = self._automaton
+        if automaton is None:
+            with self._lock:
+                if self._automaton is None:
+                    self._automaton = self._build()
+                automaton = self._automaton
+        goto, fail, output = automaton
+
+        text = " ".join(text.lower().split())
+        matches = []
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for phrase in output[node]:
+                start = i - len(phrase) + 1
+                if self.whole_words and not self._on_word_boundary(text, start, i + 1):
+                    continue
+                matches.append((phrase, start, i + 1))
+        return matches
+
+    def _on_word_boundary(self, text, start, end):
+        before = text[start - 1] if start > 0 else " "
+        after = text[end] if end < len(text) else " "
+        return not before.isalnum() and not after.isalnum()
+
+
+# Scaling check
+if __name__ == "__main__":
+    import random
+
+    rng = random.Random(0)
+    words = ["go", "to", "sleep", "patrol", "your", "fault", "come", "here", "spin",
+             "left", "right", "stop", "fast", "slow", "dance", "happy", "sad", "look"]
+    transcript = " ".join(rng.choice(words) for _ in range(30)) + " it is all your fault"
+
+    for size in (3, 30, 300, 3000):
+        matcher = PhraseMatcher()
+        matcher.add("your fault")
+        while len(matcher.callbacks) < size:
+            matcher.add(" ".join(rng.choice(words) for _ in range(rng.randint(2, 4))) + " now")
+        matcher.match("")
+
+        runs = 2000
+        start = time.perf_counter()
+        for _ in range(runs):
+            matcher.match(transcript)
+        per_call = (time.perf_counter() - start) / runs
+        print(f"{size:5d} phrases: {per_call*1e6:.1f}us per transcript")
@@ -0,0 +1,127 @@
+import time
+import numpy as np
+
+
+# (heading, speed) primitives the patrol already used
+PATROL_ACTIONS = [
+    (0, 40),
+    (45, 30),
+    (315, 30),
+    (90, 25),
+    (270, 25),
+    (135, 20),
+    (225, 20),
+    (180, 15),
+]
+
+
+class PatrolQPolicy:
+    """Tabular Q-learning over (heading sector, collided last move, collisions so far)
+
+    The table is a (states, actions) NumPy array. choose() and update()
+    take a single state or arrays of them, so the same code drives the
+    robot and batches of simulated arenas.
+    """
+
+    def __init__(self, actions=PATROL_ACTIONS, heading_bins=8, collision_bins=4,
+                 learning_rate=0.1, discount_factor=0.9, epsilon=0.3,
+                 collision_penalty=2.0, seed=None):
+        self.actions = list(actions)
+        self.headings = np.array([heading for heading, _ in self.actions])
+        self.speeds = np.array([speed for _, speed in self.actions], dtype=float)
+        self.heading_bins = heading_bins
+        self.collision_bins = collision_bins
+        self.n_states = heading_bins * 2 * collision_bins
+        self.n_actions = len(self.actions)
+        self.q_table = np.zeros((self.n_states, self.n_actions))
+
+        self.learning_rate = learning_rate
+        self.discount_factor = discount_factor
+        self.epsilon = epsilon
+        self.collision_penalty = collision_penalty
+        self.rng = np.random.default_rng(seed)
+
+        # exploration keeps the old forward bias: 70% straight ahead
+        forward = self.headings == 0
+        weights = np.where(forward, 0.7 / max(1, forward.sum()), 0.3 / max(1, (~forward).sum()))
+        self.explore_cdf = np.cumsum(weights / weights.sum())
+
+        self.decisions = 0
+        self.updates = 0
+
+    def encode(self, heading, collided, collisions):
+        """state index; scalars or arrays"""
+        sector = (np.asarray(heading) % 360 * self.heading_bins // 360).astype(int)
+        collided = np.asarray(collided).astype(int)
+        count = np.minimum(np.asarray(collisions), self.collision_bins - 1).astype(int)
+        return (sector * 2 + collided) * self.collision_bins + count
+
+    def choose(self, states):
+        """epsilon-greedy action index (or array of them)"""
+        states = np.asarray(states)
+        q = self.q_table[states]
+        greedy = q.argmax(axis=-1)
+        explore = self.rng.random(states.shape) < self.epsilon
+        # inverse CDF draw from the forward-biased distribution
+        random_actions = np.minimum(np.searchsorted(self.explore_cdf, self.rng.random(states.shape)),
+                                    self.n_actions - 1)
+        self.decisions += states.size
+        return np.where(explore, random_actions, greedy)
+
+    def reward(self, actions, collisions):
+        """ground covered (full speed ~ 1) minus a penalty per collision"""
+        return self.speeds[actions] / self.speeds.max() - self.collision_penalty * np.asarray(collisions)
+
+    def update(self, states, actions, rewards, next_states, done=False):
+        """Q-learning step for each (s, a, r, s'); a pair seen several times
+        in one batch moves by its mean TD error, so batch size does not
+        change the step size"""
+        states = np.atleast_1d(states)
+        actions = np.atleast_1d(actions)
+        target = np.atleast_1d(rewards).astype(float)
+        bootstrap = self.q_table[np.atleast_1d(next_states)].max(axis=-1)
+        target = target + self.discount_factor * bootstrap * (1 - np.atleast_1d(done))
+        td = target - self.q_table[states, actions]
+        if states.size == 1:
+            self.q_table[states[0], actions[0]] += self.learning_rate * td[0]
+        else:
+            cells = states * self.n_actions + actions
+            total = np.bincount(cells, weights=td, minlength=self.q_table.size)
+            count = np.bincount(cells, minlength=self.q_table.size)
+            self.q_table += (self.learning_rate * total / np.maximum(count, 1)).reshape(self.q_table.shape)
+        self.updates += states.size
+        return td
+
+    def greedy_action(self, state):
+        return self.actions[int(self.q_table[state].argmax())]
+
+
+# Per-decision cost on the patrol loop, and batched updates
+if __name__ == "__main__":
+    policy = PatrolQPolicy(seed=0)
+    runs = 20000
+
+    start = time.perf_counter()
+    state = policy.encode(0, False, 0)
+    for i in range(runs):
+        action = int(policy.choose(state))
+        heading, speed = PATROL_ACTIONS[action]
+        collided = policy.rng.random() < 0.1
+        next_state = int(policy.encode(heading, collided, i % 5))
+        policy.update(state, action, policy.reward(action, int(collided)), next_state)
+        state = next_state
+    single_us = (time.perf_counter() - start) / runs * 1e6
+
+    batch = 4096
+    states = policy.rng.integers(0, policy.n_states, batch)
+    start = time.perf_counter()
+    for _ in range(100):
+        actions = policy.choose(states)
+        collided = policy.rng.random(batch) < 0.1
+        next_states = policy.encode(policy.headings[actions], collided, policy.rng.integers(0, 5, batch))
+        policy.update(states, actions, policy.reward(actions, collided), next_states)
+        states = next_states
+    batch_us = (time.perf_counter() - start) / (100 * batch) * 1e6
+
+    print(f"choose + update: {single_us:.1f}us per decision (patrol decides every 4.5 s)")
+    print(f"batched ({batch}):  {batch_us:.3f}us per decision")
@@ -0,0 +1,278 @@
+import math
+import random
+from collections import deque
+import numpy as np
+
+
+class SimulatedSphero:
+    """Kinematic Sphero seen from the overhead camera (pixel coordinates)"""
+
+    def __init__(self, x=60.0, y=200.0, target=(260.0, 60.0),
+                 px_per_speed=2.0, time_constant=0.25, heading_offset=0.0):
+        # pose (image coords, y down)
+        self.x = x
+        self.y = y
+        self.target = target
+
+        # drive model
+        self.px_per_speed = px_per_speed
+        self.time_constant = time_constant
+        self.heading_offset = heading_offset
+        self.velocity = 0.0
+
+        # commanded values (SpheroEduAPI style)
+        self.heading = 0
+        self.speed = 0
+        self.roll_commands = 0
+
+    # --- api subset ---
+
+    def set_heading(self, heading):
+        self.heading = int(heading) % 360
+        self.roll_commands += 1
+
+    def set_speed(self, speed):
+        self.speed = max(-255, min(255, int(speed)))
+        self.roll_commands += 1
+
+    def get_heading(self):
+        return self.heading
+
+    def stop_roll(self):
+        self.set_speed(0)
+
+    # --- physics ---
+
+    def advance(self, dt):
+        """Step kinematics by dt seconds"""
+        target_velocity = self.speed * self.px_per_speed
+        # first order lag towards commanded speed
+        alpha = 1.0 - math.exp(-dt / self.time_constant)
+        self.velocity += (target_velocity - self.velocity) * alpha
+
+        # heading 0 = image up, clockwise
+        h = math.radians(self.heading + self.heading_offset)
+        self.x += math.sin(h) * self.velocity * dt
+        self.y -= math.cos(h) * self.velocity * dt
+
+    def distance_to_target(self):
+        return math.hypot(self.target[0] - self.x, self.target[1] - self.y)
+
+
+class SimulatedCamera:
+    """Delayed, noisy detect_sphero_and_target() for a SimulatedSphero"""
+
+    def __init__(self, sphero, latency=0.08, noise_px=1.5, seed=None):
+        self.sphero = sphero
+        self.latency = latency
+        self.noise_px = noise_px
+        self.rng = random.Random(seed)
+        self.history = deque()
+
+    def record(self, now):
+        """Store the true pose at time now"""
+        self.history.append((now, self.sphero.x, self.sphero.y))
+
+    def observe(self, now):
+        """Result for the frame captured `latency` seconds ago"""
+        capture_time = now - self.latency
+        while len(self.history) > 1 and self.history[1][0] <= capture_time:
+            self.history.popleft()
+        if not self.history or self.history[0][0] > capture_time:
+            return {'sphero_found': False, 'target_found': False}
+
+        stamp, x, y = self.history[0]
+        sx = int(round(x + self.rng.gauss(0, self.noise_px)))
+        sy = int(round(y + self.rng.gauss(0, self.noise_px)))
+        tx, ty = int(self.sphero.target[0]), int(self.sphero.target[1])
+
+        dx = tx - sx
+        dy = ty - sy
+        return {
+            'sphero_found': True,
+            'target_found': True,
+            'sphero_pos': (sx, sy),
+            'target_pos': (tx, ty),
+            'relative_angle': math.degrees(math.atan2(-dy, dx)),
+            'distance': math.hypot(dx, dy),
+            'timestamp': stamp
+        }
+
+
+class PatrolArena:
+    """Many 2-D patrol arenas stepped together with NumPy (metres, seconds)
+
+    One step() is one patrol decision as the state machine sees it:
+    execute_patrol_action drives for move_seconds, then the loop waits
+    pause_seconds. Hitting a wall or obstacle above min_impact_speed counts
+    a collision and stops the robot, like on_collision_detected.
+    """
+
+    def __init__(self, n_envs=1024, size=(2.0, 1.5), obstacles=((0.7, 0.5, 0.15), (1.4, 1.0, 0.2)),
+                 radius=0.037, m_per_speed=0.008, time_constant=0.25, min_impact_speed=0.05,
+                 dt=0.05, move_seconds=2.0, pause_seconds=2.5, seed=None):
+        self.n_envs = n_envs
+        self.width, self.height = size
+        obstacles = np.asarray(obstacles, dtype=float).reshape(-1, 3)
+        self.obstacle_x, self.obstacle_y, self.obstacle_r = obstacles.T
+        self.radius = radius
+        self.m_per_speed = m_per_speed
+        self.time_constant = time_constant
+        self.min_impact_speed = min_impact_speed
+        self.dt = dt
+        self.move_steps = int(round(move_seconds / dt))
+        self.pause_steps = int(round(pause_seconds / dt))
+        self.rng = np.random.default_rng(seed)
+
+        self.x = np.zeros(n_envs)
+        self.y = np.zeros(n_envs)
+        # where heading 0 points in each arena (robot aimed at random)
+        self.heading_offset = np.zeros(n_envs)
+        self.velocity = np.zeros(n_envs)
+        self.collisions = np.zeros(n_envs, dtype=int)
+        self.elapsed = np.zeros(n_envs)
+        self.distance = np.zeros(n_envs)
+        self.reset()
+
+    def _overlapping(self, x, y):
+        dx = x[:, None] - self.obstacle_x
+        dy = y[:, None] - self.obstacle_y
+        return (dx * dx + dy * dy < (self.obstacle_r + self.radius) ** 2).any(axis=1)
+
+    def reset(self, mask=None):
+        """new episode for the masked arenas (all by default)"""
+        index = np.arange(self.n_envs) if mask is None else np.flatnonzero(mask)
+        todo = index
+        for _ in range(20):
+            if not len(todo):
+                break
+            self.x[todo] = self.rng.uniform(self.radius, self.width - self.radius, len(todo))
+            self.y[todo] = self.rng.uniform(self.radius, self.height - self.radius, len(todo))
+            todo = todo[self._overlapping(self.x[todo], self.y[todo])]
+        self.heading_offset[index] = self.rng.uniform(0, 360, len(index))
+        self.velocity[index] = 0.0
+        self.collisions[index] = 0
+        self.elapsed[index] = 0.0
+        self.distance[index] = 0.0
+
+    def step(self, headings, speeds):
+        """one move + pause per arena; returns collisions during it"""
+        radians = np.radians(np.asarray(headings, dtype=float) + self.heading_offset)
+        sin_h, cos_h = np.sin(radians), np.cos(radians)
+        target = np.asarray(speeds, dtype=float) * self.m_per_speed
+        alpha = 1.0 - math.exp(-self.dt / self.time_constant)
+        hits = np.zeros(self.n_envs, dtype=int)
+        stopped = np.zeros(self.n_envs, dtype=bool)
+        low_x, high_x = self.radius, self.width - self.radius
+        low_y, high_y = self.radius, self.height - self.radius
+
+        for i in range(self.move_steps + self.pause_steps):
+            commanded = 0.0 if i >= self.move_steps else np.where(stopped, 0.0, target)
+            self.velocity += (commanded - self.velocity) * alpha
+            step = self.velocity * self.dt
+            # heading 0 = +y, clockwise
+            x = self.x + sin_h * step
+            y = self.y + cos_h * step
+
+            wall = (x < low_x) | (x > high_x) | (y < low_y) | (y > high_y)
+            np.clip(x, low_x, high_x, out=x)
+            np.clip(y, low_y, high_y, out=y)
+
+            dx = x[:, None] - self.obstacle_x
+            dy = y[:, None] - self.obstacle_y
+            dist = np.sqrt(dx * dx + dy * dy)
+            reach = self.obstacle_r + self.radius
+            inside = dist < reach
+            if inside.any():
+                # push back onto the obstacle surface
+                scale = np.where(inside, reach / np.maximum(dist, 1e-9), 1.0)
+                x = self.obstacle_x + dx * scale
+                y = self.obstacle_y + dy * scale
+                nearest = inside.argmax(axis=1)
+                blocked = inside.any(axis=1)
+                x = np.where(blocked, x[np.arange(self.n_envs), nearest], self.x + sin_h * step)
+                y = np.where(blocked, y[np.arange(self.n_envs), nearest], self.y + cos_h * step)
+                np.clip(x, low_x, high_x, out=x)
+                np.clip(y, low_y, high_y, out=y)
+                wall |= blocked
+
+            self.distance += np.hypot(x - self.x, y - self.y)
+            self.x, self.y = x, y
+            impact = wall & (np.abs(self.velocity) > self.min_impact_speed)
+            hits += impact
+            # stop_roll() on every detected collision
+            stopped |= impact
+            self.velocity[wall] = 0.0
+
+        self.collisions += hits
+        self.elapsed += (self.move_steps + self.pause_steps) * self.dt
+        return hits
+
+
+def train_patrol_policy(policy, arena, decisions, max_collisions=5, episode_seconds=60.0):
+    """Q-learning on every arena at once, episodes end like PATROL does
+    (max_collisions -> ANGRY, or the patrol timeout)"""
+    arena.reset()
+    states = policy.encode(np.zeros(arena.n_envs), False, 0)
+    episodes = 0
+    collisions = 0
+    distance = 0.0
+    seconds = 0.0
+    for _ in range(decisions):
+        actions = policy.choose(states)
+        hits = arena.step(policy.headings[actions], policy.speeds[actions])
+        next_states = policy.encode(policy.headings[actions], hits > 0, arena.collisions)
+        done = (arena.collisions >= max_collisions) | (arena.elapsed >= episode_seconds)
+        policy.update(states, actions, policy.reward(actions, hits), next_states, done)
+
+        episodes += int(done.sum())
+        collisions += int(hits.sum())
+        seconds += (arena.move_steps + arena.pause_steps) * arena.dt * arena.n_envs
+        distance += float(arena.distance[done].sum())
+        arena.reset(done)
+        states = np.where(done, policy.encode(0, False, 0), next_states)
+    return {
+        'episodes': episodes,
+        'collisions_per_minute': 60.0 * collisions / seconds,
+        'metres_per_episode': distance / episodes if episodes else 0.0
+    }
+
+
+# Offline patrol training: python3 Sphero_Sim.py [--save [learned.bin]]
+if __name__ == "__main__":
+    import sys
+    import time
+    from Sphero_Policy import PatrolQPolicy
+
+    envs = 4096
+    decisions = 400
+
+    # the old behaviour: always explore (forward biased random choice)
+    baseline = PatrolQPolicy(epsilon=1.0, seed=0)
+    report = train_patrol_policy(baseline, PatrolArena(envs, seed=0), 50)
+    print(f"random patrol:  {report['collisions_per_minute']:.2f} collisions/min, "
+          f"{report['metres_per_episode']:.1f} m/episode")
+
+    policy = PatrolQPolicy(seed=0)
+    arena = PatrolArena(envs, seed=1)
+    start = time.perf_counter()
+    report = train_patrol_policy(policy, arena, decisions)
+    elapsed = time.perf_counter() - start
+    print(f"training:       {report['episodes']} episodes in {elapsed:.1f}s "
+          f"({report['episodes'] / elapsed:.0f} episodes/s, {decisions * envs / elapsed:.0f} decisions/s)")
+
+    policy.epsilon = 0.05
+    report = train_patrol_policy(policy, PatrolArena(envs, seed=2), 50)
+    print(f"learned patrol: {report['collisions_per_minute']:.2f} collisions/min, "
+          f"{report['metres_per_episode']:.1f} m/episode")
+
+    if "--save" in sys.argv:
+        from Sphero_Persist import LearnedStateStore, DEFAULT_PATH
+        index = sys.argv.index("--save") + 1
+        path = sys.argv[index] if index < len(sys.argv) else DEFAULT_PATH
+        # the robot starts from this table; its own counters and history stay
+        store = LearnedStateStore(path, *policy.q_table.shape)
+        state = store.load() or {'counters': {}, 'history': []}
+        store.checkpoint(policy.q_table, state['counters'], state['history'])
+        store.close()
+        print(f"Saved trained table to {path}")
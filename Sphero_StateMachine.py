@@ -1,12 +1,24 @@
+import sys
 import time
-import threading
-import random
+from collections import deque
 from pynput import keyboard
 from spherov2 import scanner
 from spherov2.sphero_edu import SpheroEduAPI
 from spherov2.types import Color
 from Sphero_Pattern import SpheroPattern
 from Sphero_Voice import SpheroVoiceRecognition
+from Sphero_FSM import StateMachineEngine, EventLoop, BehaviourTask, ANY
+from Sphero_IMU import IMUService
+from Sphero_Gesture import GestureDetector, HANDLED_GESTURES, channels_for
+from Sphero_Collision import CollisionDetector, COLLISION_CHANNELS
+from Sphero_Policy import PatrolQPolicy
+from Sphero_Persist import LearnedStateStore, DEFAULT_PATH
+
+
+STATES = ["SLEEP", "PATROL", "ANGRY", "INTERACT", "SATISFIED"]
+
+# states with a shake transition, the only ones that need the sensor poll
+SENSOR_STATES = {"SLEEP", "ANGRY"}
 
 
 class SpheroStateMachine:
@@ -19,42 +31,132 @@ class SpheroStateMachine:
         self.voice = SpheroVoiceRecognition()
         
         # state
-        self.current_state = "SLEEP"
         self.is_running = True
         self.should_stop = False
+        self.cleaned_up = False
         
         # timers
-        self.state_start_time = time.time()
         self.patrol_duration = 60
         self.angry_duration = 30
+        self.state_timeouts = {
+            "PATROL": self.patrol_duration,
+            "ANGRY": self.angry_duration,
+            "INTERACT": 30,
+            "SATISFIED": 20,
+        }
         
         # collisions
         self.collision_count = 0
         self.max_collisions = 5
         
         # q-learning
-        self.q_table = {}
         self.learning_rate = 0.1
         self.discount_factor = 0.9
         self.epsilon = 0.3
+        self.policy = PatrolQPolicy(learning_rate=self.learning_rate,
+                                    discount_factor=self.discount_factor,
+                                    epsilon=self.epsilon)
+        self.q_table = self.policy.q_table
+        # (state, action, collision_count) of the move in progress
+        self._last_patrol = None
+        self.patrol_heading = 0
+        
+        # learned state kept across restarts (opened on connect)
+        self.store = None
+        self.store_path = DEFAULT_PATH
+        self.total_collisions = 0
+        self.patrol_episodes = 0
+        self.collision_history = deque(maxlen=256)
         
         # keyboard
         self.keyboard_listener = None
         
+        # voice commands (phrase -> state)
+        self.voice_commands = {
+            "go to sleep": "SLEEP",
+            "patrol": "PATROL",
+            "come here": "INTERACT",
+            "good boy": "SATISFIED",
+        }
+        
+        # shared IMU sampler and the gestures read from it (started on connect)
+        self.imu = None
+        self.gestures = None
+        
         # shake detect
         self.last_orientation = None
         self.shake_threshold = 0.3
+        # picking the robot up satisfies it as much as shaking it
+        self.shake_gestures = HANDLED_GESTURES
         
-        # alt collision
+        # alt collision: accelerometer detector, drives on_collision_detected
+        # when the firmware detector is unavailable, shadows it otherwise
         self.last_speed = 0
-        self.speed_change_threshold = 20
-        self.collision_check_interval = 0.1
-        self.last_collision_check = 0
-        
-        # breathing led
-        self.breathing_thread = None
-        self.breathing_active = False
-        
+        self.firmware_collision = False
+        self.soft_collision = None
+        
+        # state behaviour (patrol / angry / breathing), one at a time
+        self.behaviour = BehaviourTask(stop_timeout=0.5)
+        
+        # transition table
+        self.engine = StateMachineEngine(STATES, "SLEEP")
+        self._build_transitions()
+        
+        # events from every thread + deadline timers, one loop thread
+        self.events = EventLoop()
+        self.sensor_interval = 0.1
+        self._timeout_timer = None
+        self._sensor_timer = None
+        self.engine.listeners.append(self._on_state_changed)
+    
+    def _build_transitions(self):
+        """(state, event, guard) -> state, plus enter/exit behaviour"""
+        engine = self.engine
+        
+        # keys
+        engine.add(["INTERACT", "SATISFIED"], "key_r", "PATROL")
+        engine.add(["PATROL", "ANGRY", "SATISFIED"], "key_s", "INTERACT")
+        engine.add("INTERACT", "key_q", "SLEEP")
+        
+        # voice
+        for state in STATES:
+            engine.add(state, "your_fault", "ANGRY")
+        for state in dict.fromkeys(self.voice_commands.values()):
+            engine.add(ANY, "voice_" + state.lower(), state)
+        
+        # sensors
+        engine.add("PATROL", "collision", "ANGRY", guard=self._too_many_collisions)
+        engine.add(["SLEEP", "ANGRY"], "shake", "SATISFIED")
+        
+        # timeouts
+        for state in self.state_timeouts:
+            engine.add(state, "timeout", "SLEEP", guard=self._state_timed_out)
+        
+        # behaviour
+        engine.on_enter("SLEEP", self._enter_sleep)
+        engine.on_enter("PATROL", self._enter_patrol)
+        engine.on_enter("ANGRY", self._enter_angry)
+        engine.on_enter("INTERACT", self._enter_interact)
+        engine.on_enter("SATISFIED", self._enter_satisfied)
+        engine.on_exit("PATROL", self._stop_moving)
+        engine.on_exit("ANGRY", self._stop_moving)
+        engine.on_exit("SLEEP", self._exit_breathing)
+        engine.on_exit("SATISFIED", self._exit_breathing)
+    
+    @property
+    def current_state(self):
+        return self.engine.state
+    
+    @property
+    def state_start_time(self):
+        return self.engine.entered_at
+    
+    def _too_many_collisions(self, data):
+        return self.collision_count >= self.max_collisions
+    
+    def _state_timed_out(self, data):
+        return self.engine.elapsed() >= self.state_timeouts[self.current_state]
+    
     def connect(self):
         """connect"""
         try:
@@ -70,6 +172,12 @@ class SpheroStateMachine:
             # collision on
             self.setup_collision_detection()
             
+            # q-table and counters from the last run
+            self.load_learned()
+            
+            # one sampler for every orientation / motion reader
+            self.attach_imu()
+            
             time.sleep(1)
             print(f"Connected: {self.toy.name}")
             return True
@@ -77,46 +185,70 @@ class SpheroStateMachine:
             print(f"Connect failed: {e}")
             return False
     
+    def attach_imu(self):
+        """IMU sampler plus the gesture and collision detectors reading it"""
+        self.imu = IMUService(self.api, channels=('orientation', 'accelerometer', 'gyroscope', 'velocity'))
+        self.gestures = GestureDetector(rate_hz=self.imu.rate_hz)
+        self.gestures.attach(self.imu)
+        self.soft_collision = CollisionDetector(rate_hz=self.imu.rate_hz)
+        self.soft_collision.attach(self.imu, lambda: self.last_speed)
+        self.soft_collision.on_collision(self._on_soft_collision)
+        # idle until a state selects what it reads
+        self.imu.select(())
+        self.start_imu()
+    
+    def start_imu(self):
+        """sampler thread"""
+        self.imu.start()
+    
     def setup_collision_detection(self):
         """collision setup"""
         try:
             # enable
             self.api.enable_collision_detection()
             # callback
-            self.api.on_collision = self.on_collision_detected
+            self.api.on_collision = self._on_firmware_collision
+            self.firmware_collision = True
             print("Collision on")
         except Exception as e:
             print(f"Collision setup failed: {e}")
             print("use fallback")
     
+    def _on_firmware_collision(self, collision_data):
+        if self.soft_collision:
+            self.soft_collision.firmware_event()
+        self.on_collision_detected(collision_data)
+    
+    def _on_soft_collision(self, collision_data):
+        # IMU thread: with the firmware detector on, only compared against it;
+        # otherwise the loop thread reacts, the sampler must not block on BLE
+        if not self.firmware_collision:
+            self.events.post("soft_collision", collision_data)
+    
     def on_collision_detected(self, collision_data):
         """on collision"""
+        self.last_speed = 0
         self.collision_count += 1
+        self.total_collisions += 1
         print(f"Collision! count={self.collision_count}")
         
-        # stop
-        self.api.stop_roll()
-        
-        # led red
-        self.api.set_main_led(Color(255, 0, 0))
+        # stop, led red
+        self._collision_stop()
         
-        # threshold
-        if self.current_state == "PATROL" and self.collision_count >= self.max_collisions:
-            self.transition_to_state("ANGRY")
-        else:
-            # delay
-            time.sleep(0.5)
-            self.api.set_main_led(Color(255, 255, 255))
+        # threshold (decided on the loop thread)
+        self.events.post("collision")
     
-    def check_collision_alternative(self):
-        """disabled"""
-        # disabled
-        return False
+    def _collision_stop(self):
+        self.api.stop_roll()
+        self.api.set_main_led(Color(255, 0, 0))
     
     def detect_shake(self):
         """shake detect"""
+        if self.gestures:
+            # windowed detector runs on every IMU sample, this only collects
+            return self.gestures.take(*self.shake_gestures)
         try:
-            orient = self.api.get_orientation()
+            orient = self.imu.latest('orientation') if self.imu else self.api.get_orientation()
             if not orient:
                 return False
             
@@ -140,197 +272,240 @@ class SpheroStateMachine:
     
     def start_breathing_effect(self, color, duration=0.5):
         """breathing led"""
-        if self.breathing_active:
-            return
-        
-        self.breathing_active = True
-        
-        def breathing_loop():
-            while self.breathing_active:
-                try:
-                    # fade in
-                    for brightness in range(0, 255, 10):
-                        if not self.breathing_active:
-                            break
-                        led_color = Color(
-                            int(color[0] * brightness / 255),
-                            int(color[1] * brightness / 255),
-                            int(color[2] * brightness / 255)
-                        )
-                        self.api.set_front_led(led_color)
-                        self.api.set_back_led(led_color)
-                        time.sleep(duration / 50)
-                    
-                    # fade out
-                    for brightness in range(255, 0, -10):
-                        if not self.breathing_active:
-                            break
-                        led_color = Color(
-                            int(color[0] * brightness / 255),
-                            int(color[1] * brightness / 255),
-                            int(color[2] * brightness / 255)
-                        )
-                        self.api.set_front_led(led_color)
-                        self.api.set_back_led(led_color)
-                        time.sleep(duration / 50)
-                except Exception as e:
-                    print(f"呼吸灯效果错误: {e}")
-                    break
-        
-        self.breathing_thread = threading.Thread(target=breathing_loop, daemon=True)
-        self.breathing_thread.start()
+        self.behaviour.start("breathing", self._breathing_loop, color, duration)
+    
+    def _breathing_loop(self, token, color, duration):
+        levels = list(range(0, 255, 10)) + list(range(255, 0, -10))
+        while not token.cancelled:
+            try:
+                # fade in, fade out
+                for brightness in levels:
+                    if token.cancelled:
+                        break
+                    led_color = Color(
+                        int(color[0] * brightness / 255),
+                        int(color[1] * brightness / 255),
+                        int(color[2] * brightness / 255)
+                    )
+                    self.api.set_front_led(led_color)
+                    self.api.set_back_led(led_color)
+                    token.wait(duration / 50)
+            except Exception as e:
+                print(f"呼吸灯效果错误: {e}")
+                break
     
     def stop_breathing_effect(self):
         """stop breathing"""
-        self.breathing_active = False
-        if self.breathing_thread:
-            self.breathing_thread.join(timeout=1)
+        self.behaviour.stop()
     
     def transition_to_state(self, new_state):
-        """switch state"""
-        print(f"State: {self.current_state} -> {new_state}")
-        
-        # stop current
-        self.stop_current_state_behavior()
-        
-        # set state
-        self.current_state = new_state
-        self.state_start_time = time.time()
-        
-        # reset vars
-        if new_state == "PATROL":
-            self.collision_count = 0
-        
-        # start state
-        self.start_state_behavior()
+        """switch state (unconditional, serialized with table events)"""
+        self.engine.force(new_state)
     
     def stop_current_state_behavior(self):
         """stop state"""
-        if not self.api:
-            return
-            
-        if self.current_state == "PATROL":
-            self.api.set_speed(0)
-        elif self.current_state == "ANGRY":
-            self.api.set_speed(0)
-        elif self.current_state in ["SLEEP", "SATISFIED"]:
-            self.stop_breathing_effect()
+        handler = self.engine.exit_handlers.get(self.current_state)
+        if handler:
+            handler(self.current_state)
     
     def start_state_behavior(self):
         """start state"""
+        handler = self.engine.enter_handlers.get(self.current_state)
+        if handler:
+            handler(self.current_state)
+    
+    def _stop_moving(self, state):
+        # behaviour first, so it cannot send another move after the stop
+        self.behaviour.stop()
+        self.last_speed = 0
+        if self.api:
+            self.api.set_speed(0)
+        if state == "PATROL":
+            self.end_patrol_episode()
+    
+    def _exit_breathing(self, state):
+        if self.api:
+            self.stop_breathing_effect()
+    
+    def _enter_sleep(self, state):
         if not self.api:
             return
-            
-        if self.current_state == "PATROL":
-            self.patterns.show_expression(self.api, "wave")
-            self.start_patrol()
-        elif self.current_state == "SLEEP":
-            self.patterns.show_expression(self.api, "sleep")
-            self.start_breathing_effect((255, 255, 255), 1.0)
-        elif self.current_state == "ANGRY":
-            self.patterns.show_expression(self.api, "angry")
-            self.start_angry_behavior()
-        elif self.current_state == "INTERACT":
-            self.api.set_speed(0)
-            self.patterns.show_expression(self.api, "ishmael")
-        elif self.current_state == "SATISFIED":
-            self.api.set_speed(0)
-            self.patterns.show_expression(self.api, "satisfied")
-            self.start_breathing_effect((220, 80, 0), 0.8)
+        self.patterns.show_expression(self.api, "sleep")
+        self.start_breathing_effect((255, 255, 255), 1.0)
+    
+    def _enter_patrol(self, state):
+        # reset vars
+        self.collision_count = 0
+        self._last_patrol = None
+        if not self.api:
+            return
+        self.patterns.show_expression(self.api, "wave")
+        self.start_patrol()
+    
+    def _enter_angry(self, state):
+        if not self.api:
+            return
+        self.patterns.show_expression(self.api, "angry")
+        self.start_angry_behavior()
+    
+    def _enter_interact(self, state):
+        if not self.api:
+            return
+        self.api.set_speed(0)
+        self.patterns.show_expression(self.api, "ishmael")
+    
+    def _enter_satisfied(self, state):
+        if not self.api:
+            return
+        self.api.set_speed(0)
+        self.patterns.show_expression(self.api, "satisfied")
+        self.start_breathing_effect((220, 80, 0), 0.8)
     
     def start_patrol(self):
         """start patrol"""
-        def patrol_loop():
-            while self.current_state == "PATROL" and self.is_running and not self.should_stop:
-                try:
-                    # choose action
-                    action = self.choose_patrol_action()
-                    self.execute_patrol_action(action)
-                    # wait finish
-                    time.sleep(2.5)
-                except Exception as e:
-                    print(f"Patrol error: {e}")
-                    time.sleep(0.5)
-        
-        patrol_thread = threading.Thread(target=patrol_loop, daemon=True)
-        patrol_thread.start()
+        self.behaviour.start("patrol", self._patrol_loop)
+    
+    def _patrol_loop(self, token):
+        while not token.cancelled and self.is_running and not self.should_stop:
+            try:
+                # choose action
+                action = self.choose_patrol_action()
+                self.execute_patrol_action(action, token)
+                # wait finish
+                token.wait(2.5)
+            except Exception as e:
+                print(f"Patrol error: {e}")
+                token.wait(0.5)
+    
+    def patrol_state(self):
+        """heading of the last move, whether it hit something, collisions so far"""
+        collided = False
+        if self._last_patrol is not None:
+            collided = self.collision_count > self._last_patrol[2]
+        return int(self.policy.encode(self.patrol_heading, collided, self.collision_count))
     
     def choose_patrol_action(self):
-        """pick action"""
-        actions = [
-            (0, 40),
-            (0, 40),
-            (0, 40),
-            (45, 30),
-            (315, 30),
-            (90, 25),
-            (270, 25),
-            (135, 20),
-            (225, 20),
-            (180, 15),
-        ]
-        
-        # bias forward
-        if random.random() < 0.7:
-            # forward set
-            forward_actions = [action for action in actions if action[0] == 0]
-            return random.choice(forward_actions)
-        else:
-            # others
-            other_actions = [action for action in actions if action[0] != 0]
-            return random.choice(other_actions)
+        """pick action (epsilon-greedy on the Q-table, learns from the last move)"""
+        state = self.patrol_state()
+        if self._last_patrol is not None:
+            last_state, last_action, collisions_before = self._last_patrol
+            reward = self.policy.reward(last_action, self.collision_count - collisions_before)
+            self.policy.update(last_state, last_action, reward, state)
+        
+        action = int(self.policy.choose(state))
+        self._last_patrol = (state, action, self.collision_count)
+        heading, speed = self.policy.actions[action]
+        self.patrol_heading = heading
+        return heading, speed
+    
+    def end_patrol_episode(self):
+        """credit the last move when patrol ends (no next state), then checkpoint"""
+        if self._last_patrol is not None:
+            last_state, last_action, collisions_before = self._last_patrol
+            reward = self.policy.reward(last_action, self.collision_count - collisions_before)
+            self.policy.update(last_state, last_action, reward, last_state, done=True)
+            self._last_patrol = None
+        
+        self.patrol_episodes += 1
+        self.collision_history.append(self.collision_count)
+        if self.store:
+            self.store.request_checkpoint()
+    
+    def learned_snapshot(self):
+        """what the store persists: (q_table, counters, collision history)"""
+        counters = {
+            'updates': self.policy.updates,
+            'decisions': self.policy.decisions,
+            'episodes': self.patrol_episodes,
+            'collisions': self.total_collisions
+        }
+        return self.q_table, counters, list(self.collision_history)
+    
+    def load_learned(self):
+        """map the learned-state file, restore it and checkpoint in the background"""
+        try:
+            self.store = LearnedStateStore(self.store_path, *self.q_table.shape,
+                                           history=self.collision_history.maxlen)
+            state = self.store.load()
+            if state:
+                # in place: policy and q_table share the array
+                self.q_table[:] = state['q_table']
+                self.policy.updates = state['counters']['updates']
+                self.policy.decisions = state['counters']['decisions']
+                self.patrol_episodes = state['counters']['episodes']
+                self.total_collisions = state['counters']['collisions']
+                self.collision_history.extend(state['history'])
+                print(f"Learned state restored: {self.patrol_episodes} patrols, "
+                      f"{self.policy.updates} updates (checkpoint {state['generation']})")
+            self.start_checkpoints()
+        except Exception as e:
+            print(f"Learned state unavailable: {e}")
+            self.store = None
     
-    def execute_patrol_action(self, action):
+    def start_checkpoints(self):
+        """checkpoint thread"""
+        self.store.start(self.learned_snapshot)
+    
+    def execute_patrol_action(self, action, token=None):
         """exec action"""
         heading, speed = action
         try:
             # longer move
             duration = 2.0
-            self.api.roll(heading, speed, duration)
+            # the collision detector only judges commanded moves
+            self.last_speed = speed
+            if token is None:
+                self.api.roll(heading, speed, duration)
+                self.last_speed = 0
+                return
+            # roll() blocks for the whole move; this one stops on cancel
+            self.api.set_heading(heading)
+            self.api.set_speed(speed)
+            token.wait(duration)
+            self.api.set_speed(0)
+            self.last_speed = 0
         except Exception as e:
+            self.last_speed = 0
             print(f"Action error: {e}")
     
     def start_angry_behavior(self):
         """angry spin"""
-        def angry_loop():
-            while self.current_state == "ANGRY" and self.is_running and not self.should_stop:
-                try:
-                    # spin
-                    self.api.spin(360, 2)
-                    time.sleep(0.5)
-                except Exception as e:
-                    print(f"Angry error: {e}")
-                    time.sleep(0.5)
-        
-        angry_thread = threading.Thread(target=angry_loop, daemon=True)
-        angry_thread.start()
+        self.behaviour.start("angry", self._angry_loop)
+    
+    def _angry_loop(self, token):
+        while not token.cancelled and self.is_running and not self.should_stop:
+            try:
+                # spin
+                self.spin(token, 360, 2)
+                token.wait(0.5)
+            except Exception as e:
+                print(f"Angry error: {e}")
+                token.wait(0.5)
+    
+    def spin(self, token, angle, duration, steps=20):
+        """api.spin() in small heading steps, stops on cancel"""
+        start = self.api.get_heading()
+        for step in range(1, steps + 1):
+            if token.wait(duration / steps):
+                return
+            self.api.set_heading(int(start + angle * step / steps) % 360)
     
     def on_key_press(self, key):
         """key input"""
         try:
             if key == keyboard.Key.esc:
                 print("ESC stop...")
-                self.should_stop = True
-                self.is_running = False
+                self.stop()
                 return False
             
             elif hasattr(key, 'char') and key.char:
-                if key.char.lower() == 'r':
-                    if self.current_state in ["INTERACT", "SATISFIED"]:
-                        self.transition_to_state("PATROL")
-                
-                elif key.char.lower() == 's':
-                    if self.current_state in ["PATROL", "ANGRY", "SATISFIED"]:
-                        self.transition_to_state("INTERACT")
+                char = key.char.lower()
+                if char in "rsq":
+                    self.events.post("key_" + char)
                 
-                elif key.char.lower() == 'q':
-                    if self.current_state == "INTERACT":
-                        self.transition_to_state("SLEEP")
-                
-                elif key.char.lower() == 'x':
+                elif char == 'x':
                     print("X stop...")
-                    self.should_stop = True
-                    self.is_running = False
+                    self.stop()
                     return False
         
         except AttributeError:
@@ -339,41 +514,75 @@ class SpheroStateMachine:
     def on_voice_detected(self):
         """voice hit"""
         print("Voice: your fault")
-        self.transition_to_state("ANGRY")
-    
-    def check_state_transitions(self):
-        """tick"""
-        current_time = time.time()
-        state_duration = current_time - self.state_start_time
-        
-        # patrol check
-        if self.current_state == "PATROL":
-            # patrol timeout
-            if state_duration >= self.patrol_duration:
-                self.transition_to_state("SLEEP")
-            
-            # alt collision
-            self.check_collision_alternative()
-        
-        elif self.current_state == "ANGRY":
-            # angry timeout
-            if state_duration >= self.angry_duration:
-                self.transition_to_state("SLEEP")
-        
-        elif self.current_state == "INTERACT":
-            # interact timeout
-            if state_duration >= 30:
-                self.transition_to_state("SLEEP")
-        
-        elif self.current_state == "SATISFIED":
-            # satisfy timeout
-            if state_duration >= 20:
-                self.transition_to_state("SLEEP")
-        
+        self.events.post("your_fault")
+    
+    def on_voice_command(self, phrase, state):
+        """voice command"""
+        print(f"Voice: {phrase}")
+        self.events.post("voice_" + state.lower())
+    
+    def stop(self):
+        self.should_stop = True
+        self.is_running = False
+        self.events.stop()
+    
+    def _on_state_changed(self, source, event, target):
+        self._arm_state_timers(target)
+    
+    def _arm_state_timers(self, state):
+        """state timeout as a deadline, sensor poll only where it is used"""
+        if self._timeout_timer:
+            self._timeout_timer.cancel()
+            self._timeout_timer = None
+        if state in self.state_timeouts:
+            self._timeout_timer = self.events.call_later(self.state_timeouts[state], "timeout")
+        
+        if state in SENSOR_STATES:
+            if self._sensor_timer is None:
+                # a stale sample would look like a shake
+                self.last_orientation = None
+                if self.gestures:
+                    self.gestures.clear()
+                self._sensor_timer = self.start_sensor_poll()
+        elif self._sensor_timer:
+            self._sensor_timer.cancel()
+            self._sensor_timer = None
+        
+        if self.imu:
+            self.imu.select(self.imu_channels(state))
+    
+    def imu_channels(self, state):
+        """IMU channels a state reads: shake gestures, or the collision detector while patrolling"""
+        if state in SENSOR_STATES:
+            return channels_for(*self.shake_gestures)
+        if state == "PATROL":
+            return COLLISION_CHANNELS
+        return ()
+    
+    def start_sensor_poll(self):
+        """periodic "sensors" event; returns a handle with cancel()"""
+        return self.events.call_every(self.sensor_interval, "sensors")
+    
+    def poll_sensors(self):
+        """periodic sensor read (only armed in SENSOR_STATES); collisions arrive as events"""
         # shake
         if self.detect_shake():
-            if self.current_state in ["SLEEP", "ANGRY"]:
-                self.transition_to_state("SATISFIED")
+            self.engine.fire("shake")
+    
+    def handle_event(self, event, data=None):
+        """loop thread: every input ends up here"""
+        if event == "sensors":
+            self.poll_sensors()
+        elif event == "soft_collision":
+            self.on_collision_detected(data)
+        elif event == "collision":
+            if not self.engine.fire("collision") and self.api:
+                # back to white after a short flash
+                self.events.call_later(0.5, "collision_flash_done")
+        elif event == "collision_flash_done":
+            self.api.set_main_led(Color(255, 255, 255))
+        else:
+            self.engine.fire(event, data)
     
     def run(self):
         """run"""
@@ -388,32 +597,56 @@ class SpheroStateMachine:
         print("  ESC - quit")
         print("  shake - satisfy")
         print("  voice 'your fault' - angry")
+        for phrase, state in self.voice_commands.items():
+            print(f"  voice '{phrase}' - {state.lower()}")
         print("="*60)
         
         # voice on
+        for phrase, state in self.voice_commands.items():
+            self.voice.register_phrase(
+                phrase, lambda phrase=phrase, state=state: self.on_voice_command(phrase, state))
         self.voice.start_listening(callback=self.on_voice_detected)
         
         # keys on
         self.keyboard_listener = keyboard.Listener(on_press=self.on_key_press)
         self.keyboard_listener.start()
         
-        # start state
-        self.start_state_behavior()
-        
         try:
-            # loop
-            while self.is_running and not self.should_stop:
-                self.check_state_transitions()
-                time.sleep(0.1)
+            self.serve()
         
         except KeyboardInterrupt:
             print("\nInterrupted")
         finally:
             self.cleanup()
     
+    def serve(self):
+        """start the current state and dispatch events until stop()"""
+        # start state
+        self.start_state_behavior()
+        self._arm_state_timers(self.current_state)
+        
+        # sleeps until an event or a deadline, no polling tick
+        self.events.run(self.handle_event)
+    
     def cleanup(self):
-        """cleanup"""
+        """cleanup (once: run() and main() both call it)"""
+        if self.cleaned_up:
+            return
+        self.cleaned_up = True
         print("Cleaning up...")
+        self.events.stop()
+        
+        stats = self.events.stats()
+        if stats['reaction']['count']:
+            print(f"Event reaction: mean {stats['reaction']['mean_ms']:.2f}ms, "
+                  f"max {stats['reaction']['max_ms']:.2f}ms; {stats['wakeups_per_second']:.1f} wakeups/s")
+        
+        if self.soft_collision and self.firmware_collision:
+            report = self.soft_collision.compare()
+            if report['firmware']:
+                latency = f", latency {report['latency_mean_ms']:+.0f}ms" if report['matched'] else ""
+                print(f"Accelerometer vs firmware collisions: {report['matched']}/{report['firmware']} matched, "
+                      f"{report['extra']} extra{latency}")
         
         # stop all
         if self.api:
@@ -422,6 +655,15 @@ class SpheroStateMachine:
             except Exception as e:
                 print(f"Stop error: {e}")
         
+        # sampler off
+        if self.imu:
+            self.imu.stop()
+        
+        # last checkpoint
+        if self.store:
+            self.store.close()
+            self.store = None
+        
         # voice off
         if self.voice:
             self.voice.stop_listening()
@@ -468,6 +710,10 @@ def main():
     """main"""
     state_machine = SpheroStateMachine()
     
+    if "--table" in sys.argv:
+        print(state_machine.engine.dump())
+        return
+    
     if state_machine.connect():
         try:
             state_machine.run()
@@ -0,0 +1,216 @@
+import sys
+import time
+import numpy as np
+
+
+class NoiseFloorTracker:
+    """Running noise floor, O(1) per frame: falls fast, rises slowly
+
+    Quiet frames pull the floor down within fall_seconds; speech (or a new
+    fan / motor) only lifts it over rise_seconds, so short phrases barely
+    move it while a lasting change in the background is followed.
+    """
+
+    def __init__(self, ratio=2.5, rise_seconds=4.0, fall_seconds=0.25,
+                 min_threshold=0.002, max_threshold=0.2):
+        self.ratio = ratio
+        self.rise_seconds = rise_seconds
+        self.fall_seconds = fall_seconds
+        self.min_threshold = min_threshold
+        self.max_threshold = max_threshold
+        self.floor = None
+        self.threshold = min_threshold
+        self.frames = 0
+        self._alphas = {}
+
+    def _alpha(self, seconds):
+        # one entry per frame length in practice
+        alphas = self._alphas.get(seconds)
+        if alphas is None:
+            alphas = (1.0 - np.exp(-seconds / self.rise_seconds),
+                      1.0 - np.exp(-seconds / self.fall_seconds))
+            self._alphas[seconds] = alphas
+        return alphas
+
+    def update(self, energy, seconds=0.02):
+        """Add one frame's RMS (0..1 scale), returns the speech threshold"""
+        self.frames += 1
+        if self.floor is None:
+            self.floor = energy
+        else:
+            rise, fall = self._alpha(seconds)
+            self.floor += (rise if energy > self.floor else fall) * (energy - self.floor)
+        self.threshold = min(self.max_threshold, max(self.min_threshold, self.floor * self.ratio))
+        return self.threshold
+
+
+class EnergyVAD:
+    """Streaming energy VAD on short frames"""
+
+    def __init__(self, rate=16000, frame_ms=20, threshold=0.01,
+                 start_frames=3, hangover_frames=10, preroll_frames=5, noise=None):
+        """noise: a NoiseFloorTracker that moves threshold on every frame"""
+        self.rate = rate
+        self.frame_len = int(rate * frame_ms / 1000)
+        self.threshold = threshold
+        self.noise = noise
+        self.start_frames = start_frames
+        self.hangover_frames = hangover_frames
+        self.preroll_frames = preroll_frames
+        self.reset()
+
+    def reset(self):
+        self._leftover = np.zeros(0, dtype=np.float32)
+        self._frames = []
+        self._in_speech = False
+        self._voiced_run = 0
+        self._silent_run = 0
+        self.frames_seen = 0
+        self.speech_frames = 0
+
+    def frame_energies(self, samples):
+        """RMS per full frame (vectorised over the chunk)"""
+        n = len(samples) // self.frame_len
+        frames = samples[:n * self.frame_len].reshape(n, self.frame_len)
+        return frames, np.sqrt(np.einsum("ij,ij->i", frames, frames) / self.frame_len)
+
+    def is_speech(self, energy):
+        return energy > self.threshold
+
+    def process(self, samples):
+        """Feed float32 audio, returns finished speech segments"""
+        samples = np.concatenate((self._leftover, np.asarray(samples, dtype=np.float32)))
+        frames, energies = self.frame_energies(samples)
+        self._leftover = samples[len(frames) * self.frame_len:]
+
+        segments = []
+        for frame, energy in zip(frames, energies):
+            was_speech = self._in_speech
+            event = self.step(energy)
+
+            if not was_speech:
+                # keep a short pre-roll so onsets are not clipped
+                self._frames.append(frame)
+                if len(self._frames) > self.preroll_frames + self.start_frames:
+                    self._frames.pop(0)
+                continue
+
+            self._frames.append(frame)
+            if event == "end":
+                # enough silence: close the segment
+                segments.append(np.concatenate(self._frames))
+                self._frames = []
+        return segments
+
+    def step(self, energy):
+        """One frame of the start/hangover state machine: "start", "end" or None
+
+        Lets callers that keep the audio themselves (ring buffer) segment
+        by frame index without handing samples over.
+        """
+        self.frames_seen += 1
+        if self.noise is not None:
+            self.threshold = self.noise.update(energy, self.frame_len / self.rate)
+        voiced = self.is_speech(energy)
+
+        if not self._in_speech:
+            self._voiced_run = self._voiced_run + 1 if voiced else 0
+            if self._voiced_run >= self.start_frames:
+                self._in_speech = True
+                self._silent_run = 0
+                return "start"
+            return None
+
+        self.speech_frames += 1
+        if voiced:
+            self._silent_run = 0
+            return None
+        self._silent_run += 1
+        if self._silent_run >= self.hangover_frames:
+            self._in_speech = False
+            self._voiced_run = 0
+            return "end"
+        return None
+
+    @property
+    def in_speech(self):
+        return self._in_speech
+
+    def flush(self):
+        """Close an open segment at end of stream"""
+        segment = None
+        if self._in_speech and self._frames:
+            segment = np.concatenate(self._frames)
+        self.reset()
+        return segment
+
+    def trim(self, samples, min_frames=None):
+        """Speech part of a whole utterance, None with fewer than min_frames
+        (default start_frames) voiced frames"""
+        frames, energies = self.frame_energies(np.asarray(samples, dtype=np.float32))
+        if self.noise is not None:
+            seconds = self.frame_len / self.rate
+            voiced = np.array([energy > self.noise.update(energy, seconds) for energy in energies], dtype=bool)
+            self.threshold = self.noise.threshold
+        else:
+            voiced = energies > self.threshold
+        if voiced.sum() < (self.start_frames if min_frames is None else min_frames):
+            return None
+        index = np.flatnonzero(voiced)
+        first = max(0, index[0] - self.preroll_frames)
+        last = min(len(frames), index[-1] + 1 + self.hangover_frames)
+        return frames[first:last].reshape(-1)
+
+
+def benchmark(samples, recognizer, rate=16000, block_seconds=1.0, vad=None):
+    """Recognizer calls and CPU time with and without the VAD gate"""
+    vad = vad or EnergyVAD(rate=rate)
+    block = int(rate * block_seconds)
+    blocks = [samples[i:i + block] for i in range(0, len(samples) - block + 1, block)]
+    minutes = len(samples) / rate / 60.0
+
+    report = {}
+    for gated in (False, True):
+        calls = 0
+        cpu_start = time.thread_time()
+        for chunk in blocks:
+            if gated:
+                chunk = vad.trim(chunk)
+                if chunk is None:
+                    continue
+            recognizer(chunk)
+            calls += 1
+        cpu = time.thread_time() - cpu_start
+        report["gated" if gated else "ungated"] = {
+            'calls': calls,
+            'calls_per_minute': calls / minutes if minutes else 0.0,
+            'cpu_seconds': cpu,
+            'cpu_percent': 100.0 * cpu / (minutes * 60.0) if minutes else 0.0
+        }
+    return report
+
+
+# Gate benchmark on a recording
+if __name__ == "__main__":
+    from Sphero_Keyword import KeywordSpotter, load_wav, KEYWORD_MODEL_PATH
+
+    if len(sys.argv) < 2:
+        print("Usage: python3 Sphero_VAD.py recording.wav [threshold | adaptive]")
+        sys.exit(1)
+
+    samples = load_wav(sys.argv[1])
+    mode = sys.argv[2] if len(sys.argv) > 2 else "0.01"
+    if mode == "adaptive":
+        vad = EnergyVAD(noise=NoiseFloorTracker())
+    else:
+        vad = EnergyVAD(threshold=float(mode))
+    try:
+        spotter = KeywordSpotter.load(KEYWORD_MODEL_PATH)
+    except (OSError, ValueError) as e:
+        print(f"No usable keyword model ({e}), run Sphero_Keyword.py enroll first")
+        sys.exit(1)
+
+    report = benchmark(samples, spotter.detect, vad=vad)
+    for name, stats in report.items():
+        print(f"{name:8s} calls={stats['calls']} ({stats['calls_per_minute']:.1f}/min), "
+              f"cpu={stats['cpu_seconds']:.3f}s ({stats['cpu_percent']:.2f}%)")
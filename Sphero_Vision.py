@@ -1,16 +1,62 @@
 import cv2
+import json
 import numpy as np
+import os
+import sys
 import threading
 import time
 
 
+# Written by Sphero_Calibrate.py
+HSV_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hsv_config.json")
+
+# Capture candidates tried by probe_camera()
+CAPTURE_CANDIDATES = [
+    {'fourcc': 'MJPG', 'fps': 60, 'buffer_size': 1},
+    {'fourcc': 'MJPG', 'fps': 30, 'buffer_size': 1},
+    {'fourcc': 'YUYV', 'fps': 30, 'buffer_size': 1},
+    {'fourcc': None, 'fps': None, 'buffer_size': None},
+]
+
+# CAP_PROP_AUTO_EXPOSURE "manual" differs per backend (V4L2 menu index 1,
+# DirectShow/MSMF 0.25); tried in order, the first one that reads back wins
+MANUAL_EXPOSURE_VALUES = {
+    'V4L2': (1, 0.25),
+    'DSHOW': (0.25, 1),
+    'MSMF': (0.25, 1),
+}
+DEFAULT_MANUAL_EXPOSURE_VALUES = (1, 0.25)
+
+
+def fourcc_to_str(value):
+    """Decode CAP_PROP_FOURCC"""
+    value = int(value)
+    if value <= 0:
+        return None
+    return "".join(chr((value >> (8 * i)) & 0xFF) for i in range(4))
+
+
 class SpheroVision:
     """Vision controller"""
     
-    def __init__(self, camera_index=0):
+    def __init__(self, camera_index=0, capture_settings=None, hsv_config=HSV_CONFIG_PATH,
+                 hist_tracking=False):
         self.camera = None
         self.camera_index = camera_index
         
+        # Capture settings (fourcc, fps, buffer_size, exposure_lock, exposure)
+        self.capture_settings = {
+            'fourcc': 'MJPG',
+            'fps': 30,
+            'buffer_size': 1,
+            'exposure_lock': False,
+            'exposure': None
+        }
+        if capture_settings:
+            self.capture_settings.update(capture_settings)
+        self.negotiated = {}
+        self.exposure_locked = None
+        
         # Red HSV range
         self.lower_red1 = np.array([0, 150, 100])
         self.upper_red1 = np.array([10, 255, 255])
@@ -21,25 +67,62 @@ class SpheroVision:
         self.lower_green = np.array([40, 100, 100])
         self.upper_green = np.array([80, 255, 255])
         
+        # Calibrated ranges override the defaults
+        if hsv_config and os.path.exists(hsv_config):
+            self.load_hsv_config(hsv_config)
+        
         # Detection parameters
         self.min_area = 500
         self.min_green_area = 200
         self.frame_width = 320
         self.frame_height = 240
         
+        # Histogram tracking (CamShift) once the target is acquired
+        self.hist_tracking = hist_tracking
+        self.target_hist = None
+        self.track_window = None
+        self.track_margin = 20
+        self.track_min_confidence = 0.25
+        self.track_criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 1)
+        
         # Current results
         self.last_result = None
         self.is_tracking = False
         self.tracking_thread = None
     
+    def load_hsv_config(self, path):
+        """Load thresholds from Sphero_Calibrate.py"""
+        try:
+            with open(path) as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"HSV config error: {e}")
+            return False
+        
+        red = config.get('red')
+        if red:
+            # One range when red does not wrap around hue 0
+            second = red[1] if len(red) > 1 else red[0]
+            self.lower_red1 = np.array(red[0][0])
+            self.upper_red1 = np.array(red[0][1])
+            self.lower_red2 = np.array(second[0])
+            self.upper_red2 = np.array(second[1])
+        
+        green = config.get('green')
+        if green:
+            self.lower_green = np.array(green[0][0])
+            self.upper_green = np.array(green[0][1])
+        
+        print(f"HSV config loaded ({path})")
+        return True
+    
     def initialize_camera(self):
         """Init camera"""
         try:
             self.camera = cv2.VideoCapture(self.camera_index)
             
-            # Set resolution
-            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.frame_width)
-            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.frame_height)
+            # Apply capture settings
+            self.apply_capture_settings(self.camera, self.capture_settings)
             
             # Test read
             ret, frame = self.camera.read()
@@ -47,13 +130,175 @@ class SpheroVision:
                 print("Camera init failed")
                 return False
             
-            print(f"Camera ready ({self.frame_width}x{self.frame_height})")
+            # What the driver actually gave us
+            self.negotiated = self.read_capture_settings(self.camera)
+            self.verify_capture_settings()
+            
+            print(f"Camera ready ({self.negotiated['width']}x{self.negotiated['height']}, "
+                  f"{self.negotiated['fourcc']}, {self.negotiated['fps']:.0f}fps)")
             return True
             
         except Exception as e:
             print(f"Camera error: {e}")
             return False
     
+    def apply_capture_settings(self, camera, settings):
+        """Push settings to the driver (fourcc must go before size)"""
+        if settings.get('fourcc'):
+            camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*settings['fourcc']))
+        
+        # Set resolution
+        camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.frame_width)
+        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.frame_height)
+        
+        if settings.get('fps'):
+            camera.set(cv2.CAP_PROP_FPS, settings['fps'])
+        if settings.get('buffer_size'):
+            camera.set(cv2.CAP_PROP_BUFFERSIZE, settings['buffer_size'])
+        
+        # Exposure lock, checked by reading it back
+        self.exposure_locked = None
+        if settings.get('exposure_lock'):
+            self.exposure_locked = self.lock_exposure(camera, settings.get('exposure'))
+    
+    def lock_exposure(self, camera, exposure=None):
+        """Switch to manual exposure; the value that read back, None if the backend ignored it"""
+        try:
+            backend = camera.getBackendName()
+        except (AttributeError, cv2.error):
+            backend = None
+        
+        locked = None
+        for value in MANUAL_EXPOSURE_VALUES.get(backend, DEFAULT_MANUAL_EXPOSURE_VALUES):
+            if camera.set(cv2.CAP_PROP_AUTO_EXPOSURE, value) and \
+                    abs(camera.get(cv2.CAP_PROP_AUTO_EXPOSURE) - value) < 1e-3:
+                locked = value
+                break
+        if locked is None:
+            return None
+        
+        if exposure is not None:
+            camera.set(cv2.CAP_PROP_EXPOSURE, exposure)
+        return locked
+    
+    def read_capture_settings(self, camera):
+        """Read back negotiated values"""
+        return {
+            'fourcc': fourcc_to_str(camera.get(cv2.CAP_PROP_FOURCC)),
+            'width': int(camera.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'fps': camera.get(cv2.CAP_PROP_FPS),
+            'buffer_size': int(camera.get(cv2.CAP_PROP_BUFFERSIZE)),
+            'auto_exposure': camera.get(cv2.CAP_PROP_AUTO_EXPOSURE),
+            'exposure': camera.get(cv2.CAP_PROP_EXPOSURE)
+        }
+    
+    def verify_capture_settings(self):
+        """Warn on every requested value the camera ignored"""
+        requested = self.capture_settings
+        actual = self.negotiated
+        mismatches = []
+        
+        if requested.get('fourcc') and actual['fourcc'] != requested['fourcc']:
+            mismatches.append(f"fourcc {requested['fourcc']} -> {actual['fourcc']}")
+        if (actual['width'], actual['height']) != (self.frame_width, self.frame_height):
+            mismatches.append(f"size {self.frame_width}x{self.frame_height} -> "
+                              f"{actual['width']}x{actual['height']}")
+        if requested.get('fps') and abs(actual['fps'] - requested['fps']) > 1:
+            mismatches.append(f"fps {requested['fps']} -> {actual['fps']:.1f}")
+        if requested.get('buffer_size') and actual['buffer_size'] != requested['buffer_size']:
+            mismatches.append(f"buffer {requested['buffer_size']} -> {actual['buffer_size']}")
+        if requested.get('exposure_lock'):
+            if self.exposure_locked is None or abs(actual['auto_exposure'] - self.exposure_locked) > 1e-3:
+                mismatches.append(f"exposure lock (auto exposure reads {actual['auto_exposure']})")
+            elif requested.get('exposure') is not None and abs(actual['exposure'] - requested['exposure']) > 1e-3:
+                mismatches.append(f"exposure {requested['exposure']} -> {actual['exposure']}")
+        
+        for mismatch in mismatches:
+            print(f"Camera ignored {mismatch}")
+        return not mismatches
+    
+    def measure_capture(self, camera, frames=60, idle=0.2):
+        """Delivered fps, stale buffered frames and an estimated latency of an open camera
+
+        The latency is not measured: frames carry no capture timestamp on
+        every backend, so it is estimated as the stale frames plus one live
+        frame, each one frame interval.
+        """
+        # Warm up
+        for _ in range(5):
+            camera.read()
+        
+        # Delivered fps
+        start = time.perf_counter()
+        count = 0
+        for _ in range(frames):
+            ret, _ = camera.read()
+            if ret:
+                count += 1
+        elapsed = time.perf_counter() - start
+        fps = count / elapsed if elapsed > 0 else 0.0
+        if fps <= 0:
+            return {'fps': 0.0, 'latency_estimate': float('inf'), 'stale_frames': 0}
+        interval = 1.0 / fps
+        
+        # Stale frames: after idling, buffered frames come back instantly
+        time.sleep(idle)
+        stale = 0
+        read_times = []
+        for _ in range(10):
+            t0 = time.perf_counter()
+            if not camera.grab():
+                break
+            dt = time.perf_counter() - t0
+            read_times.append(dt)
+            if dt < interval * 0.5:
+                stale += 1
+            else:
+                break
+        
+        # Estimate, not a measurement: queued frames plus one live frame
+        latency_estimate = stale * interval + interval
+        return {'fps': fps, 'latency_estimate': latency_estimate, 'stale_frames': stale}
+    
+    def probe_camera(self, candidates=None, frames=60):
+        """Try each capture config and keep the best one"""
+        candidates = candidates or CAPTURE_CANDIDATES
+        reports = []
+        
+        for settings in candidates:
+            camera = cv2.VideoCapture(self.camera_index)
+            if not camera.isOpened():
+                continue
+            try:
+                self.apply_capture_settings(camera, settings)
+                ret, _ = camera.read()
+                if not ret:
+                    continue
+                negotiated = self.read_capture_settings(camera)
+                stats = self.measure_capture(camera, frames=frames)
+                reports.append({'settings': settings, 'negotiated': negotiated, **stats})
+                print(f"Probe {settings}: {stats['fps']:.1f}fps, "
+                      f"estimated latency~{stats['latency_estimate']*1000:.0f}ms, "
+                      f"stale={stats['stale_frames']}")
+            finally:
+                camera.release()
+        
+        if not reports:
+            print("Probe failed: no working config")
+            return None, reports
+        
+        # Right size first, then fps, then estimated latency
+        def score(report):
+            size_ok = (report['negotiated']['width'], report['negotiated']['height']) == \
+                      (self.frame_width, self.frame_height)
+            return (size_ok, round(report['fps']), -report['latency_estimate'])
+        
+        best = max(reports, key=score)
+        self.capture_settings.update(best['settings'])
+        print(f"Best capture config: {best['settings']}")
+        return best, reports
+    
     def release_camera(self):
         """Release camera"""
         if self.camera:
@@ -86,55 +331,135 @@ class SpheroVision:
         
         return None, 0
     
+    def detect_red_contour(self, hsv):
+        """Full red detection: threshold, morphology, largest contour"""
+        # Red mask
+        mask1 = cv2.inRange(hsv, self.lower_red1, self.upper_red1)
+        mask2 = cv2.inRange(hsv, self.lower_red2, self.upper_red2)
+        mask = mask1 | mask2
+        
+        # Denoise
+        kernel = np.ones((5, 5), np.uint8)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+        
+        # Find contours
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        
+        if contours:
+            # Largest contour
+            largest = max(contours, key=cv2.contourArea)
+            area = cv2.contourArea(largest)
+            
+            if area > self.min_area:
+                # Center point
+                M = cv2.moments(largest)
+                if M['m00'] != 0:
+                    cx = int(M['m10'] / M['m00'])
+                    cy = int(M['m01'] / M['m00'])
+                    return largest, area, (cx, cy), mask
+        
+        return None, 0, None, mask
+    
+    def acquire_target(self, hsv, contour, mask):
+        """Build the hue histogram of a detected target"""
+        x, y, w, h = cv2.boundingRect(contour)
+        hist = cv2.calcHist([hsv[y:y+h, x:x+w]], [0], mask[y:y+h, x:x+w], [180], [0, 180])
+        cv2.normalize(hist, hist, 0, 255, cv2.NORM_MINMAX)
+        
+        self.target_hist = hist
+        self.track_window = (x, y, w, h)
+    
+    def reset_target_track(self):
+        """Drop the histogram, next frame runs full detection"""
+        self.target_hist = None
+        self.track_window = None
+    
+    def track_target(self, frame, hsv=None):
+        """Back-projection + CamShift inside a search window around the target"""
+        if self.target_hist is None:
+            return None
+        
+        # Search window around the last position
+        x, y, w, h = self.track_window
+        margin = max(w, h) // 2 + self.track_margin
+        frame_h, frame_w = frame.shape[:2]
+        x0, y0 = max(0, x - margin), max(0, y - margin)
+        x1, y1 = min(frame_w, x + w + margin), min(frame_h, y + h + margin)
+        
+        # Only convert the window when no full-frame HSV exists
+        if hsv is None:
+            roi = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2HSV)
+        else:
+            roi = hsv[y0:y1, x0:x1]
+        
+        # Back-projection, gated by the red saturation/value floor
+        back = cv2.calcBackProject([roi], [0], self.target_hist, [0, 180], 1)
+        gate = cv2.inRange(roi, (0, int(self.lower_red1[1]), int(self.lower_red1[2])), (180, 255, 255))
+        back &= gate
+        
+        window = (x - x0, y - y0, w, h)
+        rotated, (wx, wy, ww, wh) = cv2.CamShift(back, window, self.track_criteria)
+        
+        if ww <= 0 or wh <= 0:
+            self.reset_target_track()
+            return None
+        
+        # Confidence: how much of the window still looks like the target
+        patch = back[wy:wy+wh, wx:wx+ww]
+        confidence = float(patch.mean()) / 255.0
+        area = cv2.countNonZero(patch)
+        if confidence < self.track_min_confidence or area < self.min_area:
+            self.reset_target_track()
+            return None
+        
+        self.track_window = (wx + x0, wy + y0, ww, wh)
+        cx = int(rotated[0][0]) + x0
+        cy = int(rotated[0][1]) + y0
+        return {'position': (cx, cy), 'area': area, 'confidence': confidence}
+    
     def detect_sphero_and_target(self, show_preview=False):
         """Detect both objects"""
         if not self.camera:
             return {'sphero_found': False, 'target_found': False}
         
         ret, frame = self.camera.read()
+        capture_time = time.time()
         if not ret:
             return {'sphero_found': False, 'target_found': False}
         
+        return self.process_sphero_and_target(frame, capture_time, show_preview)
+    
+    def process_sphero_and_target(self, frame, capture_time=None, show_preview=False):
+        """Detect both objects in a given frame"""
+        if capture_time is None:
+            capture_time = time.time()
+        
         # BGR to HSV
         hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
         
         # Detect Sphero
         sphero_pos, sphero_area = self.detect_green_object(frame, hsv)
         
-        # Detect red target
-        mask_red1 = cv2.inRange(hsv, self.lower_red1, self.upper_red1)
-        mask_red2 = cv2.inRange(hsv, self.lower_red2, self.upper_red2)
-        mask_red = mask_red1 | mask_red2
-        
-        # Morphology ops
-        kernel = np.ones((5, 5), np.uint8)
-        mask_red = cv2.morphologyEx(mask_red, cv2.MORPH_OPEN, kernel)
-        mask_red = cv2.morphologyEx(mask_red, cv2.MORPH_CLOSE, kernel)
-        
-        # Find red contours
-        contours, _ = cv2.findContours(mask_red, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        target_pos = None
-        target_area = 0
-        
-        if contours:
-            largest = max(contours, key=cv2.contourArea)
-            area = cv2.contourArea(largest)
-            
-            if area > self.min_area:
-                M = cv2.moments(largest)
-                if M['m00'] != 0:
-                    cx = int(M['m10'] / M['m00'])
-                    cy = int(M['m01'] / M['m00'])
-                    target_pos = (cx, cy)
-                    target_area = area
+        # Follow the acquired target, full detection only when lost
+        tracked = self.track_target(frame, hsv) if self.hist_tracking else None
+        if tracked:
+            target_pos = tracked['position']
+            target_area = tracked['area']
+        else:
+            # Detect red target
+            largest, target_area, target_pos, mask_red = self.detect_red_contour(hsv)
+            if largest is not None and self.hist_tracking:
+                self.acquire_target(hsv, largest, mask_red)
         
         # Calculate positions
         result = {
             'sphero_found': sphero_pos is not None,
             'target_found': target_pos is not None,
             'sphero_pos': sphero_pos,
-            'target_pos': target_pos
+            'target_pos': target_pos,
+            'tracked': tracked is not None,
+            'timestamp': capture_time
         }
         
         if sphero_pos and target_pos:
@@ -187,61 +512,61 @@ class SpheroVision:
         if not ret:
             return {'found': False}
         
-        # HSV conversion
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        
-        # Red mask
-        mask1 = cv2.inRange(hsv, self.lower_red1, self.upper_red1)
-        mask2 = cv2.inRange(hsv, self.lower_red2, self.upper_red2)
-        mask = mask1 | mask2
-        
-        # Denoise
-        kernel = np.ones((5, 5), np.uint8)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-        
-        # Find contours
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return self.process_red_object(frame, show_preview)
+    
+    def process_red_object(self, frame, show_preview=False):
+        """Detect red in a given frame"""
+        largest_contour = None
+        mask = None
+        
+        # Tracking only converts the search window to HSV
+        tracked = self.track_target(frame) if self.hist_tracking else None
+        if tracked:
+            position = tracked['position']
+            area = tracked['area']
+        else:
+            # HSV conversion
+            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+            largest_contour, area, position, mask = self.detect_red_contour(hsv)
+            if largest_contour is not None and self.hist_tracking:
+                self.acquire_target(hsv, largest_contour, mask)
         
         result = {'found': False}
         
-        if contours:
-            # Largest contour
-            largest_contour = max(contours, key=cv2.contourArea)
-            area = cv2.contourArea(largest_contour)
+        if position:
+            cx, cy = position
             
-            if area > self.min_area:
-                # Center point
-                M = cv2.moments(largest_contour)
-                if M['m00'] != 0:
-                    cx = int(M['m10'] / M['m00'])
-                    cy = int(M['m01'] / M['m00'])
-                    
-                    # Center offset
-                    center_x = self.frame_width / 2
-                    offset = cx - center_x
-                    
-                    # Normalized angle
-                    angle_offset = offset / center_x
-                    
-                    result = {
-                        'found': True,
-                        'offset': offset,
-                        'area': area,
-                        'position': (cx, cy),
-                        'angle': angle_offset
-                    }
-                    
-                    # Draw preview
-                    if show_preview:
-                        cv2.drawContours(frame, [largest_contour], -1, (0, 255, 0), 2)
-                        cv2.circle(frame, (cx, cy), 5, (0, 255, 0), -1)
-                        cv2.line(frame, (int(center_x), 0), (int(center_x), self.frame_height), (255, 0, 0), 1)
+            # Center offset
+            center_x = self.frame_width / 2
+            offset = cx - center_x
+            
+            # Normalized angle
+            angle_offset = offset / center_x
+            
+            result = {
+                'found': True,
+                'offset': offset,
+                'area': area,
+                'position': (cx, cy),
+                'angle': angle_offset,
+                'tracked': tracked is not None
+            }
+            
+            # Draw preview
+            if show_preview:
+                if largest_contour is not None:
+                    cv2.drawContours(frame, [largest_contour], -1, (0, 255, 0), 2)
+                else:
+                    x, y, w, h = self.track_window
+                    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 255), 2)
+                cv2.circle(frame, (cx, cy), 5, (0, 255, 0), -1)
+                cv2.line(frame, (int(center_x), 0), (int(center_x), self.frame_height), (255, 0, 0), 1)
         
         # Show windows
         if show_preview:
             cv2.imshow('Red Detection', frame)
-            cv2.imshow('Mask', mask)
+            if mask is not None:
+                cv2.imshow('Mask', mask)
             cv2.waitKey(1)
         
         self.last_result = result
@@ -285,6 +610,10 @@ if __name__ == "__main__":
     
     vision = SpheroVision()
     
+    # Probe capture configs first
+    if "--probe" in sys.argv:
+        vision.probe_camera()
+    
     if not vision.initialize_camera():
         print("Camera failed")
         exit()
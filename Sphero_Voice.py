@@ -1,20 +1,410 @@
+import math
+import os
+import queue
+import sys
+import numpy as np
 import speech_recognition as sr
 import threading
 import time
+from collections import deque
+from Sphero_Keyword import (KeywordSpotter, StreamingPhraseDetector, KEYWORD_MODEL_PATH, SAMPLE_RATE,
+                            keyword_model_path, pcm16_to_float)
+from Sphero_VAD import EnergyVAD, NoiseFloorTracker
+from Sphero_Phrases import PhraseMatcher
+from Sphero_AudioSource import open_source, open_capture, RingCapture, MeteredStream
+from Sphero_Metrics import StageMetrics
+
+
+class UtteranceQueue:
+    """Bounded utterance queue
+
+    Live input drops the oldest entry when full (the speaker will not wait);
+    files and arrays block the producer instead, so nothing is lost.
+    Items count as unfinished from put() until the consumer's task_done().
+    """
+    
+    def __init__(self, maxsize=4, drop_oldest=True, on_drop=None):
+        self.items = deque()
+        self.maxsize = maxsize
+        self.drop_oldest = drop_oldest
+        self.on_drop = on_drop
+        self.cond = threading.Condition()
+        self.closed = False
+        self.unfinished = 0
+        
+        # metrics
+        self.dropped = 0
+        self.max_depth = 0
+        self.blocked = 0.0
+    
+    def put(self, item):
+        """False if the queue was closed while waiting for room"""
+        with self.cond:
+            if len(self.items) >= self.maxsize:
+                if self.drop_oldest:
+                    dropped = self.items.popleft()
+                    self.dropped += 1
+                    self.unfinished -= 1
+                    if self.on_drop:
+                        self.on_drop(dropped)
+                else:
+                    # backpressure: wait for a consumer
+                    start = time.perf_counter()
+                    while len(self.items) >= self.maxsize and not self.closed:
+                        self.cond.wait()
+                    self.blocked += time.perf_counter() - start
+                    if self.closed:
+                        return False
+            self.items.append(item)
+            self.unfinished += 1
+            self.max_depth = max(self.max_depth, len(self.items))
+            self.cond.notify_all()
+            return True
+    
+    def get(self, timeout=None):
+        """next item, None on timeout or close"""
+        with self.cond:
+            if not self.items and not self.closed:
+                self.cond.wait(timeout)
+            if not self.items:
+                return None
+            item = self.items.popleft()
+            # room for a blocked producer
+            self.cond.notify_all()
+            return item
+    
+    def task_done(self):
+        with self.cond:
+            self.unfinished -= 1
+            if not self.unfinished:
+                self.cond.notify_all()
+    
+    def join(self, timeout=None):
+        """True once every item put has been marked done"""
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.unfinished, timeout)
+    
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+    
+    def depth(self):
+        with self.cond:
+            return len(self.items)
+
+
+# per-utterance stage -> (start mark, end mark)
+VOICE_STAGES = {
+    'speech': ('capture_start', 'speech_end'),
+    'endpoint': ('speech_end', 'captured'),
+    'queue': ('captured', 'recognize_start'),
+    'recognize': ('recognize_start', 'recognize_end'),
+    'match': ('recognize_end', 'matched'),
+    'dispatch': ('matched', 'callback_done'),
+    'total': ('speech_end', 'callback_done')
+}
+
+
+class VoiceEventDispatcher:
+    """Runs phrase callbacks on its own thread, with dedup of repeats"""
+    
+    def __init__(self, phrases, dedup_window=1.5, on_done=None):
+        self.phrases = phrases
+        # called with each finished event (latency accounting)
+        self.on_done = on_done
+        self.dedup_window = dedup_window
+        self.events = queue.Queue()
+        self.is_running = False
+        self.thread = None
+        
+        # last accepted time per phrase
+        self.last_accepted = {}
+        self._lock = threading.Lock()
+        self.history = deque(maxlen=50)
+        self.deduplicated = 0
+    
+    def post(self, phrase, text=None, detected_at=None, marks=None):
+        """Queue an event; never blocks the caller. False if deduplicated"""
+        now = detected_at if detected_at is not None else time.time()
+        with self._lock:
+            last = self.last_accepted.get(phrase)
+            if last is not None and abs(now - last) < self.dedup_window:
+                self.deduplicated += 1
+                return False
+            self.last_accepted[phrase] = now
+        self.events.put({'phrase': phrase, 'text': text, 'detected_at': now, 'marks': marks})
+        return True
+    
+    def _run(self):
+        while self.is_running:
+            try:
+                event = self.events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            
+            event['dispatched_at'] = time.time()
+            for callback in list(self.phrases.callbacks.get(event['phrase'], [])):
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"Voice callback error ({event['phrase']}): {e}")
+            event['completed_at'] = time.time()
+            self.history.append(event)
+            if self.on_done:
+                self.on_done(event)
+            self.events.task_done()
+    
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        self.is_running = False
+        if self.thread:
+            self.thread.join(timeout=2)
 
 
 class SpheroVoiceRecognition:
     
-    def __init__(self):
+    def __init__(self, backend=None, keyword_model=KEYWORD_MODEL_PATH, vad_gate=True, streaming=False,
+                 recognizer_workers=2, queue_size=4, source=None, realtime=False, capture="listen",
+                 adaptive_threshold=True):
+        """
+        Args:
+            backend: "google" (cloud) or "keyword" (offline spotter),
+                     defaults to $SPHERO_VOICE_BACKEND or "google"
+            keyword_model: templates written by Sphero_Keyword.py enroll
+            vad_gate: only hand speech segments to the recognizer
+            streaming: sliding-window detection instead of phrase blocks
+                       (keyword backend only)
+            recognizer_workers: threads consuming captured utterances
+            queue_size: captured utterances kept while workers are busy
+            source: None / "mic" for the microphone, a WAV path, a NumPy
+                    buffer or any speech_recognition AudioSource
+            realtime: pace file/array sources at real time instead of
+                      as fast as possible
+            capture: "listen" (speech_recognition listen/AudioData) or
+                     "ring" (callback capture into a NumPy ring buffer,
+                     consumers get views of it)
+            adaptive_threshold: track the noise floor on every chunk instead
+                                of a blocking one second calibration
+        """
         self.recognizer = sr.Recognizer()
-        self.microphone = sr.Microphone()
+        
+        # audio source, opened on first use (no microphone needed for files)
+        self.source = source
+        self.realtime = realtime
+        self.microphone = None
+        self.capture = capture
+        self.source_done = threading.Event()
         
         self.is_listening = False
         self.listen_thread = None
         
+        # capture -> queue -> recognizer workers
+        self.recognizer_workers = recognizer_workers
+        self.queue_size = queue_size
+        self.utterances = None
+        self.worker_threads = []
+        
         self.target_phrase = "your fault"
         
         self.on_phrase_detected = None
+        
+        # phrase -> callback registry
+        self.phrases = PhraseMatcher()
+        self.phrases.add(self.target_phrase, self._on_target_phrase)
+        
+        # callbacks run here, never on the audio threads
+        self.dispatcher = VoiceEventDispatcher(self.phrases, on_done=self._on_event_done)
+        
+        # recognition backend
+        self.backend = backend or os.environ.get("SPHERO_VOICE_BACKEND", "google")
+        self.spotter = None
+        # keyword backend: one spotter per phrase that has templates
+        self.keyword_model = keyword_model
+        self.spotters = {}
+        if self.backend == "keyword":
+            self._setup_keyword_backend(keyword_model)
+        
+        # streaming mode
+        self.streaming = streaming
+        self.stream_detectors = []
+        if self.streaming and self.spotter is None:
+            print("Streaming needs the keyword backend, using phrase blocks")
+            self.streaming = False
+        
+        # vad gate: its own decision, stricter than the energy trigger that
+        # ended listen(), or it would pass every chunk listen() returns
+        self.vad_gate = vad_gate
+        self.vad = EnergyVAD(rate=SAMPLE_RATE)
+        self.gate_snr = 4.0
+        self.gate_min_frames = 10
+        
+        # energy threshold follows the background (fans, motors, people)
+        self.adaptive_threshold = adaptive_threshold
+        self.noise_floor = NoiseFloorTracker()
+        
+        # stats
+        self.stats = {
+            'utterances': 0,
+            'gated': 0,
+            'overwritten': 0,
+            'recognizer_calls': 0,
+            'recognizer_cpu': 0.0,
+            'started': time.time()
+        }
+        self._stats_lock = threading.Lock()
+        
+        # per-utterance stage latencies (wall clock marks)
+        self.metrics = StageMetrics(VOICE_STAGES)
+    
+    def _setup_keyword_backend(self, path):
+        """load local templates, fall back to google"""
+        try:
+            self.spotter = KeywordSpotter.load(path)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Keyword model unavailable ({e}), using google")
+            self.backend = "google"
+            return
+        
+        self.spotter.phrase = self.target_phrase
+        self.spotters[self.target_phrase] = self.spotter
+        # end the utterance soon after the phrase
+        self.recognizer.pause_threshold = 0.3
+        self.recognizer.non_speaking_duration = 0.2
+    
+    def register_phrase(self, phrase, callback):
+        """Call callback whenever phrase is recognized"""
+        self.phrases.add(phrase, callback)
+        if self.backend == "keyword" and phrase not in self.spotters:
+            self._load_phrase_spotter(phrase)
+    
+    def _load_phrase_spotter(self, phrase):
+        """the keyword backend only hears phrases it has templates for"""
+        path = keyword_model_path(phrase, self.keyword_model)
+        try:
+            spotter = KeywordSpotter.load(path)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"No keyword templates for '{phrase}' ({e}), "
+                  f"enroll with: python3 Sphero_Keyword.py enroll --phrase '{phrase}' clips...")
+            return
+        spotter.phrase = phrase
+        self.spotters[phrase] = spotter
+    
+    def _on_target_phrase(self):
+        print(f"It's all your fault Ishmael!")
+        
+        if self.on_phrase_detected:
+            self.on_phrase_detected()
+    
+    def _post_phrases(self, text, detected_at=None, marks=None):
+        """post one event per distinct phrase in text"""
+        posted = []
+        matches = self.phrases.match(text)
+        if marks is not None:
+            marks['matched'] = time.time()
+        for phrase, _, _ in matches:
+            if phrase in posted:
+                continue
+            posted.append(phrase)
+            # marks travel with the first accepted event only
+            if self.dispatcher.post(phrase, text, detected_at, marks):
+                marks = None
+        if marks is not None:
+            # nothing dispatched, the utterance ends here
+            self.metrics.record(marks)
+        return posted
+    
+    def _on_event_done(self, event):
+        """dispatcher thread: close the utterance's marks"""
+        marks = event.get('marks')
+        if marks is not None:
+            marks['callback_done'] = event['completed_at']
+            self.metrics.record(marks)
+    
+    def recognize(self, audio):
+        """audio (AudioData or float32 samples) -> text with the configured backend"""
+        if self.backend == "keyword":
+            if isinstance(audio, np.ndarray):
+                samples = audio
+            else:
+                samples = pcm16_to_float(audio.get_raw_data(convert_rate=SAMPLE_RATE, convert_width=2))
+            # best match: furthest below its own spotter's threshold
+            # (a difference, a threshold calibrated on identical templates is 0)
+            best, best_margin = None, None
+            for phrase, spotter in list(self.spotters.items()):
+                detected, score = spotter.detect(samples)
+                margin = score - spotter.threshold
+                if detected and (best is None or margin < best_margin):
+                    best, best_margin = phrase, margin
+            if best is None:
+                raise sr.UnknownValueError()
+            return best
+        
+        if isinstance(audio, np.ndarray):
+            audio = self._to_audio_data(audio)
+        return self.recognizer.recognize_google(audio, language='en-US')
+    
+    def _to_audio_data(self, samples):
+        """float32 samples -> 16-bit AudioData (the only copy for cloud backends)"""
+        pcm = np.clip(samples * 32768.0, -32768, 32767).astype(np.int16)
+        return sr.AudioData(pcm.tobytes(), SAMPLE_RATE, 2)
+    
+    def _timed_recognize(self, audio):
+        """recognize() with call and cpu accounting"""
+        cpu_start = time.thread_time()
+        try:
+            return self.recognize(audio)
+        finally:
+            with self._stats_lock:
+                self.stats['recognizer_calls'] += 1
+                self.stats['recognizer_cpu'] += time.thread_time() - cpu_start
+    
+    def _noise_floor(self):
+        """background RMS (0..1): the tracked floor, else the calibrated threshold backed out"""
+        if self.adaptive_threshold and self.noise_floor.floor is not None:
+            return self.noise_floor.floor
+        return self.recognizer.energy_threshold / 32768.0 / self.recognizer.dynamic_energy_ratio
+    
+    def _gate(self, audio):
+        """trimmed speech AudioData, None unless gate_min_frames frames are gate_snr above the noise floor"""
+        self.vad.threshold = max(self._noise_floor() * self.gate_snr, self.noise_floor.min_threshold)
+        
+        raw = audio.get_raw_data(convert_rate=SAMPLE_RATE, convert_width=2)
+        speech = self.vad.trim(pcm16_to_float(raw), min_frames=self.gate_min_frames)
+        if speech is None:
+            return None
+        return self._to_audio_data(speech)
+    
+    def get_stats(self):
+        """recognizer load since start"""
+        elapsed = max(time.time() - self.stats['started'], 1e-6)
+        minutes = elapsed / 60.0
+        return {
+            'utterances': self.stats['utterances'],
+            'gated': self.stats['gated'],
+            'overwritten': self.stats['overwritten'],
+            'gate_rejection': self.stats['gated'] / self.stats['utterances'] if self.stats['utterances'] else 0.0,
+            'recognizer_calls': self.stats['recognizer_calls'],
+            'calls_per_minute': self.stats['recognizer_calls'] / minutes,
+            'recognizer_cpu': self.stats['recognizer_cpu'],
+            'cpu_percent': 100.0 * self.stats['recognizer_cpu'] / elapsed,
+            'vad_gate': self.vad_gate,
+            'noise_floor': self.noise_floor.floor,
+            'energy_threshold': self.recognizer.energy_threshold,
+            'queue_depth': self.utterances.depth() if self.utterances else 0,
+            'queue_max_depth': self.utterances.max_depth if self.utterances else 0,
+            'queue_dropped': self.utterances.dropped if self.utterances else 0,
+            'queue_blocked': self.utterances.blocked if self.utterances else 0.0,
+            'events_deduplicated': self.dispatcher.deduplicated,
+            'capture': self.microphone.stats() if isinstance(self.microphone, RingCapture) else None,
+            'latency': self.metrics.summary()
+        }
     
     def start_listening(self, callback=None):
         """
@@ -27,56 +417,406 @@ class SpheroVoiceRecognition:
         
         self.on_phrase_detected = callback
         self.is_listening = True
+        self.stats['started'] = time.time()
+        self.source_done.clear()
+        self.dispatcher.start()
+        
+        # recognizer workers (phrase mode); only the microphone drops utterances
+        self.utterances = UtteranceQueue(self.queue_size, drop_oldest=self._source_is_live(),
+                                         on_drop=self._release_utterance)
+        self.worker_threads = []
+        if not self.streaming:
+            for _ in range(self.recognizer_workers):
+                worker = threading.Thread(target=self._recognize_worker, daemon=True)
+                worker.start()
+                self.worker_threads.append(worker)
         
         # start background thread
         self.listen_thread = threading.Thread(target=self._listen_loop, daemon=True)
         self.listen_thread.start()
         
-        print("Voice listening started (phrase: '{}')".format(self.target_phrase))
+        print("Voice listening started (phrase: '{}', backend: {})".format(self.target_phrase, self.backend))
     
     def stop_listening(self):
         """stop voice listening"""
         self.is_listening = False
+        if self.utterances:
+            self.utterances.close()
         if self.listen_thread:
             self.listen_thread.join(timeout=2)
-        print("Voice listening stopped")
+        for worker in self.worker_threads:
+            worker.join(timeout=2)
+        self.dispatcher.stop()
+        
+        stats = self.get_stats()
+        print(f"Voice listening stopped ({stats['recognizer_calls']} recognizer calls, "
+              f"{stats['calls_per_minute']:.1f}/min, {stats['gated']} gated "
+              f"({100 * stats['gate_rejection']:.0f}% of utterances), "
+              f"{stats['queue_dropped']} dropped, max queue {stats['queue_max_depth']}, "
+              f"cpu {stats['cpu_percent']:.1f}%)")
+        
+        for detector in self.stream_detectors:
+            report = detector.latency_report()
+            if report:
+                print(f"Trigger latency after '{detector.spotter.phrase}' ends: mean {report['mean']*1000:.0f}ms, "
+                      f"p95 {report['p95']*1000:.0f}ms ({report['triggers']} triggers)")
+        
+        self.metrics.print_summary("Voice latency per stage")
+    
+    def _release_utterance(self, item):
+        """ring segments hold their part of the ring until released"""
+        release = item[3]
+        if release is not None:
+            release()
+    
+    def _source_is_live(self):
+        """microphone (or any live AudioSource) vs file / array"""
+        source = self.microphone if self.microphone is not None else self.source
+        if source is None or (isinstance(source, str) and source == "mic"):
+            return True
+        if isinstance(source, (str, np.ndarray)):
+            return False
+        return getattr(source, 'live', True)
+    
+    def wait_until_done(self, timeout=None):
+        """block until a file/array source is consumed and all events ran"""
+        deadline = None if timeout is None else time.time() + timeout
+        
+        def remaining():
+            return None if deadline is None else max(0.0, deadline - time.time())
+        
+        if not self.source_done.wait(timeout):
+            return False
+        # queued and in-flight utterances are counted under the queue lock
+        if not self.utterances.join(remaining()):
+            return False
+        while self.dispatcher.events.unfinished_tasks:
+            if deadline is not None and time.time() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
     
     def _listen_loop(self):
         """background listening loop"""
-        # initialize microphone
-        with self.microphone as source:
-            print("🎤 Calibrating microphone...")
-            self.recognizer.adjust_for_ambient_noise(source, duration=1)
-            print("✅ Microphone ready\n")
+        try:
+            if self.capture == "ring":
+                self._ring_listen()
+                return
             
-            while self.is_listening:
-                try:
-                    # listen to audio (timeout 1 second)
-                    audio = self.recognizer.listen(source, timeout=1, phrase_time_limit=5)
-                    
-                    # recognize speech
-                    try:
-                        text = self.recognizer.recognize_google(audio, language='en-US')
-                        text_lower = text.lower()
-                        
-                        print(f"Recognized: {text}")
-                        
-                        if self.target_phrase in text_lower:
-                            print(f"It's all your fault Ishmael!")
-                            
-                            if self.on_phrase_detected:
-                                self.on_phrase_detected()
-                        
-                    except sr.UnknownValueError:
-                        pass
-                    except sr.RequestError as e:
-                        print(f"Speech recognition service error: {e}")
-                        time.sleep(1)
+            # streaming reads raw chunks, so capture at the spotter rate
+            if self.microphone is None:
+                self.microphone = open_source(self.source, SAMPLE_RATE if self.streaming else None, self.realtime)
+            
+            with self.microphone as source:
+                metered = source.SAMPLE_WIDTH == 2
+                if self.adaptive_threshold and metered:
+                    # no calibration pause: every chunk listen() reads moves the threshold
+                    self.recognizer.dynamic_energy_threshold = False
+                    source.stream = MeteredStream(source.stream, self._track_noise, source.SAMPLE_RATE)
+                else:
+                    if metered:
+                        # sample positions and read times for the latency marks
+                        source.stream = MeteredStream(source.stream, None, source.SAMPLE_RATE)
+                    if getattr(source, 'live', True):
+                        # files start from a fixed threshold, only live input is calibrated
+                        print("🎤 Calibrating microphone...")
+                        self.recognizer.adjust_for_ambient_noise(source, duration=1)
+                        print("✅ Microphone ready\n")
                 
-                except sr.WaitTimeoutError:
-                    continue
-                except Exception as e:
-                    print(f"Listening error: {e}")
-                    time.sleep(0.5)
+                if self.streaming:
+                    self._stream_loop(source)
+                else:
+                    self._capture_loop(source)
+        finally:
+            self.source_done.set()
+    
+    def _track_noise(self, energy, seconds):
+        """one chunk's RMS -> noise floor -> recognizer threshold"""
+        threshold = self.noise_floor.update(energy, seconds)
+        self.recognizer.energy_threshold = threshold * 32768.0
+        return threshold
+    
+    def _source_clock(self, source):
+        """wall time for live input, media time for files/arrays"""
+        if getattr(source, 'live', True):
+            return time.time()
+        return source.stream.position / source.SAMPLE_RATE
+    
+    def _capture_loop(self, source):
+        """capture only; recognition runs in the workers"""
+        while self.is_listening and not getattr(source, 'finished', False):
+            try:
+                # listen to audio (timeout 1 second)
+                audio = self.recognizer.listen(source, timeout=1, phrase_time_limit=5)
+                self.stats['utterances'] += 1
+                marks = self._capture_marks(audio, source)
+                
+                # drop chunks without speech before the recognizer
+                if self.vad_gate:
+                    audio = self._gate(audio)
+                    if audio is None:
+                        self.stats['gated'] += 1
+                        continue
+                
+                self.utterances.put((audio, self._source_clock(source), marks, None))
+                
+            except sr.WaitTimeoutError:
+                continue
+            except Exception as e:
+                print(f"Listening error: {e}")
+                time.sleep(0.5)
+    
+    def _capture_marks(self, audio, source):
+        """capture start / speech end from sample positions in the source stream"""
+        captured = time.time()
+        stream = source.stream
+        if not isinstance(stream, MeteredStream):
+            # no positions: assume listen() waited pause_threshold after the speech
+            duration = len(audio.frame_data) / (audio.sample_rate * audio.sample_width)
+            speech_end = captured - self.recognizer.pause_threshold
+            capture_start = speech_end + self.recognizer.non_speaking_duration - duration
+            return {'capture_start': capture_start, 'speech_end': speech_end, 'captured': captured}
+        
+        # listen() read up to `end`, kept non_speaking_duration of the
+        # silence after the last chunk above the threshold and dropped the rest
+        end = stream.position
+        length = len(audio.frame_data) // audio.sample_width
+        speech_end = stream.last_above(self.recognizer.energy_threshold / 32768.0, end - length - source.CHUNK)
+        if speech_end is None:
+            speech_end = end
+        kept = int(math.ceil(self.recognizer.non_speaking_duration * source.SAMPLE_RATE / source.CHUNK))
+        silent = (end - speech_end) // source.CHUNK
+        audio_end = end - max(0, silent - kept) * source.CHUNK
+        return {
+            'capture_start': stream.clock.time_of(max(0, audio_end - length)),
+            'speech_end': stream.clock.time_of(speech_end - 1),
+            'captured': captured
+        }
+    
+    def _recognize_worker(self):
+        """consume captured utterances"""
+        while self.is_listening:
+            item = self.utterances.get(timeout=0.5)
+            if item is None:
+                continue
+            audio, captured_at, marks, release = item
+            
+            # recognize speech
+            marks['recognize_start'] = time.time()
+            try:
+                text = self._timed_recognize(audio)
+                marks['recognize_end'] = time.time()
+                
+                if release is not None:
+                    intact, release = release(), None
+                    if not intact:
+                        # live input lapped the ring while the view was queued
+                        self.stats['overwritten'] += 1
+                        continue
+                
+                print(f"Recognized: {text}")
+                
+                # every registered phrase in one pass (live: time of the match)
+                live = getattr(self.microphone, 'live', True)
+                self._post_phrases(text, None if live else captured_at, marks)
+            
+            except sr.UnknownValueError:
+                marks['recognize_end'] = time.time()
+                self.metrics.record(marks)
+            except sr.RequestError as e:
+                print(f"Speech recognition service error: {e}")
+                time.sleep(1)
+            except Exception as e:
+                print(f"Recognition error: {e}")
+            finally:
+                if release is not None:
+                    release()
+                self.utterances.task_done()
+    
+    def _stream_loop(self, source):
+        """ring buffer + overlapping windows, fires as soon as the phrase ends"""
+        self.stream_detectors = [StreamingPhraseDetector(spotter) for spotter in self.spotters.values()]
+        
+        while self.is_listening and not getattr(source, 'finished', False):
+            try:
+                raw = source.stream.read(source.CHUNK)
+            except Exception as e:
+                print(f"Listening error: {e}")
+                time.sleep(0.5)
+                continue
+            
+            # the metered stream already updated the tracker
+            self._feed_detectors(pcm16_to_float(raw), self._source_clock(source),
+                                 self.noise_floor.threshold if self.adaptive_threshold else None)
+    
+    def _feed_detectors(self, samples, now, min_energy=None, end=None):
+        """one block to every phrase's sliding-window detector (end: ring index past the block)"""
+        for detector in self.stream_detectors:
+            if min_energy is not None:
+                detector.min_energy = min_energy
+            recognize_start = time.time()
+            for hit in detector.feed(samples, now, end):
+                self._on_stream_hit(hit, recognize_start)
+    
+    def _on_stream_hit(self, hit, recognize_start):
+        recognize_end = time.time()
+        print(f"Recognized: {hit['phrase']} ({hit['latency']*1000:.0f}ms after phrase end)")
+        # no capture/queue stages here: the chunk is recognized as read
+        marks = {
+            'speech_end': recognize_end - hit['latency'],
+            'recognize_start': recognize_start,
+            'recognize_end': recognize_end
+        }
+        self._post_phrases(hit['phrase'], hit['time'], marks)
     
+    def _ring_listen(self):
+        """callback capture into a ring buffer, consumers read views of it"""
+        if self.microphone is None:
+            self.microphone = open_capture(self.source, self.realtime)
+        capture = self.microphone
+        capture.start()
+        try:
+            if capture.live and not self.adaptive_threshold:
+                # one second of ambient audio, same rule as adjust_for_ambient_noise
+                print("🎤 Calibrating microphone...")
+                if capture.ring.wait(SAMPLE_RATE, timeout=2):
+                    ambient = capture.ring.latest(SAMPLE_RATE)
+                    rms = float(np.sqrt(np.dot(ambient, ambient) / len(ambient))) * 32768.0
+                    self.recognizer.energy_threshold = max(rms * self.recognizer.dynamic_energy_ratio, 50)
+                print("✅ Microphone ready\n")
+            
+            if self.streaming:
+                self._ring_stream_loop(capture)
+            else:
+                self._ring_segment_loop(capture)
+        finally:
+            capture.stop()
+    
+    def _ring_segment_loop(self, capture):
+        """VAD over ring frames by index; segments are handed on as views"""
+        ring = capture.ring
+        vad = self.vad
+        vad.reset()
+        vad.threshold = self.recognizer.energy_threshold / 32768.0
+        # the VAD updates the tracker itself, frame by frame
+        vad.noise = self.noise_floor if self.adaptive_threshold else None
+        frame = vad.frame_len
+        limit = 5 * SAMPLE_RATE
+        
+        # live: from now on; files: from their first sample
+        index = ring.total if capture.live else ring.oldest
+        segment_start = None
+        while self.is_listening:
+            ring.consumed = index
+            if not ring.wait(index + frame, timeout=0.5):
+                if capture.finished:
+                    break
+                continue
+            if index < ring.oldest:
+                # fell a whole ring behind, restart from the newest audio
+                print("Capture overrun, skipping ahead")
+                index = ring.total
+                vad.reset()
+                segment_start = None
+                continue
+            
+            while index + frame <= ring.total:
+                chunk = ring.view(index, index + frame)
+                event = vad.step(float(np.sqrt(np.dot(chunk, chunk) / frame)))
+                index += frame
+                
+                if event == "start":
+                    onset = index - (vad.start_frames + vad.preroll_frames) * frame
+                    segment_start = max(ring.oldest, onset)
+                elif segment_start is not None and (event == "end" or index - segment_start >= limit):
+                    if event != "end":
+                        # phrase time limit, like listen(phrase_time_limit=5)
+                        vad.reset()
+                    self._emit_segment(capture, segment_start, index)
+                    segment_start = None
+            
+            if vad.noise is not None:
+                self.recognizer.energy_threshold = vad.threshold * 32768.0
+        
+        # source ran out mid-phrase
+        if segment_start is not None and self.is_listening:
+            self._emit_segment(capture, segment_start, index)
+    
+    def _emit_segment(self, capture, start, end):
+        ring = capture.ring
+        audio = ring.view(start, end)
+        if audio is None:
+            return
+        self.stats['utterances'] += 1
+        
+        hangover = self.vad.hangover_frames * self.vad.frame_len
+        marks = {
+            'capture_start': ring.time_of(start),
+            'speech_end': ring.time_of(max(start, end - hangover)),
+            'captured': time.time()
+        }
+        captured_at = time.time() if capture.live else capture.media_time(end)
+        # the view stays valid while held: file sources wait, live input is checked on release
+        ring.hold(start)
+        if not self.utterances.put((audio, captured_at, marks, lambda: ring.release(start))):
+            ring.release(start)
+    
+    def _ring_stream_loop(self, capture):
+        """sliding windows straight over the capture ring"""
+        ring = capture.ring
+        self.stream_detectors = [StreamingPhraseDetector(spotter, ring=ring) for spotter in self.spotters.values()]
+        
+        # windows reach back this far behind the newest block
+        lookback = max((detector.window for detector in self.stream_detectors), default=0)
+        index = ring.total if capture.live else ring.oldest
+        while self.is_listening:
+            ring.consumed = max(0, index - lookback)
+            if not ring.wait(index + capture.chunk, timeout=0.5):
+                if capture.finished:
+                    break
+                continue
+            start, end = max(index, ring.oldest), ring.total
+            index = end
+            
+            # a file can land in the ring all at once: one chunk at a time, so the
+            # noise floor moves per chunk and triggers are stamped where they happened
+            for step in range(start, end, capture.chunk):
+                step_end = min(step + capture.chunk, end)
+                new = ring.view(step, step_end)
+                if new is None:
+                    continue
+                
+                min_energy = None
+                if self.adaptive_threshold:
+                    energy = float(np.sqrt(np.dot(new, new) / len(new))) if len(new) else 0.0
+                    min_energy = self._track_noise(energy, len(new) / SAMPLE_RATE)
+                
+                now = ring.time_of(step_end) if capture.live else capture.media_time(step_end)
+                self._feed_detectors(new, now, min_energy, step_end)
+
 
+# Offline run on a recording
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python3 Sphero_Voice.py clip.wav [--keyword] [--stream] [--realtime] [--ring]")
+        sys.exit(1)
+    
+    voice = SpheroVoiceRecognition(
+        backend="keyword" if "--keyword" in sys.argv else None,
+        streaming="--stream" in sys.argv,
+        source=sys.argv[1],
+        realtime="--realtime" in sys.argv,
+        capture="ring" if "--ring" in sys.argv else "listen"
+    )
+    
+    detections = []
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    voice.start_listening(callback=lambda: detections.append(time.perf_counter() - wall_start))
+    voice.wait_until_done()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    voice.stop_listening()
+    
+    print(f"Detections at: {[f'{t:.2f}s' for t in detections]}")
+    print(f"Wall {wall:.2f}s, process cpu {cpu:.2f}s")